@@ -0,0 +1,155 @@
+import numpy as np
+
+try:
+    from similarity import normalize_rows, gather_segments
+except ImportError:
+    from app.dataService.similarity import normalize_rows, gather_segments
+
+
+class IVFFlatIndex(object):
+    """
+    - approximate nearest-neighbor index (inverted file + flat scoring) for cosine similarity
+    - vectors are clustered with spherical k-means into `n_lists` lists; a query is only
+      scored against the vectors of its `n_probe` closest lists
+    - recall/latency trade-off: larger `n_probe` => higher recall, slower search
+      (`n_probe == n_lists` is exact search)
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, block_size=65536):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.block_size = block_size
+        self.centroids = None
+        self.vectors = None
+        self.ids = None
+        self.list_ids = None
+        self.list_offsets = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    def _assign(self, x):
+        # nearest centroid, in blocks to bound the (block * n_lists) score matrix
+        assign = np.zeros(len(x), dtype=np.int64)
+        for b in range(0, len(x), self.block_size):
+            assign[b:b + self.block_size] = np.argmax(x[b:b + self.block_size] @ self.centroids.T, axis=1)
+        return assign
+
+    def build(self, vectors, ids=None, n_iter=10, sample_size=100000, seed=0):
+        """
+        - INPUT:
+          - vectors: (n, dim) embeddings
+          - ids: (n,) non-negative int ids returned by searches (default: 0..n-1)
+          - n_iter: k-means iterations
+          - sample_size: max #vectors used to train the centroids
+        - OUTPUT:
+          - self
+        """
+        x = normalize_rows(vectors)
+        ids = np.arange(len(x), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        rng = np.random.RandomState(seed)
+        sample = x[rng.choice(len(x), min(sample_size, len(x)), replace=False)] if len(x) > 0 else x
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(x))))
+        n_lists = max(1, min(n_lists, len(sample)))
+        self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)] if len(sample) > 0 \
+            else np.zeros((1, x.shape[1]), dtype=np.float32)
+        for _ in range(n_iter if len(sample) > 0 else 0):
+            assign = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.where(np.bincount(assign, minlength=len(self.centroids)) == 0)[0]
+            # re-seed empty lists with random training vectors
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            self.centroids = normalize_rows(sums)
+        self.n_lists = len(self.centroids)
+        self.vectors = np.zeros((0, x.shape[1]), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.list_ids = np.zeros(0, dtype=np.int64)
+        self.add(x, ids)
+        return self
+
+    def add(self, vectors, ids):
+        """
+        - add vectors to the existing lists (centroids are not retrained)
+        """
+        x = normalize_rows(vectors).reshape(-1, self.centroids.shape[1])
+        vectors = np.concatenate([self.vectors, x])
+        ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        list_ids = np.concatenate([self.list_ids, self._assign(x)])
+        order = np.argsort(list_ids, kind="stable")
+        self.vectors = vectors[order]
+        self.ids = ids[order]
+        self.list_ids = list_ids[order]
+        self.list_offsets = np.searchsorted(self.list_ids, np.arange(self.n_lists + 1)).astype(np.int64)
+
+    def _candidates(self, q, n_probe, allowed):
+        lists = np.argsort(-(self.centroids @ q))[:n_probe]
+        pos, _ = gather_segments(self.list_offsets, lists)
+        if allowed is not None:
+            pos = pos[allowed[self.ids[pos]]]
+        return pos
+
+    def search(self, queries, k=10, n_probe=None, allowed=None):
+        """
+        - approximate top-k by cosine similarity
+        - INPUT:
+          - queries: (nq, dim) embeddings
+          - k: #neighbors
+          - n_probe: #lists scored per query (default: self.n_probe)
+          - allowed: optional boolean mask over ids; only allowed ids are returned
+        - OUTPUT:
+          - sims: (nq, k) similarities, -inf padded
+          - ids: (nq, k) ids, -1 padded
+        """
+        q = normalize_rows(np.atleast_2d(queries))
+        n_probe = n_probe or self.n_probe
+        sims = np.full((len(q), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(q), k), -1, dtype=np.int64)
+        for qi in range(len(q)):
+            pos = self._candidates(q[qi], n_probe, allowed)
+            if len(pos) == 0:
+                continue
+            s = self.vectors[pos] @ q[qi]
+            top = np.argpartition(-s, k - 1)[:k] if len(s) > k else np.arange(len(s))
+            top = top[np.argsort(-s[top])]
+            sims[qi, :len(top)] = s[top]
+            ids[qi, :len(top)] = self.ids[pos[top]]
+        return sims, ids
+
+    def range_search(self, queries, threshold, n_probe=None, allowed=None):
+        """
+        - approximate "all ids with cosine similarity > threshold"
+        - OUTPUT:
+          - list (one entry per query) of (ids, sims)
+        """
+        q = normalize_rows(np.atleast_2d(queries))
+        n_probe = n_probe or self.n_probe
+        results = []
+        for qi in range(len(q)):
+            pos = self._candidates(q[qi], n_probe, allowed)
+            s = self.vectors[pos] @ q[qi]
+            hit = s > threshold
+            results.append((self.ids[pos[hit]], s[hit]))
+        return results
+
+    def save(self, path, **meta):
+        np.savez(path, centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+                 list_ids=self.list_ids, n_probe=self.n_probe, **meta)
+
+    @classmethod
+    def load(cls, path):
+        """
+        - OUTPUT:
+          - (index, meta dict of the extra arrays passed to `save`)
+        """
+        data = np.load(path, allow_pickle=False)
+        index = cls(n_probe=int(data["n_probe"]))
+        index.centroids = data["centroids"]
+        index.n_lists = len(index.centroids)
+        index.vectors = data["vectors"]
+        index.ids = data["ids"]
+        index.list_ids = data["list_ids"]
+        index.list_offsets = np.searchsorted(index.list_ids, np.arange(index.n_lists + 1)).astype(np.int64)
+        meta = {k: data[k] for k in data.files
+                if k not in ("centroids", "vectors", "ids", "list_ids", "n_probe")}
+        return index, meta
@@ -0,0 +1,125 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from time import time
+
+import numpy as np
+
+try:
+    import globalVariable as GV
+except ImportError:
+    import app.dataService.globalVariable as GV
+
+
+class BatchEncoder(object):
+    """
+    - micro-batching façade in front of `model.encode`
+    - `submit` queues sentences and returns a `Future`; a background thread merges pending
+      requests (from any call site / thread) into one `model.encode` call, flushed when
+      `max_batch_size` sentences are pending or `max_delay` seconds after the oldest request
+    - with `max_delay=0` nothing waits: requests that arrive while a batch is being encoded
+      simply make up the next batch
+    - duplicate sentences within a batch are encoded once
+    - `encode` has the same contract as `SentenceTransformer.encode(..., convert_to_numpy=True)`,
+      so it can replace the model wherever only `encode` is used (e.g. `EmbeddingStore`)
+    """
+
+    def __init__(self, model, max_batch_size=GV.ENCODER_MAX_BATCH_SIZE, max_delay=GV.ENCODER_MAX_DELAY):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = deque()  # (sentences, future, single, submit time)
+        self._n_pending = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {"requests": 0, "sentences": 0, "batches": 0, "encoded": 0}
+        self._worker = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+        self._worker.start()
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def submit(self, sentences):
+        """
+        - INPUT:
+          - sentences: list of str or single str
+        - OUTPUT:
+          - Future of the float32 embeddings: (dim,) for a str, (n, dim) for a list
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else [str(s) for s in sentences]
+        future = Future()
+        if len(sentences) == 0:
+            future.set_result(np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32))
+            return future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchEncoder is closed")
+            self._pending.append((sentences, future, single, time()))
+            self._n_pending += len(sentences)
+            self.stats["requests"] += 1
+            self.stats["sentences"] += len(sentences)
+            self._cond.notify()
+        return future
+
+    def encode(self, sentences, **kwargs):
+        """
+        - blocking `submit` (extra `model.encode` keyword arguments are ignored: output is always numpy)
+        """
+        return self.submit(sentences).result()
+
+    def close(self):
+        """
+        - flush pending requests and stop the worker thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _take_batch(self):
+        # wait for a request, then for more until the batch is full or the oldest one is due
+        with self._cond:
+            while len(self._pending) == 0 and not self._closed:
+                self._cond.wait()
+            while len(self._pending) > 0 and self._n_pending < self.max_batch_size and not self._closed:
+                remaining = self._pending[0][3] + self.max_delay - time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            size = 0
+            while len(self._pending) > 0 and (len(batch) == 0 or size + len(self._pending[0][0]) <= self.max_batch_size):
+                request = self._pending.popleft()
+                batch.append(request)
+                size += len(request[0])
+            self._n_pending -= size
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if len(batch) == 0:
+                return  # closed and drained
+            texts = list(dict.fromkeys(s for sentences, _, _, _ in batch for s in sentences))
+            try:
+                vecs = np.asarray(self.model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            self.stats["batches"] += 1
+            self.stats["encoded"] += len(texts)
+            row = {s: i for i, s in enumerate(texts)}
+            for sentences, future, single, _ in batch:
+                out = vecs[[row[s] for s in sentences]]
+                future.set_result(out[0] if single else out)
+
+
+if __name__ == "__main__":
+    from sentence_transformers import SentenceTransformer
+
+    encoder = BatchEncoder(SentenceTransformer(GV.SENTENCE_MODEL_NAME))
+    futures = [encoder.submit(col) for col in GV.test_table_cols]
+    print([f.result().shape for f in futures], encoder.stats)
+    encoder.close()
@@ -3,7 +3,10 @@ import copy
 import time
 import json
 import os
+import queue
 import warnings
+import threading
+import functools
 
 import sqlite3
 import pandas as pd
@@ -11,6 +14,12 @@ import pandas as pd
 try:
     import globalVariable as GV
     import sqlParser as sp
+    from schemaRegistry import get_schema_registry
+    from text2sqlCache import Text2SQLCache, SemanticText2SQLCache
+    from text2sqlRetrieval import RetrievalText2SQL
+    from embeddingStore import EmbeddingStore
+    from modelRegistry import ModelRegistry
+    import modelWorkers
     import queryRec as qr
     from utils import helpers
     from utils.visRecos import vis_design_combos
@@ -20,6 +29,12 @@ try:
 except ImportError:
     import app.dataService.globalVariable as GV
     import app.dataService.sqlParser as sp
+    from app.dataService.schemaRegistry import get_schema_registry
+    from app.dataService.text2sqlCache import Text2SQLCache, SemanticText2SQLCache
+    from app.dataService.text2sqlRetrieval import RetrievalText2SQL
+    from app.dataService.embeddingStore import EmbeddingStore
+    from app.dataService.modelRegistry import ModelRegistry
+    import app.dataService.modelWorkers as modelWorkers
     import app.dataService.queryRec as qr
     from app.dataService.utils import helpers
     from app.dataService.utils.visRecos import vis_design_combos
@@ -29,69 +44,202 @@ except ImportError:
 
 
 class DataService(object):
+    # components `start_warmup` can load in the background
+    COMPONENTS = ("sql_parser", "sqlsugg", "text2sql", "sql2text")
+
     def __init__(self, dataset="spider"):
-        self.text2sql_model_loaded = False
-        self.sql_parser_loaded = False
-        self.sqlsugg_model_loaded = False
-        self.sql2text_model_loaded = False
+        # models are built on first use, once, and idle ones unloaded under memory pressure
+        self.models = ModelRegistry()
+        self._register_models()
+        # component => {"status": "pending"/"loading"/"warming"/"ready"/"failed", "seconds": ..., "error": ...}
+        self.warmup_status = {}
+        self._warmup_lock = threading.Lock()
         self.dataset = dataset
         self.global_variable = GV
         if self.dataset == "spider":
-            db_lists = []
-            db_meta_dict = {}
-            for db_meta in json.load(open(os.path.join(GV.SPIDER_FOLDER, "tables.json"), "r")):
-                db_lists.append(db_meta["db_id"])
-                db_meta_dict[db_meta["db_id"]] = db_meta
-            self.db_lists = db_lists
-            self.db_meta_dict = db_meta_dict
+            # tables.json is parsed once and shared with the sql parser and the recommender
+            self.schema_registry = get_schema_registry()
+            self.db_lists = self.schema_registry.db_lists
+            self.db_meta_dict = self.schema_registry.db_meta_dict
             self.db_id = ""
             self.cur_q = None
             self.h_q = {}
             self.table_cols = []
+            # (sql, db_id) appended to the recommender's reference corpus
+            self.reference_queries = set()
+            # queries waiting to be appended by the background thread (`queue_reference_queries`)
+            self._reference_queue = queue.Queue()
+            self._reference_thread = None
+            self._reference_lock = threading.Lock()
+            # text2sql results, kept across restarts
+            self.text2sql_cache = Text2SQLCache()
+            # paraphrases of cached utterances (`_load_semantic_cache`)
+            self.semantic_cache = None
+            # retrieval fast path of text2sql (`_load_text2sql_retrieval`)
+            self.text2sql_retrieval = None
         else:
             raise Exception("currently only support spider dataset")
         return
 
-    def _load_text2sql_model(self, verbose=True):
-        if self.text2sql_model_loaded:
-            return
-        if verbose:
-            print("=== begin loading text2sql model ===")
-        self.text2sql_model = sp.SmBop()
-        self.text2sql_model_loaded = True
-        if verbose:
-            print("=== finish loading text2sql model ===")
-    
-    def _load_sql2text_model(self, verbose=True):
-        if self.sql2text_model_loaded:
-            return
-        if verbose:
-            print("=== begin loading sql2text model ===")
-        self.sql2text_model = sp.SQL2NL()
-        self.sql2text_model_loaded = True
-        if verbose:
-            print("=== finish loading sql2text model ===")
-        return
+    def _register_models(self):
+        models = {
+            # name: (factory, evictable, label); the recommender is shared by the text2sql caches, so it stays
+            "sql_parser": (lambda: sp.SQLParser(self.schema_registry), False, "sql parser"),
+            "sqlsugg": (lambda: qr.queryRecommender(schema_registry=self.schema_registry,
+                                                    sentence_model=self._worker_model("sentence")), False,
+                        "sql suggestion model"),
+            "text2sql": (sp.SmBop, True, "text2sql model"),
+            "sql2text": (sp.SQL2NL, True, "sql2text model"),
+        }
+        for name, (factory, evictable, label) in models.items():
+            if GV.MODEL_WORKERS.get(name, 0) > 0:
+                # hosted by worker processes: nothing to unload in this process
+                factory, evictable = functools.partial(self._worker_model, name), False
+            self.models.register(name, self._verbose_factory(factory, label), evictable=evictable)
+
+    @staticmethod
+    def _worker_model(name):
+        """`name` hosted by `GV.MODEL_WORKERS[name]` worker processes, None if it runs in-process"""
+        n_workers = GV.MODEL_WORKERS.get(name, 0)
+        if n_workers <= 0:
+            return None
+        factories = {
+            "text2sql": modelWorkers.build_smbop,
+            "sql2text": modelWorkers.build_sql2nl,
+            "sentence": modelWorkers.build_sentence_model,
+        }
+        return modelWorkers.RemoteModel(modelWorkers.WorkerPool(factories[name], n_workers, name=name))
+
+    @staticmethod
+    def _verbose_factory(factory, label):
+        def load():
+            print("=== begin loading {} ===".format(label))
+            model = factory()
+            print("=== finish loading {} ===".format(label))
+            return model
+        return load
+
+    @property
+    def sql_parser(self):
+        return self.models.get("sql_parser")
+
+    @property
+    def sqlsugg_model(self):
+        return self.models.get("sqlsugg")
+
+    def _warmup_sample(self):
+        """(db_id, question, sql) of a small warm-up inference"""
+        db_id = GV.test_topic if GV.test_topic in self.db_meta_dict else self.db_lists[0]
+        db_meta = self.db_meta_dict[db_id]
+        question = "How many {} are there?".format(db_meta["table_names"][0])
+        sql = "SELECT count(*) FROM {}".format(db_meta["table_names_original"][0])
+        return db_id, question, sql
+
+    def _warmup(self, name):
+        """load component `name`, then run one inference to trigger its lazy allocations"""
+        db_id, question, sql = self._warmup_sample()
+        start = time.time()
+        try:
+            self._set_warmup_status(name, "loading")
+            with self.models.use(name) as model:
+                self._set_warmup_status(name, "warming")
+                if name == "sql_parser":
+                    model.parse_sql(sql, db_id)
+                elif name == "sqlsugg":
+                    db_state = model.get_db_state(db_id.replace("_", " ").strip(),
+                                                  self.schema_registry.get_db_cols(db_id))
+                    model.query_suggestion(db_state.db_df_bin, {"select": [], "groupby": [], "agg": []}, 0.6,
+                                           state=db_state)
+                elif name == "text2sql":
+                    model.predict(question, db_id)
+                elif name == "sql2text":
+                    model.sql2text(sql)
+            self._set_warmup_status(name, "ready", seconds=time.time() - start)
+        except Exception as e:
+            warnings.warn("warm-up of {} failed: {!r}".format(name, e))
+            self._set_warmup_status(name, "failed", seconds=time.time() - start, error=repr(e))
+
+    def _set_warmup_status(self, name, status, seconds=None, error=None):
+        with self._warmup_lock:
+            self.warmup_status[name] = {"status": status, "seconds": seconds, "error": error}
+
+    def start_warmup(self, components=GV.WARMUP_COMPONENTS):
+        """load `components` concurrently in background threads, each followed by a warm-up inference;
+        progress is reported by `readiness`"""
+        for name in components:
+            if name not in self.COMPONENTS:
+                raise ValueError("unknown component: {}".format(name))
+            with self._warmup_lock:
+                if self.warmup_status.get(name, {}).get("status") not in (None, "failed"):
+                    continue
+                self.warmup_status[name] = {"status": "pending", "seconds": None, "error": None}
+            threading.Thread(target=self._warmup, args=(name,), name="warmup-" + name, daemon=True).start()
+
+    def readiness(self):
+        """
+        per-component status; ready once every component has been loaded
+        - warmed-up components: "pending", "loading", "warming", "ready" or "failed"
+        - the others load on first use: "lazy" (not loaded yet, not ready), "loaded", or "unloaded"
+          (evicted by the memory budget after a successful load, reloaded on its next use)
+        - without a warm-up, the service is not ready before each component has served a request
+        """
+        with self._warmup_lock:
+            components = {name: dict(status) for name, status in self.warmup_status.items()}
+        for name in self.COMPONENTS:
+            if name not in components:
+                if self.models.is_loaded(name):
+                    status = "loaded"
+                elif self.models.was_loaded(name):
+                    status = "unloaded"
+                else:
+                    status = "lazy"
+                components[name] = {"status": status, "seconds": None, "error": None}
+        ready = all(c["status"] in ("ready", "loaded", "unloaded") for c in components.values())
+        return {"ready": ready, "components": components}
 
-    def _load_sql_parser(self, verbose=True):
-        if self.sql_parser_loaded:
-            return
-        if verbose:
-            print("=== begin loading sql parser ===")
-        self.sql_parser = sp.SQLParser()
-        self.sql_parser_loaded = True
-        if verbose:
-            print("=== finish loading sql parser ===")
-
-    def _load_sqlsugg_model(self, verbose=True):
-        if self.sqlsugg_model_loaded:
-            return
-        if verbose:
-            print("=== begin loading sql suggestion model ===")
-        self.sqlsugg_model = qr.queryRecommender()
-        self.sqlsugg_model_loaded = True
-        if verbose:
-            print("=== finish loading sql suggestion model ===")
+    def _load_semantic_cache(self):
+        """
+        the semantic text2sql cache, None if disabled; it shares the recommender's sentence model but
+        not its on-disk embedding cache, so utterances are never written there
+        """
+        if not GV.TEXT2SQL_SEMANTIC_CACHE:
+            return None
+        if self.semantic_cache is None:
+            self.semantic_cache = SemanticText2SQLCache(self.sqlsugg_model.encoder,
+                                                        seed=self.text2sql_cache.items)
+        return self.semantic_cache
+
+    def _load_text2sql_retrieval(self):
+        """
+        the retrieval fast path of text2sql, None if disabled; it shares the recommender's sentence model but
+        not its on-disk embedding cache: questions are never persisted, reference embeddings have their own store
+        """
+        if not GV.TEXT2SQL_RETRIEVAL:
+            return None
+        if self.text2sql_retrieval is None:
+            encoder = self.sqlsugg_model.encoder
+            self.text2sql_retrieval = RetrievalText2SQL(
+                encoder, schema_registry=self.schema_registry,
+                store=EmbeddingStore(encoder, GV.TEXT2SQL_RETRIEVAL_EMBEDDING_FOLDER))
+        return self.text2sql_retrieval
+
+    def _retrieved_sql(self, q, db_id):
+        """sql of a similar reference question re-targeted to `db_id` (if enabled and confident), else None"""
+        if self._load_text2sql_retrieval() is None:
+            return None
+        return self.text2sql_retrieval.predict(q, db_id)
+
+    def _cached_sql(self, q, db_id):
+        """sql of `q` from the exact cache, else from the semantic cache (if enabled), else None"""
+        sql = self.text2sql_cache.get(db_id, q)
+        if sql is None and self._load_semantic_cache() is not None:
+            sql = self.semantic_cache.get(db_id, q)
+        return sql
+
+    def _store_sql(self, q, db_id, sql):
+        self.text2sql_cache.put(db_id, q, sql)
+        if self.semantic_cache is not None:
+            self.semantic_cache.put(db_id, q, sql)
 
     def get_db_info(self, db_id):
         db_info = self.db_meta_dict[db_id]
@@ -157,21 +305,9 @@ class DataService(object):
         - Output: 
             - table col names: ["table name: col names", ...]
         """
-        if db_id not in self.h_q.keys():
-            db_info = self.db_meta_dict[db_id]
-            pk = db_info["primary_keys"] # primary keys
-            fk = db_info["foreign_keys"] # foreign keys
-            k_set = set(pk)
-            for f in fk:
-                for e in f:
-                    k_set.add(e)
-            # print("k_set: ", k_set)
-            table_names = db_info["table_names"]
-            # remove columns that included in primary keys and foreign keys since they usually do not carry many meanings
-            table_cols = [table_names[col[0]] + ": " + col[1] for colidx, col in enumerate(db_info["column_names"]) if col[0]!=-1 and colidx not in list(k_set)]
-            self.table_cols = table_cols
-            # print(table_cols)
-            
+        # primary and foreign keys are removed by the schema registry
+        # since they usually do not carry many meanings
+        self.table_cols = self.schema_registry.get_db_cols(db_id)
         return self.table_cols
 
     def get_col_names(self, file_name, table_name):
@@ -196,10 +332,43 @@ class DataService(object):
         return table_data
 
     def text2sql(self, q, db_id):
-        self._load_text2sql_model()
-        sql = self.text2sql_model.predict(q, db_id)
+        sql = self._cached_sql(q, db_id)
+        if sql is None:
+            sql = self._retrieved_sql(q, db_id)
+        if sql is None:
+            with self.models.use("text2sql") as text2sql_model:
+                sql = text2sql_model.predict(q, db_id)
+            self._store_sql(q, db_id, sql)
         return sql
 
+    def text2sql_batch(self, qs, db_id):
+        """text2sql for a list of questions on one database, in batched forward passes;
+        only the questions that are neither cached nor answered by the retrieval fast path reach the model"""
+        sqls = [self._cached_sql(q, db_id) for q in qs]
+        sqls = [self._retrieved_sql(q, db_id) if sql is None else sql for q, sql in zip(qs, sqls)]
+        misses = {}
+        for i, q in enumerate(qs):
+            if sqls[i] is None:
+                misses.setdefault(self.text2sql_cache.key(db_id, q), []).append(i)
+        if len(misses) > 0:
+            idxs = list(misses.values())
+            with self.models.use("text2sql") as text2sql_model:
+                preds = text2sql_model.predict_batch([(qs[idx[0]], db_id) for idx in idxs])
+            for idx, sql in zip(idxs, preds):
+                self._store_sql(qs[idx[0]], db_id, sql)
+                for i in idx:
+                    sqls[i] = sql
+        return sqls
+
+    def cache_stats(self):
+        """hit statistics of the result caches"""
+        stats = {"text2sql": self.text2sql_cache.stats()}
+        if self.semantic_cache is not None:
+            stats["text2sql_semantic"] = self.semantic_cache.stats()
+        if self.text2sql_retrieval is not None:
+            stats["text2sql_retrieval"] = dict(self.text2sql_retrieval.stats)
+        return stats
+
     def parsesql(self, sql, db_id):
         """parse sql data based on spider database
         sql: sql query
@@ -207,7 +376,6 @@ class DataService(object):
         return: {"sql_parse": sql_label, "table": table}
         """
         if self.dataset == "spider":
-            self._load_sql_parser()
             parsed = self.sql_parser.parse_sql(sql, db_id)
             return parsed
         else:
@@ -268,25 +436,108 @@ class DataService(object):
         db_meta = self.db_meta_dict[db_id]
         # print("db_meta: ", db_meta.keys()])
 
-        # load sql suggestion model
-        self._load_sqlsugg_model()
         # print("db id, table_cols: ", db_id.replace("_", " ").strip(), table_cols)
-        db_bin = self.sqlsugg_model.search_sim_dbs(db_id.replace("_", " ").strip(), table_cols)
-        # print(db_bin.head())
-        sugg_dict = self.sqlsugg_model.query_suggestion(db_bin, context_dict, min_support)
+        db_state = self.sqlsugg_model.get_db_state(db_id.replace("_", " ").strip(), table_cols)
+        # print(db_state.db_df_bin.head())
+        sugg_dict = self.sqlsugg_model.query_suggestion(db_state.db_df_bin, context_dict, min_support, state=db_state)
         # print("sugg_dict: ", sugg_dict)
         
 
         nls_prompts = generate_sql.compile_sql(sugg_dict)
         # print("nls: {}".format(nls))
-        sqls = [self.text2sql(nl, db_id) for nl in nls_prompts]
-        sql2nls =  [self.sql2nl(sql) for sql in sqls]      
+        sqls = self.text2sql_batch(nls_prompts, db_id)
+        sql2nls = self.sql2nl_batch(sqls)
         # print("sql2nls: {}, type: {}".format(sql2nls, type(sql2nls[0])))
         return {
             "sql": sqls,
             "nl": sql2nls
         }
 
+    def add_reference_queries(self, queries):
+        """
+        append sql queries to the reference corpus of the query recommender
+        ### Input
+        - queries: list of [sql (str), db_id (str)]
+        ### Output
+        - number of appended queries (queries appended before and unparsable ones are skipped)
+        """
+        records = []
+        for sql, db_id in queries:
+            if (sql, db_id) in self.reference_queries or db_id not in self.db_meta_dict:
+                continue
+            try:
+                sql_parse = self.parsesql(sql, db_id)
+            except Exception as e:
+                warnings.warn(f"skip reference query {sql!r} ({db_id}): {e}")
+                continue
+            self.reference_queries.add((sql, db_id))
+            records.append({"db_id": db_id, "query": sql, "sql": sql_parse["sql_parse"]})
+        if len(records) > 0:
+            self.sqlsugg_model.add_reference_queries(records)
+        return len(records)
+
+    def queue_reference_queries(self, queries):
+        """
+        append sql queries to the reference corpus in a background thread (`add_reference_queries` loads
+        the recommender and the sql parser and re-mines the affected databases, so requests should not wait)
+        ### Input
+        - queries: list of [sql (str), db_id (str)]
+        """
+        if len(queries) == 0:
+            return
+        self._reference_queue.put(queries)
+        with self._reference_lock:
+            if self._reference_thread is None:
+                self._reference_thread = threading.Thread(target=self._append_queued_queries,
+                                                          name="reference-queries", daemon=True)
+                self._reference_thread.start()
+
+    def _append_queued_queries(self):
+        while True:
+            # everything queued while the last batch was appended goes into one batch
+            queries = list(self._reference_queue.get())
+            while True:
+                try:
+                    queries += self._reference_queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.add_reference_queries(queries)
+            except Exception as e:
+                warnings.warn("appending {} reference queries failed: {!r}".format(len(queries), e))
+
+    @staticmethod
+    def logged_queries(user_data):
+        """
+        [sql, db_id] of every logged query in `/user_data` data (dicts with a `db_id` and a `sql`/`query` str)
+        """
+        queries = []
+        stack = [user_data.get("userdata")]
+        while len(stack) > 0:
+            item = stack.pop()
+            if isinstance(item, dict):
+                sql = item.get("sql", item.get("query"))
+                if isinstance(item.get("db_id"), str) and isinstance(sql, str):
+                    queries.append([sql, item["db_id"]])
+                else:
+                    stack.extend(item.values())
+            elif isinstance(item, list):
+                stack.extend(reversed(item))
+        return queries
+
+    def load_user_queries(self, folder=GV.USER_DATA_FOLDER):
+        """
+        append the queries of all `/user_data` logs in `folder` to the reference corpus
+        ### Output
+        - number of appended queries
+        """
+        queries = []
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.endswith(".json"):
+                with open(os.path.join(folder, file_name), "r") as f:
+                    queries += self.logged_queries(json.load(f))
+        return self.add_reference_queries(queries)
+
     def data2vl(self, data):
         """Get VegaLite specifications from tabular-style data.
         data: pd.DataFrame, data to be presented
@@ -381,10 +632,15 @@ class DataService(object):
             return response
 
     def sql2nl(self, sql: str):
-        self._load_sql2text_model()
-        nl = self.sql2text_model.sql2text(sql)
+        with self.models.use("sql2text") as sql2text_model:
+            nl = sql2text_model.sql2text(sql)
         return nl
 
+    def sql2nl_batch(self, sqls):
+        """sql2nl for a list of sqls, generated in batches"""
+        with self.models.use("sql2text") as sql2text_model:
+            return sql2text_model.sql2text_batch(sqls)
+
 if __name__ == '__main__':
     print('dataService:')
     dataService = DataService("spider")
@@ -0,0 +1,172 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import globalVariable as GV
+except ImportError:
+    import app.dataService.globalVariable as GV
+
+
+class EmbeddingStore(object):
+    """
+    - content-addressed embedding cache in front of `model.encode`
+    - lookups go: in-memory LRU -> on-disk memory-mapped matrix -> model
+    - on disk (`folder`):
+      - vectors.npy: float32 matrix (capacity * dim), opened with `np.lib.format.open_memmap`
+      - index.tsv: append-only "sha1(text)\\trow" lines, so a restart only replays the index
+    - only strings that were never seen before are sent to the model
+    - `read_only`: new embeddings are only kept in memory (e.g. worker processes sharing a store)
+    """
+
+    def __init__(self, model, folder, lru_size=GV.EMBEDDING_LRU_SIZE, init_capacity=4096, read_only=False):
+        self.model = model
+        self.read_only = read_only
+        self.folder = folder
+        self.lru_size = lru_size
+        self.init_capacity = init_capacity
+        self.dim = model.get_sentence_embedding_dimension()
+        self._lru = OrderedDict()
+        self._index = {}
+        self._count = 0
+        self._vectors = None
+        self._lock = threading.RLock()
+        self.stats = {"lru_hits": 0, "disk_hits": 0, "encoded": 0}
+        self._open()
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.folder, "vectors.npy")
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.folder, "index.tsv")
+
+    def _open(self):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        if os.path.isfile(self._vectors_path):
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="r" if self.read_only else "r+")
+            if self._vectors.shape[1] != self.dim:
+                raise ValueError("embedding dim mismatch in {}: {} != {}".format(
+                    self._vectors_path, self._vectors.shape[1], self.dim))
+        else:
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=np.float32,
+                                                      shape=(self.init_capacity, self.dim))
+        if os.path.isfile(self._index_path):
+            with open(self._index_path, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    # skip a torn last line left by an interrupted write
+                    if len(parts) != 2 or not parts[1].isdigit():
+                        continue
+                    row = int(parts[1])
+                    if row < self._vectors.shape[0]:
+                        self._index[parts[0]] = row
+                        self._count = max(self._count, row + 1)
+
+    def _grow(self, min_capacity):
+        capacity = self._vectors.shape[0]
+        while capacity < min_capacity:
+            capacity *= 2
+        tmp_path = self._vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, self.dim))
+        grown[:self._count] = self._vectors[:self._count]
+        grown.flush()
+        del grown
+        self._vectors.flush()
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="r+")
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key):
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._lru.move_to_end(key)
+            self.stats["lru_hits"] += 1
+            return vec
+        row = self._index.get(key)
+        if row is not None:
+            vec = np.array(self._vectors[row])
+            self._remember(key, vec)
+            self.stats["disk_hits"] += 1
+            return vec
+        return None
+
+    def _persist(self, keys, vecs):
+        if self._count + len(keys) > self._vectors.shape[0]:
+            self._grow(self._count + len(keys))
+        start = self._count
+        self._vectors[start:start + len(keys)] = vecs
+        self._vectors.flush()
+        # the index is written after the vectors so that it never points to an unwritten row
+        with open(self._index_path, "a") as f:
+            for i, k in enumerate(keys):
+                f.write("{}\t{}\n".format(k, start + i))
+                self._index[k] = start + i
+        self._count += len(keys)
+
+    def encode(self, sentences):
+        """
+        - same contract as `SentenceTransformer.encode(..., convert_to_numpy=True)`
+        - INPUT:
+          - sentences: list of str or single str
+        - OUTPUT:
+          - float32 embeddings: (dim,) for a str, (n, dim) for a list
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        sentences = list(sentences)
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        keys = [self.key(s) for s in sentences]
+        missing = OrderedDict()
+        with self._lock:
+            for i, k in enumerate(keys):
+                vec = self._lookup(k)
+                if vec is None:
+                    missing.setdefault(k, (sentences[i], []))[1].append(i)
+                else:
+                    out[i] = vec
+        if len(missing) > 0:
+            # the model runs outside the lock, so concurrent callers can share its batches
+            texts = [v[0] for v in missing.values()]
+            vecs = np.asarray(self.model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+            with self._lock:
+                self.stats["encoded"] += len(texts)
+                # another caller may have stored some of these strings meanwhile
+                new = [j for j, k in enumerate(missing.keys()) if k not in self._index]
+                if len(new) > 0 and not self.read_only:
+                    self._persist([list(missing.keys())[j] for j in new], vecs[new])
+                for (k, (_, idxs)), vec in zip(missing.items(), vecs):
+                    self._remember(k, vec)
+                    out[idxs] = vec
+        return out[0] if single else out
+
+    def __len__(self):
+        return self._count
+
+
+if __name__ == "__main__":
+    from time import time
+    from sentence_transformers import SentenceTransformer
+
+    store = EmbeddingStore(SentenceTransformer(GV.SENTENCE_MODEL_NAME),
+                           os.path.join(GV.EMBEDDING_CACHE_FOLDER, GV.SENTENCE_MODEL_NAME))
+    for _ in range(2):
+        start = time()
+        store.encode(GV.test_table_cols)
+        print("encode: {:.4f}s, stats: {}".format(time() - start, store.stats))
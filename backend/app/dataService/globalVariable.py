@@ -21,6 +21,63 @@ USER_DATA_FOLDER = os.path.join(DATA_FOLDER, 'user')
 if not os.path.isdir(USER_DATA_FOLDER):
     os.mkdir(USER_DATA_FOLDER)
 
+#################### Cached artifacts (schema snapshot, embeddings, ...)
+CACHE_FOLDER = os.path.join(DATA_FOLDER, 'cache')
+SCHEMA_SNAPSHOT_PATH = os.path.join(CACHE_FOLDER, 'schema_registry.pkl')
+EMBEDDING_CACHE_FOLDER = os.path.join(CACHE_FOLDER, 'embeddings')
+EMBEDDING_LRU_SIZE = 50000  # embeddings kept in memory (MiniLM: 384 floats each)
+
+ANN_INDEX_FOLDER = os.path.join(CACHE_FOLDER, 'ann')
+# compact reference corpora of the recommender (`refCorpus.RefCorpus` snapshots)
+REF_CORPUS_FOLDER = os.path.join(CACHE_FOLDER, 'ref_corpus')
+# precomputed per-database recommender states (built by `recArtifacts.py`)
+REC_ARTIFACT_FOLDER = os.path.join(CACHE_FOLDER, 'rec_artifacts')
+
+#################### Startup
+# load the models in background threads at startup, each followed by a warm-up inference
+# (`DataService.start_warmup`, progress on `/api/ready`); otherwise models load on first use,
+# and `/api/ready` answers 503 until each of them has been used once
+WARMUP_ON_STARTUP = False
+WARMUP_COMPONENTS = ["sql_parser", "sqlsugg", "text2sql", "sql2text"]
+# process RSS (bytes) above which idle models (SmBop, SQL2NL) are unloaded until it fits, see
+# `modelRegistry.ModelRegistry`; None: models stay loaded
+MODEL_RSS_BUDGET = None
+MODEL_MIN_IDLE_SECONDS = 60  # models used more recently than this are not unloaded
+# worker processes hosting a model out of the web process (`modelWorkers.WorkerPool`), 0: run it in-process;
+# "sentence" is the recommender's sentence model (MiniLM)
+MODEL_WORKERS = {"text2sql": 0, "sql2text": 0, "sentence": 0}
+MODEL_WORKER_TORCH_THREADS = 1  # torch intra-op threads per worker process
+MODEL_WORKER_TIMEOUT = 300  # seconds a call may wait for its worker
+MODEL_WORKER_STARTUP_TIMEOUT = 600  # seconds a worker may take to load its model, then it counts as failed
+
+#################### Query recommendation model
+SENTENCE_MODEL_NAME = 'paraphrase-MiniLM-L6-v2'
+# storage of the reference entity embeddings: 'float32', 'float16' or 'int8' (see `similarity.EmbeddingMatrix`)
+EMBEDDING_DTYPE = 'float32'
+# encode requests are merged into batches of up to ENCODER_MAX_BATCH_SIZE sentences (see `batchEncoder.BatchEncoder`);
+# requests arriving while a batch is encoded form the next one, ENCODER_MAX_DELAY (seconds) additionally
+# holds a batch open for more requests (trades single-request latency for larger batches)
+ENCODER_MAX_BATCH_SIZE = 64
+ENCODER_MAX_DELAY = 0.0
+# reference corpora with at least this many distinct entities are searched with an ANN index
+ANN_MIN_ENTITIES = 100000
+ANN_N_PROBE = 16  # lists probed per ANN query (higher => better recall, slower)
+# memory budget (bytes) of the cached per-database recommender states
+REC_STATE_MEMORY_BUDGET = 512 * 1024 * 1024
+REC_ITEMSET_CACHE_SIZE = 256  # mined itemset results kept per database
+REC_COL_GROUP_CACHE_SIZE = 256  # column lists whose embeddings/semantic groups are kept
+REC_CONTEXT_CACHE_SIZE = 64  # decayed context score vectors kept per database (one per history prefix)
+# ceiling (bytes) of the similarity block a recommender similarity computation holds at once;
+# wide schemas (thousands of columns) are scored block by block with streaming max reductions
+REC_SIM_MEMORY_LIMIT = 64 * 1024 * 1024
+REC_USE_ARTIFACTS = True  # load the precomputed artifact bundle (if any) at startup
+REC_APPEND_USER_QUERIES = False  # append the queries of `/user_data` logs to the recommender's reference corpus
+REC_ARTIFACT_SUPPORTS = [0.6]  # min supports whose empty-context itemsets are precomputed (`sql_suggest` default)
+# maximal itemset miner: 'bitset' (`itemsetMiner.fpmax_bitset`) or 'fpmax' (mlxtend)
+REC_ITEMSET_ENGINE = 'bitset'
+# stop growing itemsets at `max_len` while mining (changes results, so off by default)
+REC_ITEMSET_PRUNE_MAX_LEN = False
+
 #################### SQL parser variables
 split_symbol = " ; "
 ##### adopted from https://github.com/taoyds/spider/blob/88c04b7ee43a4cc58984369de7d8196f55a84fbf/process_sql.py
@@ -39,10 +96,36 @@ COND_OPS = ('and', 'or')
 SQL_OPS = ('intersect', 'union', 'except')
 ORDER_OPS = ('desc', 'asc')
 
+#################### Text2SQL model config
+TEXT2SQL_BATCH_SIZE = 8  # questions per SmBop forward pass (`SmBop.predict_batch`)
+# text2sql results by (db_id, normalized utterance, model version), see `text2sqlCache.Text2SQLCache`
+TEXT2SQL_CACHE_PATH = os.path.join(CACHE_FOLDER, 'text2sql.sqlite')
+TEXT2SQL_CACHE_LRU_SIZE = 4096  # results also kept in memory
+# answer paraphrases of cached utterances from the cache (`text2sqlCache.SemanticText2SQLCache`, embeds with the
+# recommender's sentence model); a paraphrase may need another sql than the cached one, so off by default
+TEXT2SQL_SEMANTIC_CACHE = False
+# min cosine similarity of a paraphrase; untuned (a conservative guess, not measured yet): run
+# `benchmark/bench_semantic_cache.py` and pick the lowest threshold with an acceptable false-hit rate
+TEXT2SQL_SEMANTIC_THRESHOLD = 0.9
+TEXT2SQL_SEMANTIC_DB_THRESHOLDS = {}  # db_id => threshold, for databases whose utterances are close to each other
+TEXT2SQL_SEMANTIC_MAX_ENTRIES = 4096  # utterances per database
+# answer questions with the re-targeted sql of a similar Spider train question before running SmBop
+# (`text2sqlRetrieval.RetrievalText2SQL`); off by default, `benchmark/bench_text2sql_retrieval.py` measures it
+TEXT2SQL_RETRIEVAL = False
+# min confidence (template similarity * mapping quality) of a retrieved sql, below it SmBop answers;
+# untuned (not measured yet): pick it from the coverage / execution accuracy sweep of the benchmark above
+TEXT2SQL_RETRIEVAL_THRESHOLD = 0.85
+TEXT2SQL_RETRIEVAL_TOP_K = 10  # reference questions adapted per question
+# embeddings of the reference questions and schema labels (questions themselves are never persisted)
+TEXT2SQL_RETRIEVAL_EMBEDDING_FOLDER = os.path.join(EMBEDDING_CACHE_FOLDER, 'text2sql_retrieval', SENTENCE_MODEL_NAME)
+
 #################### SQL2NL model config
 SQL2NL_MODEL_NAME = "hkunlp/from_all_T5_base_prefix_sql2text2"
 SQL2NL_MODEL_FOLDER = os.path.abspath(os.path.join(MODEL_FOLDER, "UnifiedSKG"))
 SQL2NL_MODEL_CONFIG_PATH = os.path.abspath(os.path.join(SQL2NL_MODEL_FOLDER, "configure/Salesforce/T5_base_prefix_sql2text.cfg"))
+SQL2NL_BATCH_SIZE = 16  # sqls per `generate` call (`SQL2NL.sql2text_batch`)
+# use the fast (Rust) tokenizer if it produces the same ids as the slow one on a probe set of sqls
+SQL2NL_FAST_TOKENIZER = True
 
 
 ##################
@@ -0,0 +1,137 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import globalVariable as GV
+except ImportError:
+    import app.dataService.globalVariable as GV
+
+
+class ItemsetCache(object):
+    """
+    - maximal frequent itemsets mined from column subsets of ONE binary matrix (`db_df_bin`)
+    - results are cached per (column set, support, max_len)
+    - a column subset C of a cached column set S is derived instead of mined:
+      the maximal itemsets of C are the maximal sets among {M & C : M maximal in S}
+      (every frequent set in C is frequent in S, and subsets of frequent sets are frequent)
+    - results are returned in a canonical order (by sorted item names), so mined and
+      derived results are interchangeable
+    - thread-safe (the owning `DBState` is shared by request and warm-up threads); mining runs
+      outside the lock, so two threads missing the same key may both mine it
+    """
+
+    def __init__(self, max_entries=GV.REC_ITEMSET_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._pinned = set()
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "derived": 0, "mined": 0}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        """
+        - drop everything (e.g. the underlying matrix changed)
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._pinned.clear()
+
+    def nbytes(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    @staticmethod
+    def _canonical(freq_combo):
+        order = sorted(range(len(freq_combo)), key=lambda i: sorted(freq_combo["itemsets"].values[i]))
+        return freq_combo.iloc[order].reset_index(drop=True)
+
+    @staticmethod
+    def derive(maximal, df):
+        """
+        - maximal itemsets of `df` (a column subset) from the maximal itemsets `maximal`
+          of a column superset mined with the same support
+        """
+        cols = set(df.columns)
+        candidates = sorted(set(frozenset(m & cols) for m in maximal["itemsets"].values) - {frozenset()},
+                            key=len, reverse=True)
+        kept = []
+        for c in candidates:
+            if not any(c < k for k in kept):
+                kept.append(c)
+        arr = df.values.astype(bool)
+        pos = {c: i for i, c in enumerate(df.columns)}
+        supports = [arr[:, [pos[c] for c in k]].all(axis=1).mean() for k in kept]
+        return pd.DataFrame({"support": np.array(supports, dtype=np.float64), "itemsets": kept},
+                            columns=["support", "itemsets"])
+
+    def mine(self, df, support, miner, max_len=None, pin=False):
+        """
+        - INPUT:
+          - df: 0/1 DataFrame, a column subset of the matrix this cache belongs to
+          - support: min support
+          - miner: (df, support) => DataFrame["support", "itemsets"] of maximal itemsets
+          - max_len: itemset length limit the miner applies (part of the cache key)
+          - pin: never evict this entry (e.g. the full column set, the main derivation source)
+        - OUTPUT:
+          - DataFrame["support", "itemsets"] (a copy, safe to modify)
+        """
+        df = df.loc[:, ~df.columns.duplicated()]
+        columns = frozenset(df.columns)
+        key = (columns, support, max_len)
+        with self._lock:
+            freq_combo = self._entries.get(key)
+            if freq_combo is not None:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return freq_combo.copy()
+            supersets = [k for k in self._entries if k[1] == support and k[2] == max_len and columns < k[0]]
+            source = self._entries[min(supersets, key=lambda k: len(k[0]))] if len(supersets) > 0 else None
+        if source is not None:
+            freq_combo = self.derive(source, df)
+            self.stats["derived"] += 1
+        else:
+            freq_combo = miner(df, support)[["support", "itemsets"]]
+            self.stats["mined"] += 1
+        return self._store(key, freq_combo, pin).copy()
+
+    def _store(self, key, freq_combo, pin):
+        freq_combo = self._canonical(freq_combo)
+        size = int(np.sum(freq_combo.memory_usage(index=True, deep=True)))
+        with self._lock:
+            self._entries[key] = freq_combo
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            if pin:
+                self._pinned.add(key)
+            self._evict()
+        return freq_combo
+
+    def put(self, columns, support, freq_combo, max_len=None, pin=False):
+        """
+        - add an already mined result (e.g. loaded from precomputed artifacts)
+        """
+        self._store((frozenset(columns), support, max_len), freq_combo[["support", "itemsets"]], pin)
+
+    def pinned(self):
+        """
+        - OUTPUT:
+          - list of ((column set, support, max_len), DataFrame["support", "itemsets"]) of the pinned entries
+        """
+        with self._lock:
+            return [(key, self._entries[key].copy()) for key in self._entries if key in self._pinned]
+
+    def _evict(self):
+        for key in list(self._entries.keys()):
+            if len(self._entries) <= self.max_entries:
+                break
+            if key not in self._pinned:
+                del self._entries[key]
+                del self._sizes[key]
@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+import pandas as pd
+from mlxtend.frequent_patterns import fpmax, fpgrowth
+
+# number of set bits of every byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def pack_columns(df):
+    """
+    - INPUT:
+      - df: 0/1 (or bool) DataFrame, rows = transactions, columns = items
+    - OUTPUT:
+      - bits: (n_cols, ceil(n_rows / 8)) uint8, one packed bit-vector per column
+    """
+    return np.packbits(np.asarray(df.values, dtype=bool).T, axis=1)
+
+
+def popcount(bits):
+    """
+    - number of set bits along the last axis
+    """
+    return POPCOUNT_TABLE[bits].sum(axis=-1)
+
+
+def fpmax_bitset(df, min_support=0.5, max_len=None):
+    """
+    - maximal frequent itemsets of a binary matrix, mined depth-first over packed column bitsets
+      (same output as `mlxtend.frequent_patterns.fpmax(df, min_support, use_colnames=True)`)
+    - INPUT:
+      - df: 0/1 DataFrame
+      - min_support: minimum support (fraction of rows)
+      - max_len: if set, maximal itemsets among the frequent itemsets of length <= max_len
+        (what `ItemsetCache.derive` relies on; mlxtend's `fpmax(max_len=...)` differs, see `fpmax_mlxtend`)
+    - OUTPUT:
+      - DataFrame["support", "itemsets"], itemsets are frozensets of column names
+    """
+    if min_support <= 0.:
+        raise ValueError('`min_support` must be a positive number within the interval `(0, 1]`. '
+                         'Got %s.' % min_support)
+    n_rows = df.shape[0]
+    columns = list(df.columns)
+    empty = pd.DataFrame({"support": np.zeros(0, dtype=np.float64), "itemsets": []},
+                         columns=["support", "itemsets"])
+    if n_rows == 0 or len(columns) == 0:
+        return empty
+    min_count = math.ceil(min_support * n_rows)
+    bits = pack_columns(df)
+    counts = popcount(bits)
+    # frequent items, least frequent first: small tidsets make the early branches cheap
+    items = [i for i in np.argsort(counts, kind="stable") if counts[i] >= min_count]
+    maximal = []  # (item bitmask, count)
+
+    def covered(mask):
+        return any(mask & m == mask for m, _ in maximal)
+
+    def extend(head_mask, head_bits, head_count, head_len, tail):
+        # tail: candidate items after the head, all frequent together with the head
+        if len(tail) == 0 or (max_len is not None and head_len >= max_len):
+            if not covered(head_mask):
+                maximal.append((head_mask, head_count))
+            return
+        tail_mask = 0
+        for i in tail:
+            tail_mask |= 1 << int(i)
+        # the head with its whole tail is already inside a maximal itemset
+        if covered(head_mask | tail_mask):
+            return
+        tail_bits = head_bits[None, :] & bits[tail]
+        tail_counts = popcount(tail_bits)
+        frequent = [j for j in range(len(tail)) if tail_counts[j] >= min_count]
+        if len(frequent) == 0:
+            if not covered(head_mask):
+                maximal.append((head_mask, head_count))
+            return
+        for k, j in enumerate(frequent):
+            next_tail = [tail[f] for f in frequent[k + 1:]]
+            extend(head_mask | (1 << int(tail[j])), tail_bits[j], tail_counts[j], head_len + 1, next_tail)
+
+    for k, i in enumerate(items):
+        extend(1 << int(i), bits[i], counts[i], 1, items[k + 1:])
+
+    if len(maximal) == 0:
+        return empty
+    itemsets = [frozenset(columns[i] for i in range(len(columns)) if (mask >> i) & 1) for mask, _ in maximal]
+    supports = np.array([count for _, count in maximal], dtype=np.float64) / n_rows
+    return pd.DataFrame({"support": supports, "itemsets": itemsets}, columns=["support", "itemsets"])
+
+
+def fpmax_mlxtend(df, min_support=0.5, max_len=None):
+    """
+    - mlxtend counterpart of `fpmax_bitset` (same output)
+    - mlxtend's `fpmax(max_len=...)` drops the maximal itemsets longer than `max_len` instead of
+      shortening them, so with `max_len` the itemsets come from `fpgrowth` and only the maximal ones are kept
+    """
+    if max_len is None:
+        return fpmax(df, min_support=min_support, use_colnames=True)
+    freq = fpgrowth(df, min_support=min_support, use_colnames=True, max_len=max_len)
+    itemsets = list(freq["itemsets"])
+    keep = [i for i, s in enumerate(itemsets) if not any(s < t for t in itemsets)]
+    return freq.iloc[keep].reset_index(drop=True)[["support", "itemsets"]]
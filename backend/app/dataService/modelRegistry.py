@@ -0,0 +1,209 @@
+import gc
+import os
+import time
+import ctypes
+import logging
+import threading
+import warnings
+from contextlib import contextmanager
+
+try:
+    import globalVariable as GV
+except ImportError:
+    import app.dataService.globalVariable as GV
+
+LOG = logging.getLogger(__name__)
+
+
+def current_rss():
+    """
+    - resident set size of this process in bytes, None where it cannot be read
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        # hand freed heap pages back to the OS (glibc), otherwise the RSS does not shrink
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class _Entry(object):
+    def __init__(self, name, factory, evictable):
+        self.name = name
+        self.factory = factory
+        self.evictable = evictable
+        self.model = None
+        self.refs = 0
+        self.last_used = None
+        self.lock = threading.Lock()  # held while loading: one load per model at a time
+        self.stats = {"loads": 0, "load_seconds": None, "total_load_seconds": 0.0,
+                      "evictions": 0, "eviction_seconds": None, "rss_freed": None}
+
+
+class ModelRegistry(object):
+    """
+    - owner of the models of `DataService`, built by their factories on first use
+    - single flight: concurrent first requests wait for one load instead of building the model twice
+    - `use(name)`: context manager that pins the model while a request runs (reference count)
+    - idle eviction: before and after a model is loaded (or on `enforce_budget()`), if the process RSS exceeds
+      `rss_budget`, evictable models that are not in use and were idle for `min_idle` seconds are unloaded,
+      least recently used first, until the RSS fits (they are reloaded on their next use)
+    - `stats()`: per model loads, load/eviction times and the memory freed by its last eviction
+    """
+
+    def __init__(self, rss_budget=GV.MODEL_RSS_BUDGET, min_idle=GV.MODEL_MIN_IDLE_SECONDS, rss_fn=current_rss):
+        self.rss_budget = rss_budget
+        self.min_idle = min_idle
+        self.rss_fn = rss_fn
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory, evictable=True):
+        with self._lock:
+            self._entries[name] = _Entry(name, factory, evictable)
+
+    def is_loaded(self, name):
+        return self._entries[name].model is not None
+
+    def was_loaded(self, name):
+        """True once `name` has been loaded, even if it was evicted since"""
+        return self._entries[name].stats["loads"] > 0
+
+    def _acquire(self, name):
+        entry = self._entries[name]
+        loaded = False
+        with entry.lock:
+            if entry.model is None:
+                # make room first: models released since the last check are no longer referenced by their callers
+                self.enforce_budget()
+                start = time.time()
+                model = entry.factory()
+                elapsed = time.time() - start
+                with self._lock:
+                    entry.model = model
+                    entry.stats["loads"] += 1
+                    entry.stats["load_seconds"] = elapsed
+                    entry.stats["total_load_seconds"] += elapsed
+                loaded = True
+            with self._lock:
+                entry.refs += 1
+                model = entry.model
+        if loaded:
+            self.enforce_budget()
+        return model
+
+    def _release(self, name):
+        entry = self._entries[name]
+        with self._lock:
+            entry.refs -= 1
+            entry.last_used = time.time()
+
+    @contextmanager
+    def use(self, name):
+        """
+        - the model `name` (loaded if needed), pinned until the block exits
+        """
+        model = self._acquire(name)
+        try:
+            yield model
+        finally:
+            self._release(name)
+
+    def get(self, name):
+        """
+        - the model `name` (loaded if needed) without pinning it; for models that are not evictable
+        """
+        with self.use(name) as model:
+            return model
+
+    def unload(self, name):
+        """
+        - unload `name` unless it is in use or being loaded
+        - OUTPUT:
+          - True if it was unloaded
+        """
+        entry = self._entries[name]
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if entry.model is None or entry.refs > 0:
+                    return False
+                start = time.time()
+                rss = self.rss_fn()
+                entry.model = None
+            _release_memory()
+            freed = rss - self.rss_fn() if rss is not None else None
+            with self._lock:
+                entry.stats["evictions"] += 1
+                entry.stats["eviction_seconds"] = time.time() - start
+                entry.stats["rss_freed"] = freed
+            return True
+        finally:
+            entry.lock.release()
+
+    def _idle(self):
+        """evictable models not in use, idle for `min_idle` seconds, least recently used first"""
+        now = time.time()
+        with self._lock:
+            idle = [e for e in self._entries.values()
+                    if e.evictable and e.model is not None and e.refs == 0
+                    and (e.last_used is None or now - e.last_used >= self.min_idle)]
+        return sorted(idle, key=lambda e: e.last_used or 0)
+
+    def enforce_budget(self):
+        """
+        - unload idle models while the RSS exceeds the budget
+        - OUTPUT:
+          - names of the unloaded models
+        """
+        if self.rss_budget is None:
+            return []
+        rss = self.rss_fn()
+        if rss is None or rss <= self.rss_budget:
+            return []
+        evicted = []
+        for entry in self._idle():
+            if self.unload(entry.name):
+                evicted.append(entry.name)
+                rss = self.rss_fn()
+                if rss is None or rss <= self.rss_budget:
+                    break
+        if len(evicted) > 0:
+            LOG.info("rss above budget, unloaded idle models: %s", evicted)
+        elif rss > self.rss_budget:
+            warnings.warn("rss {} above the model budget {}, but no model is idle".format(rss, self.rss_budget))
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            models = {name: dict(e.stats, loaded=e.model is not None, refs=e.refs, last_used=e.last_used,
+                                 evictable=e.evictable)
+                      for name, e in self._entries.items()}
+        return {"rss": self.rss_fn(), "rss_budget": self.rss_budget, "models": models}
+
+
+if __name__ == "__main__":
+    import numpy as np
+
+    registry = ModelRegistry(rss_budget=current_rss() + 200 * 1024 * 1024, min_idle=0)
+    for i in range(3):
+        registry.register("model_{}".format(i), lambda: np.ones(100 * 1024 * 1024 // 8))
+    for i in range(3):
+        with registry.use("model_{}".format(i)) as model:
+            model.sum()
+        del model
+    print(registry.enforce_budget(), registry.stats())
@@ -0,0 +1,342 @@
+import sys
+import time
+import logging
+import itertools
+import collections
+import threading
+import traceback
+import functools
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import Future, TimeoutError
+
+try:
+    import globalVariable as GV
+except ImportError:
+    import app.dataService.globalVariable as GV
+
+LOG = logging.getLogger(__name__)
+
+
+class WorkerError(RuntimeError):
+    """a model call raised in its worker process (message: the worker's traceback)"""
+
+
+class WorkerCrashed(RuntimeError):
+    """the worker process running a call died"""
+
+
+# factories of the models that can be hosted by workers (module level, so that spawned processes can load them)
+def build_smbop():
+    try:
+        from sqlParser import SmBop
+    except ImportError:
+        from app.dataService.sqlParser import SmBop
+    return SmBop()
+
+
+def build_sql2nl():
+    try:
+        from sqlParser import SQL2NL
+    except ImportError:
+        from app.dataService.sqlParser import SQL2NL
+    return SQL2NL()
+
+
+def build_sentence_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(GV.SENTENCE_MODEL_NAME)
+
+
+def _worker_main(factory, torch_threads, inbox, results):
+    """
+    - worker process: build the model, then serve (request id, method, args, kwargs) from its `inbox` pipe
+      until a None arrives; messages go to its own `results` pipe, written synchronously (no feeder thread,
+      no lock shared with other workers that a dying process could leave held)
+    """
+    if torch_threads is not None:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+    try:
+        model = factory()
+    except Exception:
+        results.send((None, "failed", traceback.format_exc()))
+        return
+    results.send((None, "ready", None))
+    while True:
+        try:
+            request = inbox.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        req_id, method, args, kwargs = request
+        try:
+            results.send((req_id, "done", getattr(model, method)(*args, **kwargs)))
+        except Exception:
+            results.send((req_id, "error", traceback.format_exc()))
+
+
+def _wait(future, timeout):
+    """
+    - result of `future`; on the thread of a gevent hub (the gevent server runs without monkey patching),
+      blocking would stop every other request, so the wait runs in gevent's native thread pool and only
+      the calling greenlet waits (at most `get_hub().threadpool.maxsize` calls wait at once)
+    """
+    gevent = sys.modules.get("gevent")
+    if gevent is not None and threading.current_thread() is threading.main_thread():
+        from gevent import monkey
+        if not monkey.is_module_patched("threading"):
+            return gevent.get_hub().threadpool.apply(future.result, (timeout,))
+    return future.result(timeout=timeout)
+
+
+class WorkerPool(object):
+    """
+    - `n_workers` processes hosting one model each (built by `factory`, a module-level function),
+      out of the web process: inference neither competes for its GIL nor takes it down when it crashes
+    - requests wait in the pool and are handed to an idle worker one at a time, through the worker's own
+      pipe: the pool always knows which request a worker runs; `torch_threads` caps torch's intra-op
+      threads per worker (workers * threads ~ cores)
+    - `submit(method, *args, **kwargs)` -> `Future` of `model.method(*args, **kwargs)`, `call` waits for it
+      (cooperatively under gevent, see `_wait`)
+    - a worker that dies is restarted; the call it was running fails with `WorkerCrashed`
+    - a call that waits longer than `timeout` raises `TimeoutError` and is dropped: removed from the queue,
+      or, if a worker runs it, that worker is terminated (and restarted), so a hung call cannot keep it busy
+    - a worker that dies while loading its model, or is not ready after `startup_timeout` seconds, is failed
+      (not restarted); once every worker failed, waiting calls fail with `WorkerCrashed`
+    """
+
+    def __init__(self, factory, n_workers=1, torch_threads=GV.MODEL_WORKER_TORCH_THREADS, name="model",
+                 timeout=GV.MODEL_WORKER_TIMEOUT, startup_timeout=GV.MODEL_WORKER_STARTUP_TIMEOUT):
+        self.factory = factory
+        self.n_workers = n_workers
+        self.torch_threads = torch_threads
+        self.name = name
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        # spawn: the web process runs threads (encoder, collectors) that must not be forked
+        self._ctx = multiprocessing.get_context("spawn")
+        self._futures = {}  # request id => Future
+        self._pending = collections.deque()  # (request id, method, args, kwargs) not handed to a worker yet
+        self._workers = {}  # worker id => {"process", "inbox", "results", "status", "request", "started"}
+        self._readers = {}  # results pipe => (worker id, process), until the process is gone (EOF)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "crashes": 0, "restarts": 0}
+        for worker_id in range(n_workers):
+            self._start(worker_id)
+        self._collector = threading.Thread(target=self._collect, name=name + "-results", daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._watch, name=name + "-monitor", daemon=True)
+        self._monitor.start()
+
+    def _start(self, worker_id):
+        inbox_r, inbox_w = self._ctx.Pipe(duplex=False)
+        results_r, results_w = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(target=_worker_main, name="{}-worker-{}".format(self.name, worker_id),
+                                    args=(self.factory, self.torch_threads, inbox_r, results_w), daemon=True)
+        process.start()
+        # only the worker holds its ends: its results pipe reaches EOF when it exits
+        inbox_r.close()
+        results_w.close()
+        with self._lock:
+            self._workers[worker_id] = {"process": process, "inbox": inbox_w, "results": results_r,
+                                        "status": "starting", "request": None, "started": time.time()}
+            self._readers[results_r] = (worker_id, process)
+
+    def _dispatch(self):
+        """hand pending requests to idle workers (with `_lock` held)"""
+        for worker in self._workers.values():
+            if len(self._pending) == 0:
+                return
+            if worker["status"] == "ready" and worker["request"] is None:
+                request = self._pending.popleft()
+                # recorded before it is sent: if the worker dies from here on, the call is failed, not lost
+                worker["request"] = request[0]
+                try:
+                    worker["inbox"].send(request)
+                except OSError:
+                    pass  # the worker is gone, its EOF fails the call
+
+    def _collect(self):
+        while not self._closed:
+            with self._lock:
+                readers = list(self._readers)
+            for reader in multiprocessing.connection.wait(readers, timeout=1.0):
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    self._exited(reader)
+                    continue
+                self._handle(reader, *message)
+
+    def _handle(self, reader, req_id, kind, payload):
+        future = None
+        with self._lock:
+            worker_id, process = self._readers[reader]
+            worker = self._workers[worker_id]
+            current = worker["process"] is process
+            if kind in ("ready", "failed"):
+                # a worker failed by the startup check stays failed
+                if current and worker["status"] == "starting":
+                    worker["status"] = kind
+                if kind == "failed":
+                    LOG.error("%s worker %s failed to load:\n%s", self.name, worker_id, payload)
+            else:
+                if current:
+                    worker["request"] = None
+                future = self._futures.pop(req_id, None)
+                if kind == "error":
+                    self.stats["errors"] += 1
+            self._dispatch()
+        if future is None:
+            return
+        if kind == "done":
+            future.set_result(payload)
+        else:
+            future.set_exception(WorkerError(payload))
+
+    def _exited(self, reader):
+        """
+        a worker process is gone, and all it sent has been read: fail the call it was running and restart it,
+        or fail it if it never got ready
+        """
+        lost = []  # [(future, reason), ...]
+        restart = False
+        with self._lock:
+            reader.close()
+            worker_id, process = self._readers.pop(reader)
+            worker = self._workers[worker_id]
+            if self._closed or worker["process"] is not process:
+                return
+            process.join(timeout=1.0)
+            if worker["status"] == "starting":
+                worker["status"] = "failed"
+                LOG.error("%s worker %s died while loading its model (exit code %s)", self.name, worker_id,
+                          process.exitcode)
+            elif worker["status"] == "ready":
+                future = self._futures.pop(worker["request"], None)
+                if future is not None:
+                    lost.append((future, "worker died while running the call"))
+                self.stats["crashes"] += 1
+                restart = True
+                LOG.warning("%s worker %s died (exit code %s), restarting", self.name, worker_id, process.exitcode)
+            lost += self._fail_if_no_worker()
+        if restart:
+            self._start(worker_id)
+            self.stats["restarts"] += 1
+        for future, reason in lost:
+            future.set_exception(WorkerCrashed("{}: {}".format(self.name, reason)))
+
+    def _fail_if_no_worker(self):
+        """no worker left that could serve the requests: fail everything that waits (with `_lock` held)"""
+        if not all(worker["status"] == "failed" for worker in self._workers.values()):
+            return []
+        lost = [(future, "no worker could load the model") for future in self._futures.values()]
+        self._futures.clear()
+        self._pending.clear()
+        return lost
+
+    def _watch(self):
+        while not self._closed:
+            self._check_startup()
+            threading.Event().wait(1.0)
+
+    def _check_startup(self):
+        """
+        fail workers that are not ready after `startup_timeout` seconds (e.g. a spawned process that
+        re-ran an unguarded server script, or a load that hangs)
+        """
+        with self._lock:
+            for worker_id, worker in self._workers.items():
+                if worker["status"] == "starting" and time.time() - worker["started"] > self.startup_timeout:
+                    worker["status"] = "failed"
+                    worker["process"].terminate()
+                    LOG.error("%s worker %s not ready after %s seconds, terminated", self.name, worker_id,
+                              self.startup_timeout)
+            lost = self._fail_if_no_worker()
+        for future, reason in lost:
+            future.set_exception(WorkerCrashed("{}: {}".format(self.name, reason)))
+
+    def submit(self, method, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("WorkerPool {} is closed".format(self.name))
+        future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._futures[req_id] = future
+            self._pending.append((req_id, method, args, kwargs))
+            self.stats["requests"] += 1
+            self._dispatch()
+            lost = self._fail_if_no_worker()
+        for future_, reason in lost:
+            future_.set_exception(WorkerCrashed("{}: {}".format(self.name, reason)))
+        return future
+
+    def call(self, method, *args, **kwargs):
+        future = self.submit(method, *args, **kwargs)
+        try:
+            return _wait(future, self.timeout)
+        except TimeoutError:
+            self._cancel(future)
+            raise
+
+    def _cancel(self, future):
+        """
+        drop a call nobody waits for any more: unqueue it, or terminate the worker running it
+        (its EOF restarts it, see `_exited`)
+        """
+        with self._lock:
+            req_id = next((r for r, f in self._futures.items() if f is future), None)
+            if req_id is None:
+                return  # finished meanwhile
+            del self._futures[req_id]
+            self.stats["timeouts"] += 1
+            for request in self._pending:
+                if request[0] == req_id:
+                    self._pending.remove(request)
+                    return
+            for worker_id, worker in self._workers.items():
+                if worker["request"] == req_id:
+                    LOG.warning("%s worker %s timed out after %s seconds, terminating", self.name, worker_id,
+                                self.timeout)
+                    worker["process"].terminate()
+
+    def status(self):
+        with self._lock:
+            return {"workers": {w: worker["status"] for w, worker in self._workers.items()},
+                    "pending": len(self._futures), **self.stats}
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            try:
+                worker["inbox"].send(None)
+            except OSError:
+                pass
+        for worker in workers:
+            worker["process"].join(timeout=10)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+
+
+class RemoteModel(object):
+    """
+    - stand-in for a model hosted by a `WorkerPool`: `remote.predict(q, db_id)` runs
+      `model.predict(q, db_id)` in a worker (arguments and results are pickled)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return functools.partial(self.pool.call, method)
@@ -2,6 +2,9 @@ import os
 import sys
 import re
 import json
+import copy
+import hashlib
+import threading
 import numpy as np
 import pandas as pd
 import math
@@ -12,25 +15,59 @@ from sklearn.metrics.pairwise import cosine_similarity
 
 try:
     import globalVariable as GV
+    from schemaRegistry import get_schema_registry
+    from embeddingStore import EmbeddingStore
+    from batchEncoder import BatchEncoder
+    from recArtifacts import ArtifactBundle, bundle_params
+    from refCorpus import RefCorpus, AGG_OPTS, strip_table_name
+    from similarity import normalize_rows, segment_max, gather_segments, EmbeddingMatrix, block_rows, \
+        cos_sim_max, community_detection
+    from annIndex import IVFFlatIndex
+    from recState import DBState, StateCache, ColumnGroupCache, cols_key
+    from itemsetMiner import fpmax_bitset, fpmax_mlxtend, pack_columns
     from utils.processSQL import process_sql, decode_sql, generate_sql
     from utils.processSQL.decode_sql import extract_select_names, extract_agg_opts, extract_groupby_names
 except ImportError:
     import app.dataService.globalVariable as GV
+    from app.dataService.schemaRegistry import get_schema_registry
+    from app.dataService.embeddingStore import EmbeddingStore
+    from app.dataService.batchEncoder import BatchEncoder
+    from app.dataService.recArtifacts import ArtifactBundle, bundle_params
+    from app.dataService.refCorpus import RefCorpus, AGG_OPTS, strip_table_name
+    from app.dataService.similarity import normalize_rows, segment_max, gather_segments, EmbeddingMatrix, \
+        block_rows, cos_sim_max, community_detection
+    from app.dataService.annIndex import IVFFlatIndex
+    from app.dataService.recState import DBState, StateCache, ColumnGroupCache, cols_key
+    from app.dataService.itemsetMiner import fpmax_bitset, fpmax_mlxtend, pack_columns
     from app.dataService.utils.processSQL import process_sql, decode_sql, generate_sql
     from app.dataService.utils.processSQL.decode_sql import extract_select_names, extract_agg_opts, extract_groupby_names
 # TODO: data type checking and loading before recommendation
 class queryRecommender(object):
+    AGG_OPTS = AGG_OPTS
+
     # TODO Check: handle change of database
     def __init__(self, topic_sim_th=0.55, item_sim=0.4, alpha=0.9, beta=0.5,
                  groupby_th=0.7, agg_th=0.5, sim=0.7,
                  opt_n = 1,
-                 ref_db_meta_path=os.path.join(GV.SPIDER_FOLDER, "train_spider.json")):
+                 ref_db_meta_path=os.path.join(GV.SPIDER_FOLDER, "train_spider.json"),
+                 schema_registry=None, ann_min_entities=GV.ANN_MIN_ENTITIES, ann_n_probe=GV.ANN_N_PROBE,
+                 state_memory_budget=GV.REC_STATE_MEMORY_BUDGET,
+                 itemset_engine=GV.REC_ITEMSET_ENGINE, prune_max_len=GV.REC_ITEMSET_PRUNE_MAX_LEN,
+                 use_artifacts=GV.REC_USE_ARTIFACTS, embedding_dtype=GV.EMBEDDING_DTYPE,
+                 sim_memory_limit=GV.REC_SIM_MEMORY_LIMIT, sentence_model=None):
         self.GV = GV
-        self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+        # `sentence_model`: anything with the `encode` of a SentenceTransformer (e.g. `modelWorkers.RemoteModel`)
+        self.model = sentence_model or SentenceTransformer(GV.SENTENCE_MODEL_NAME)
         # self.model = SentenceTransformer('paraphrase-MiniLM-L12-v2')
-
-        self.db_schema, self.db_names, self.tables = process_sql.get_schemas_from_json(
-            os.path.join(GV.SPIDER_FOLDER, "tables.json"))
+        # unseen strings of all callers are merged into batched `model.encode` calls
+        self.encoder = BatchEncoder(self.model)
+        # embeddings are cached in memory and on disk, only unseen strings hit the model
+        self.embeddings = EmbeddingStore(self.encoder, os.path.join(GV.EMBEDDING_CACHE_FOLDER, GV.SENTENCE_MODEL_NAME))
+
+        self.schema_registry = schema_registry or get_schema_registry()
+        self.db_schema = self.schema_registry.db_schema
+        self.db_names = self.schema_registry.db_names
+        self.tables = self.schema_registry.tables
         self.db_new_names = [re.sub(r'[0-9]+', '', n.replace("_", " ")).strip().lower() for n in
                              self.db_names]
 
@@ -43,16 +80,32 @@ class queryRecommender(object):
         self.alpha = alpha  # relevance decay for seqeuential query
         self.beta = beta
         self.opt_n = opt_n
+        self.ann_min_entities = ann_min_entities
+        self.ann_n_probe = ann_n_probe
+        self.embedding_dtype = embedding_dtype  # storage of the reference entity embeddings (`EmbeddingMatrix`)
+        self.sim_memory_limit = sim_memory_limit  # bytes per block of a blockwise similarity computation
+        if itemset_engine not in ("bitset", "fpmax"):
+            raise ValueError("unknown itemset engine: {}".format(itemset_engine))
+        self.itemset_engine = itemset_engine
+        self.prune_max_len = prune_max_len
         # --- reference database
-        with open(ref_db_meta_path, "r") as f:
-            ref_db_data = pd.DataFrame(json.load(f))
-        self.dataset = ref_db_data
-        # --- target table to search
-        # self.search_cols = search_cols
-        self.db_cache = {} # caching search results
-        self.g_cols_cache = {}
-        # ---- pre-selected
-        self.pre_sel = []
+        self.ref_db_meta_path = ref_db_meta_path
+        # only the database and the interned entities of every reference query (`RefCorpus`)
+        self.corpus = RefCorpus.load(ref_db_meta_path, self.tables, self.schema_registry.tables_path)
+        self.n_corpus_rows = len(self.corpus)  # rows from `ref_db_meta_path`, later rows were appended
+        self._corpus_lock = threading.RLock()  # serializes `add_reference_queries`
+        # --- `select`/`groupby` entities of reference queries, embedded lazily (see `_build_ref_entities`)
+        self.ref_ent_emb = None
+        self.ref_ent_index = None
+        self.ref_gb_index = None
+        # --- per-database state (db_df_bin, reference rows, column groups, itemsets, ...)
+        self.db_states = StateCache(state_memory_budget)
+        # --- semantic column groups per column list (outlive evicted states)
+        self.col_group_cache = ColumnGroupCache(GV.REC_COL_GROUP_CACHE_SIZE)
+        # --- precomputed states of all databases (`recArtifacts.py`), memory-mapped
+        self.artifacts = ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, bundle_params(self)) if use_artifacts else None
+
+    strip_table_name = staticmethod(strip_table_name)
 
     def cal_cosine_sim(self, sen0, sen1):
         """
@@ -63,19 +116,130 @@ class queryRecommender(object):
         - OUTPUT:
           - cosine similarity between sen0 and sen1
         """
-        if isinstance(sen0, list):
-            sen0 = ["".join(s.split(":")[1:]) if ":" in s else s for s in sen0]
-        elif isinstance(sen0, str):
-            sen0 = "".join(sen0.split(":")[1:]) if ":" in sen0 else sen0
-        if isinstance(sen1, list):
-            sen1 = ["".join(s.split(":")[1:]) if ":" in s else s for s in sen1]
-        elif isinstance(sen1, str):
-            sen1 = "".join(sen1.split(":")[1:]) if ":" in sen1 else sen1
-        embedd0 = self.model.encode(sen0, convert_to_tensor=True)
-        embedd1 = self.model.encode(sen1, convert_to_tensor=True)
+        embedd0 = self._encode_sen(sen0)
+        embedd1 = self._encode_sen(sen1)
         cosine_scores = util.pytorch_cos_sim(embedd0, embedd1).cpu().numpy()
         return cosine_scores
 
+    def cal_cosine_max(self, sen0, sen1):
+        """
+        - max cosine similarity of every sen0 item over the sen1 items, computed in blocks
+          of `self.sim_memory_limit` bytes (same as `np.max(self.cal_cosine_sim(sen0, sen1), axis=1)`)
+        - INPUT:
+          - sen0: list of str (or column index)
+          - sen1: list of str (or column index), not empty
+        - OUTPUT:
+          - (len(sen0),) max cosine similarity
+        """
+        return cos_sim_max(self._encode_sen(sen0), self._encode_sen(sen1), self.sim_memory_limit)
+
+    def _encode_sen(self, sen):
+        # lists and str are compared without table names, like in `cal_cosine_sim`
+        if isinstance(sen, list):
+            sen = [self.strip_table_name(s) for s in sen]
+        elif isinstance(sen, str):
+            sen = self.strip_table_name(sen)
+        return self.embeddings.encode(sen)
+
+    def _build_ref_entities(self):
+        """
+        - embed the interned `select`, `groupby` and aggregated column entities of the reference corpus once
+        - self.ref_ent_emb: `EmbeddingMatrix` of `corpus.select.vocab` (#distinct * dim),
+          stored as `self.embedding_dtype`
+        - self.ref_ent_ids: entity slot => row in `ref_ent_emb`
+        - self.ref_ent_offsets: slots of reference query i are ref_ent_offsets[i]:ref_ent_offsets[i+1]
+        - self.ref_gb_*: the same for `groupby` entities
+        - self.ref_agg: agg_opt => (offsets, ids) of the aggregated columns of every reference query,
+          ids index `self.ref_agg_emb` (`EmbeddingMatrix` of the stripped column names)
+        - large corpora (>= `ann_min_entities` distinct entities) also get an ANN index
+        """
+        if self.ref_ent_emb is not None:
+            return
+        with self._corpus_lock:
+            if self.ref_ent_emb is not None:
+                return
+            corpus = self.corpus
+            distinct_ents, distinct_gbs = corpus.select.vocab, corpus.groupby.vocab
+            ref_ent_emb = EmbeddingMatrix(self.embeddings.encode(list(distinct_ents)), self.embedding_dtype)
+            ref_gb_emb = EmbeddingMatrix(self.embeddings.encode(list(distinct_gbs)), self.embedding_dtype)
+            # one vocabulary for the aggregated columns of all operators
+            ref_agg_emb = EmbeddingMatrix(
+                self.embeddings.encode([self.strip_table_name(ent) for ent in corpus.agg(self.AGG_OPTS[0]).vocab]),
+                self.embedding_dtype)
+            if len(distinct_ents) >= self.ann_min_entities:
+                self.ref_ent_index = self._load_or_build_index("select_entities", distinct_ents, ref_ent_emb.rows())
+            if len(distinct_gbs) >= self.ann_min_entities:
+                self.ref_gb_index = self._load_or_build_index("groupby_entities", distinct_gbs, ref_gb_emb.rows())
+            self.ref_gb_emb, self.ref_agg_emb = ref_gb_emb, ref_agg_emb
+            # set last: `ref_ent_emb` marks the entities as built
+            self.ref_ent_emb = ref_ent_emb
+
+    @property
+    def ref_ent_offsets(self):
+        return self.corpus.select.offsets
+
+    @property
+    def ref_ent_ids(self):
+        return self.corpus.select.ids
+
+    @property
+    def ref_gb_offsets(self):
+        return self.corpus.groupby.offsets
+
+    @property
+    def ref_gb_ids(self):
+        return self.corpus.groupby.ids
+
+    @property
+    def ref_agg(self):
+        corpus = self.corpus
+        return {agg_opt: (corpus.agg(agg_opt).offsets, corpus.agg(agg_opt).ids) for agg_opt in self.AGG_OPTS}
+
+    def _extend_ref_entities(self, corpus):
+        """
+        - embed the entities that `corpus` (an appended version of `self.corpus`) adds
+          to the vocabularies; done before `corpus` is published, so that readers never
+          see entity ids without an embedding
+        """
+        vocab = corpus.select.vocab
+        if len(vocab) > len(self.ref_ent_emb):
+            self.ref_ent_emb, self.ref_ent_index = self._extend_ref_emb(
+                self.ref_ent_emb, self.ref_ent_index, vocab[len(self.ref_ent_emb):])
+        vocab = corpus.groupby.vocab
+        if len(vocab) > len(self.ref_gb_emb):
+            self.ref_gb_emb, self.ref_gb_index = self._extend_ref_emb(
+                self.ref_gb_emb, self.ref_gb_index, vocab[len(self.ref_gb_emb):])
+        vocab = corpus.agg(self.AGG_OPTS[0]).vocab
+        if len(vocab) > len(self.ref_agg_emb):
+            self.ref_agg_emb, _ = self._extend_ref_emb(
+                self.ref_agg_emb, None, [self.strip_table_name(ent) for ent in vocab[len(self.ref_agg_emb):]])
+
+    def _extend_ref_emb(self, emb, index, texts):
+        # new objects instead of in-place updates: readers keep a consistent (older) version
+        start = len(emb)
+        emb = emb.extended(self.embeddings.encode(list(texts)))
+        if index is not None:
+            index = copy.copy(index)
+            index.add(emb.rows(np.arange(start, len(emb))), np.arange(start, len(emb)))
+        return emb, index
+
+    def _load_or_build_index(self, name, texts, emb):
+        """
+        - ANN index over `emb` (rows embed `texts`), saved under `GV.ANN_INDEX_FOLDER`
+          and reused while `texts` (and the embedding precision) are unchanged
+        """
+        fingerprint = hashlib.sha1("\n".join(list(texts) + [self.embedding_dtype]).encode("utf-8")).hexdigest()
+        path = os.path.join(GV.ANN_INDEX_FOLDER, "{}-{}.npz".format(GV.SENTENCE_MODEL_NAME, name))
+        if os.path.isfile(path):
+            index, meta = IVFFlatIndex.load(path)
+            if str(meta.get("fingerprint")) == fingerprint:
+                index.n_probe = self.ann_n_probe
+                return index
+        index = IVFFlatIndex(n_probe=self.ann_n_probe).build(emb)
+        if not os.path.isdir(GV.ANN_INDEX_FOLDER):
+            os.makedirs(GV.ANN_INDEX_FOLDER)
+        index.save(path, fingerprint=np.array(fingerprint))
+        return index
 
     def search_sim_dbs(self, topic, search_cols):
         """
@@ -86,52 +250,202 @@ class queryRecommender(object):
         - OUTPUT:
           - dataframe of similar dbs in the dataset
         """
+        return self.get_db_state(topic, search_cols).db_df_bin
+
+    def get_db_state(self, topic, search_cols):
+        """
+        - cached `DBState` of a database, built on the first request
+        - INPUT:
+          - topic: table/db name (str)
+          - search_cols: input table columns (list)
+        - OUTPUT:
+          - DBState (from the artifact bundle when it has one for these inputs)
+        """
+        key = (topic, cols_key(search_cols))
+        state = self.db_states.get_or_build(
+            key, lambda: self._load_db_state(key) or self._build_db_state(topic, search_cols))
+        if state.n_ref_rows < len(self.corpus):
+            # loaded from the bundle, or built while reference queries were appended
+            state = self._refresh_db_state(state)
+        return state
+
+    def _load_db_state(self, key):
+        """
+        - precomputed state from the artifact bundle (None if not available)
+        """
+        if self.artifacts is None:
+            return None
+        state = self.artifacts.state(key)
+        if state is not None:
+            # the bundle covers the corpus file, not the queries appended since
+            state.n_ref_rows = self.n_corpus_rows
+        return state
+
+    def find_db_state(self, db_df_bin):
+        """
+        - cached `DBState` that owns `db_df_bin` (None if it was evicted)
+        """
+        for state in self.db_states.values():
+            if state.db_df_bin is db_df_bin:
+                return state
+        return None
+
+    def _state_of(self, db_df_bin):
+        state = self.find_db_state(db_df_bin)
+        if state is None:
+            raise ValueError("db_df_bin has no cached state, get it from `get_db_state`/`search_sim_dbs`")
+        return state
+
+    def _build_db_state(self, topic, search_cols):
+        state = DBState(topic, search_cols)
         ############## cluster input columns based on their semantic meanings
-        cols_groups = self.get_grouped_cols(search_cols)
-        self.g_cols_cache = cols_groups
+        state.col_groups = self.get_grouped_cols(state.search_cols)
         #################################################
 
-        if topic in self.db_cache.keys():
-            return self.db_cache[topic]
-
-        self.search_cols = search_cols
-        sim_scores = self.cal_cosine_sim(topic, self.db_new_names)[0]
-        related_db_names = [self.db_names[i] for i in np.where(sim_scores > self.topic_sim_th)[0]]
+        corpus = self.corpus
+        related_db_names = self._related_db_names(topic)
         print(f"related_db_names: {related_db_names}")
-        row_sims = []
-        rowids = []
-        for rowid, row in self.dataset.iterrows():
-            if row["db_id"] in related_db_names:
-                rowids.append(rowid)
-                # entity in `select` clause
-                # print(row["sql"])
-                select_decoded = decode_sql(row["sql"], self.tables[row["db_id"]])["select"]
-                select_ents = extract_select_names(select_decoded)
-                # calculate similarity between `select` items and `select` cols
-                row_sim = self.cal_cosine_sim(self.search_cols, select_ents)
-                row_sims.append(np.max(row_sim, axis=1))
-        db_df_bin = pd.DataFrame(np.where(np.array(row_sims) > self.item_sim, 1, 0),
-                                 columns=self.search_cols)
-        self.ref_db = (self.dataset.loc[rowids]).reset_index(drop=True)
-        sim_sum = [sum(db_df_bin[col]) for col in db_df_bin.columns]
-        db_df_bin = db_df_bin[db_df_bin.columns[(-np.array(sim_sum)).argsort()]]
+        rowids = corpus.rows_of(related_db_names)
+        row_hits = self._ref_row_hits(state.search_cols, rowids)
+        db_df_bin = pd.DataFrame(np.where(row_hits, 1, 0),
+                                 columns=state.search_cols)
+        self._set_ref_rows(state, db_df_bin, rowids, len(corpus))
         ######################################################################
-        
-        self.db_cache[topic] = db_df_bin
-        return db_df_bin
+        return state
+
+    def _related_db_names(self, topic):
+        """
+        - reference databases whose (cleaned) name is similar to the topic
+        """
+        sim_scores = self.cal_cosine_sim(topic, self.db_new_names)[0]
+        return [self.db_names[i] for i in np.where(sim_scores > self.topic_sim_th)[0]]
+
+    def _ref_row_hits(self, search_cols, rowids):
+        """
+        - OUTPUT:
+          - (len(rowids), len(search_cols)) bool: reference query `rowids[i]` selects an entity
+            similar (> `item_sim`) to column j
+        """
+        # similarity between `select` items of the related reference queries and `select` cols:
+        # one product against the entity matrix, then a max over each query's entity segment
+        self._build_ref_entities()
+        slots, row_offsets = gather_segments(self.ref_ent_offsets, rowids)
+        col_emb = normalize_rows(self.embeddings.encode([self.strip_table_name(c) for c in search_cols]))
+        # wide schemas: columns are scored in blocks of at most `sim_memory_limit` bytes of similarities
+        row_hits = np.zeros((len(rowids), len(col_emb)), dtype=bool)
+        if self.ref_ent_index is None:
+            step = block_rows(len(slots) * 4, self.sim_memory_limit)
+            for start in range(0, len(col_emb), step):
+                ent_sim = self.ref_ent_emb.sim(col_emb[start:start + step], self.ref_ent_ids[slots])
+                row_hits[:, start:start + step] = segment_max(ent_sim, row_offsets, fill=-1.0).T > self.item_sim
+        else:
+            # approximate: entities above `item_sim` come from the ANN index (restricted to related queries)
+            allowed = np.zeros(len(self.ref_ent_emb), dtype=bool)
+            allowed[self.ref_ent_ids[slots]] = True
+            step = block_rows(len(self.ref_ent_emb) + len(slots), self.sim_memory_limit)
+            for start in range(0, len(col_emb), step):
+                block = col_emb[start:start + step]
+                ent_hit = np.zeros((len(block), len(self.ref_ent_emb)), dtype=np.uint8)
+                for cid, (ids, _) in enumerate(self.ref_ent_index.range_search(block, self.item_sim, allowed=allowed)):
+                    ent_hit[cid, ids] = 1
+                row_hits[:, start:start + step] = segment_max(ent_hit[:, self.ref_ent_ids[slots]], row_offsets).T > 0
+        return row_hits
+
+    @staticmethod
+    def _set_ref_rows(state, db_df_bin, rowids, n_ref_rows):
+        """
+        - set `db_df_bin` (in `search_cols` order) and the reference rows behind it on the state,
+          columns are ordered by decreasing number of hits
+        """
+        state.ref_rowids = rowids
+        state.n_ref_rows = n_ref_rows
+        sim_sum = db_df_bin.values.sum(axis=0)
+        state.db_df_bin = db_df_bin[db_df_bin.columns[(-np.array(sim_sum)).argsort()]]
+        state.col_bits = pack_columns(state.db_df_bin)
+        state.col_pos = {c: i for i, c in enumerate(state.db_df_bin.columns)}
+
+    def add_reference_queries(self, records):
+        """
+        - append reference queries (e.g. logged user queries) to the reference corpus at runtime
+        - derived structures are updated incrementally: only the new queries are decoded
+          (`RefCorpus.appended`), only unseen entities are embedded, and cached states of related databases get the new
+          `db_df_bin` rows (their mined itemsets and context scores start over); other states are kept
+        - INPUT:
+          - records: list of dicts in the format of `train_spider.json`, at least `db_id` and
+            the parsed `sql` (`SQLParser.parse_sql(query, db_id)["sql_parse"]`)
+        - OUTPUT:
+          - keys of the updated states
+        """
+        for record in records:
+            if record.get("db_id") not in self.tables:
+                raise ValueError("unknown database: {}".format(record.get("db_id")))
+            if not isinstance(record.get("sql"), dict):
+                raise ValueError("reference queries need the parsed `sql`")
+        if len(records) == 0:
+            return []
+        with self._corpus_lock:
+            corpus = self.corpus.appended(records, self.tables)
+            if self.ref_ent_emb is not None:
+                self._extend_ref_entities(corpus)
+            # the corpus is swapped last: a reader that sees the new rows also sees their embeddings
+            self.corpus = corpus
+            updated = []
+            for state in self.db_states.values():
+                if self._refresh_db_state(state) is not state:
+                    updated.append(state.key)
+            return updated
+
+    def _refresh_db_state(self, state):
+        """
+        - `_extend_db_state` + replace the cached state
+        """
+        with self._corpus_lock:
+            new_state = self._extend_db_state(state)
+            if new_state is not state:
+                self.db_states.put(new_state)
+            return new_state
+
+    def _extend_db_state(self, state):
+        """
+        - bring a state up to date with the corpus rows appended since it was built
+        - OUTPUT:
+          - state itself if none of the new rows is related, else a new DBState with the new
+            `db_df_bin` rows (and the column groups of `state`)
+        """
+        corpus = self.corpus
+        if state.n_ref_rows >= len(corpus):
+            return state
+        rowids = corpus.rows_of(self._related_db_names(state.topic), start=state.n_ref_rows)
+        if len(rowids) == 0:
+            state.n_ref_rows = len(corpus)
+            return state
+        row_hits = self._ref_row_hits(state.search_cols, rowids)
+        db_df_bin = pd.DataFrame(np.vstack([state.db_df_bin[state.search_cols].values, np.where(row_hits, 1, 0)]),
+                                 columns=state.search_cols)
+        new_state = DBState(state.topic, state.search_cols)
+        new_state.col_groups = state.col_groups
+        new_state.pre_sel = state.pre_sel
+        self._set_ref_rows(new_state, db_df_bin, np.concatenate([state.ref_rowids, rowids]), len(corpus))
+        return new_state
 
     def get_grouped_cols(self, columns, min_size = 2, th = 0.8):
-        corpus_embeddings = self.model.encode(columns, convert_to_tensor=False)
-        clusters = util.community_detection(corpus_embeddings, min_community_size = min_size, threshold = th, init_max_size=3)
-        col_groups = [set([columns[c] for c in cluster]) for cluster in clusters]
+        """
+        - semantic column groups (cached per column list, see `ColumnGroupCache`) + `GV.col_combo`
+        """
+        col_groups = self.col_group_cache.get(
+            list(columns), min_size, th, self.embeddings.encode,
+            lambda emb, size, th_: community_detection(emb, th_, size, self.sim_memory_limit))
         col_groups += GV.col_combo
         # print("col_groups: ", col_groups)
         return col_groups
 
 
-    def get_freq_combo(self, df, filter_set=set([]), support=None, max_len = 3):
+    def get_freq_combo(self, df, filter_set=set([]), support=None, max_len = 3, state=None):
         """
         - input: dataframe (m * n) => binary values
+               - state: `DBState` whose `db_df_bin` contains df's columns; mined itemsets
+                 are cached there and column subsets are derived from cached supersets
+               - max_len: only applied while mining if `self.prune_max_len` is set
         - output: frequent combo => columns: support, itemsets, itemlen
         """
         # print("max_len: ", max_len)
@@ -139,7 +453,17 @@ class queryRecommender(object):
         # (choose `fpgrowth` for flexible itemset selection based on itemset lengths)
         if support is None:
             support = self.item_sim
-        freq_combo = fpmax(df, min_support=support, use_colnames=True)
+        max_len = max_len if self.prune_max_len else None
+        if self.itemset_engine == "bitset":
+            miner = lambda d, s: fpmax_bitset(d, min_support=s, max_len=max_len)
+        else:
+            miner = lambda d, s: fpmax_mlxtend(d, min_support=s, max_len=max_len)
+        if state is None:
+            freq_combo = miner(df, support)
+        else:
+            freq_combo = state.itemsets.mine(df, support, miner, max_len=max_len,
+                                             pin=df.shape[1] == state.db_df_bin.shape[1])
+            self.db_states.evict()
         # freq_combo = fpgrowth(df, min_support=support, use_colnames=True, max_len = max_len)
         freq_combo["itemlen"] = freq_combo["itemsets"].apply(len)
         # (DONE): adjust ranking according to both itemset lengths AND itemsets support: (log2(item length)+1) * support
@@ -158,15 +482,17 @@ class queryRecommender(object):
         # exit()
         return freq_combo
 
-    def get_opts(self, df, cols, groupby_contexts=[], agg_contexts=[], top_n = 1):
+    def get_opts(self, df, cols, groupby_contexts=[], agg_contexts=[], top_n = 1, state=None):
         """
         recommend  `groupby` & `agg_opt` items
         `agg_opt` items: `avg`, `min`, `max`, `count`, `sum`
         - input: binary feature vectors (size: db_col_num * input_col_num) for input table cols
               - top_n: limit return results
+              - state: `DBState` of `df` (looked up from `df` if not given)
         - output: `groupby` cols ([col1, col2]), `agg_opt` lists ([{"opt": "col"}, {}])
         """
-        agg_opts = ['max', 'min', 'count', 'sum', 'avg']
+        state = state or self._state_of(df)
+        agg_opts = self.AGG_OPTS
         groupby_sugg = []
         agg_sugg = []
 
@@ -183,7 +509,7 @@ class queryRecommender(object):
             # calculate `groupby` context relecance (between remaining cols and groupby contexts)
             if len(groupby_contexts)>0:
                 df_col_diff = df.columns.difference(set(groupby_contexts))
-                groupby_c_sim = np.max(self.cal_cosine_sim(groupby_contexts, df_col_diff), axis=0)
+                groupby_c_sim = self.cal_cosine_max(df_col_diff, groupby_contexts)
                 # print(f"groupby_c_sim: {groupby_c_sim}", groupby_c_sim.shape)
                 df_col_diff = df_col_diff[(-groupby_c_sim).argsort()]
                 groupby_c_sim = groupby_c_sim[(-groupby_c_sim).argsort()]
@@ -197,26 +523,27 @@ class queryRecommender(object):
         
         # print(f"groupby_contexts = {groupby_contexts}, agg_contexts = {agg_contexts}")
 
+        self._build_ref_entities()
+        # `agg` contexts of every operator, embedded once for all column sets
+        ctx_agg = [[str(a) for agg_c in agg_contexts if agg_opt in agg_c.keys() for a in agg_c[agg_opt]]
+                   for agg_opt in agg_opts]
+        ctx_agg_offsets = np.concatenate([[0], np.cumsum([len(a) for a in ctx_agg])]).astype(np.int64)
+        ctx_agg_emb = np.zeros((0, self.ref_agg_emb.shape[1]), dtype=np.float32)
+        if ctx_agg_offsets[-1] > 0:
+            ctx_agg_emb = normalize_rows(self.embeddings.encode(sum(ctx_agg, [])))
+        # rows matching a column set come from AND-ing the columns' row bitmaps
+        if df is state.db_df_bin:
+            col_bits, col_pos = state.col_bits, state.col_pos
+        else:
+            col_bits, col_pos = pack_columns(df), {c: i for i, c in enumerate(df.columns)}
+        df_col_emb = normalize_rows(self.embeddings.encode(list(df.columns)))
         for _, col in enumerate(cols):
-            col_mul = np.prod(df[col], axis=1)
-            col_mul_idx = np.where(col_mul == 1)[0]
-            all_groupby_names = []
-            agg_list = []
-            for rowid, row in self.ref_db.iloc[col_mul_idx].iterrows():
-                db_id = row["db_id"]
-                table = self.tables[db_id]
-                sql = row["sql"]
-                # extract `groupby` entities
-                # groupby_decoded = decode_sql.decode_groupby(sql["groupBy"], table)
-                groupby_decoded = decode_sql(sql, table)["groupBy"]
-                groupby_names = extract_groupby_names(groupby_decoded)
-                # extract `agg` operations
-                select_decoded = decode_sql(sql, table)["select"]
-                # select_decoded = decode_sql.decode_select(sql, table)
-                agg_dict = extract_agg_opts(select_decoded)
-                agg_list.append(agg_dict)
-                if len(groupby_names) > 0:
-                    all_groupby_names.append(groupby_names)
+            col_mul_idx = np.flatnonzero(
+                np.unpackbits(np.bitwise_and.reduce(col_bits[[col_pos[c] for c in col]], axis=0))[:len(df)])
+            rowids = state.ref_rowids[col_mul_idx]
+            # `groupby` entities of the matching reference queries
+            gb_slots, gb_offsets = gather_segments(self.ref_gb_offsets, rowids)
+            n_groupby = np.count_nonzero(np.diff(gb_offsets))
             # `groupby` entity suggestion
             # TODO: Thresholds `groupby` confidence support and similarity
             # TODO: Whether context/history `groupby` opts should be included in the next `groupby` opt? - Current: remove context/history opt
@@ -224,11 +551,15 @@ class queryRecommender(object):
             # calculate db `groupby` relevance
             gb_sugg = []
             if len(col_mul_idx) > 0:
-                if len(all_groupby_names) / len(
-                        col_mul_idx) > self.groupby_th:  # confidence thresholds
-                    # print(all_groupby_names)
-                    groupby_sim = np.max(
-                        self.cal_cosine_sim(np.concatenate(all_groupby_names), df.columns), axis=0)
+                if n_groupby / len(col_mul_idx) > self.groupby_th:  # confidence thresholds
+                    gb_ids = np.unique(self.ref_gb_ids[gb_slots])
+                    if self.ref_gb_index is None:
+                        groupby_sim = np.max(self.ref_gb_emb.sim(df_col_emb, gb_ids), axis=1)
+                    else:
+                        # approximate: nearest `groupby` entity of the matching reference queries
+                        allowed = np.zeros(len(self.ref_gb_emb), dtype=bool)
+                        allowed[gb_ids] = True
+                        groupby_sim = self.ref_gb_index.search(df_col_emb, k=1, allowed=allowed)[0][:, 0]
                     groupby_cols = df.columns[(-groupby_sim).argsort()]
                     groupby_sim = groupby_sim[(-groupby_sim).argsort()]
                     gb_sugg = list(
@@ -249,18 +580,23 @@ class queryRecommender(object):
             # `agg` entity suggestion
             # TODO: Thresholds `agg` confidence support and similarity
             # TODO: (DOING) limit return results of `agg`
-            agg_df = pd.DataFrame(agg_list).head()
-            # print(agg_df.head())
             agg_sugg_dict = {}
             if len(col_mul_idx) > 0:
-                for agg_opt in agg_opts:
+                # aggregated columns of the first 5 matching reference queries, per operator
+                agg_slots = {agg_opt: gather_segments(self.ref_agg[agg_opt][0], rowids[:5])
+                             for agg_opt in agg_opts}
+                agg_ids = np.concatenate([self.ref_agg[agg_opt][1][agg_slots[agg_opt][0]] for agg_opt in agg_opts])
+                agg_id_offsets = np.concatenate([[0], np.cumsum([len(agg_slots[agg_opt][0]) for agg_opt in agg_opts])])
+                # one similarity product for the context and reference aggregates of every operator
+                col_emb = normalize_rows(self.embeddings.encode([self.strip_table_name(c) for c in col]))
+                agg_sim = np.vstack([ctx_agg_emb, self.ref_agg_emb.rows(agg_ids)]) @ col_emb.T
+                ctx_agg_sim, ref_agg_sim = agg_sim[:len(ctx_agg_emb)], agg_sim[len(ctx_agg_emb):]
+                for opt_id, agg_opt in enumerate(agg_opts):
                     # print("agg_opt: ", agg_opt)
                     # calculate `agg` context relevance
                     ################################################################
-                    agg_l = [agg_c[agg_opt] for agg_c in agg_contexts if agg_opt in agg_c.keys()]
-                    agg_l = np.concatenate(agg_l) if len(agg_l) > 0 else agg_l
-                    if len(agg_l) > 0:
-                        agg_context_sim = np.max(self.cal_cosine_sim(agg_l, col), axis=0)
+                    if ctx_agg_offsets[opt_id + 1] > ctx_agg_offsets[opt_id]:
+                        agg_context_sim = np.max(ctx_agg_sim[ctx_agg_offsets[opt_id]:ctx_agg_offsets[opt_id + 1]], axis=0)
                         agg_col = [col[aid] for aid, a_sim in enumerate(agg_context_sim) if
                                    a_sim > self.item_sim]
                         if agg_opt != "count":
@@ -274,20 +610,14 @@ class queryRecommender(object):
                         # print("type(agg_col)",type(agg_col), agg_col, agg_sugg_dict[agg_opt])
                     ################################################################
                     # calculate db `agg` relevance
-                    agg_num = 0
-                    a_l = []
-                    for agg in agg_df[agg_opt].values:
-                        if len(agg) > 0:
-                            agg_num += 1
-                            a_l += agg
+                    agg_num = np.count_nonzero(np.diff(agg_slots[agg_opt][1]))
                     # print("---"*10)
                     # print("agg_num, len(col_mul_idx): ", agg_num, len(col_mul_idx))
                     # print("---"*10)
                     # if agg_num / len(col_mul_idx) > self.agg_th:
                     if agg_num > 0:
                         # agg_sugg_dict[agg_opt] = []
-                        # print("a_l, col: ", a_l, col)
-                        agg_c_sim = np.mean(self.cal_cosine_sim(a_l, col), axis=0)
+                        agg_c_sim = np.mean(ref_agg_sim[agg_id_offsets[opt_id]:agg_id_offsets[opt_id + 1]], axis=0)
                         for g_sim, c in zip(agg_c_sim, col):
                             if g_sim > self.agg_th:
                                 if agg_opt not in agg_sugg_dict.keys():
@@ -314,10 +644,48 @@ class queryRecommender(object):
         # print("agg_sugg: ", agg_sugg)
         return groupby_sugg, agg_sugg
 
+    def _context_scores(self, db_df_bin, sel_contexts, state):
+        """
+        - decayed relevance of every `db_df_bin` column to a `select` history:
+          score_i = alpha * score_(i-1) + semantic_sim_i + beta * db_relevance_i
+          (empty contexts only decay the score)
+        - scores are cached on the state per history prefix, so a request that extends
+          an earlier history only scores its new contexts
+        - OUTPUT:
+          - (#columns,) scores, in `db_df_bin.columns` order
+        """
+        columns = db_df_bin.columns
+        prefix = hashlib.sha1()
+        keys = []
+        for context in sel_contexts:
+            prefix.update(json.dumps(list(context)).encode("utf-8"))
+            keys.append(prefix.hexdigest())
+        start, scores = state.cached_scores(keys)
+        if scores is None:
+            scores = np.zeros(len(columns))
+        for i in range(start, len(sel_contexts)):
+            context = sel_contexts[i]
+            scores = scores * self.alpha
+            if len(context) > 0:
+                # 1. consider semantic similarity
+                semantic_sim_scores = self.cal_cosine_max(columns, context)
+                # 2. consider cosine similarity between feature vectors (relevance vector to the database)
+                if db_df_bin is state.db_df_bin:
+                    # precomputed column * column similarity of the state
+                    db_relevance = np.max(state.cooccurrence([state.col_pos[c] for c in context],
+                                                             self.sim_memory_limit), axis=1)
+                else:
+                    db_relevance = np.max(cosine_similarity(db_df_bin.T, db_df_bin[context].T), axis=1)
+                # 3. average similarity based on semantic similarity and db relevance
+                scores = scores + semantic_sim_scores + self.beta * db_relevance
+            state.remember_scores(keys[i], scores)
+        return scores
+
     def query_suggestion(self, db_df_bin, context_dict={"select": [], "groupby": [], "agg": []},
-                         min_support=None, top_n=5, max_len = 3):
+                         min_support=None, top_n=5, max_len = 3, state=None):
         """
         max_len: max query entity # per query
+        state: `DBState` of `db_df_bin` (looked up from `db_df_bin` if not given)
         TODO: 
         0. drill down and up in existing query items
         1. consider clustering input columns based on their semantics and operate cols on cluster levels
@@ -326,6 +694,7 @@ class queryRecommender(object):
         consider decreasing the rank of unselected recommended items
         4. ranking considering `groupby` and `opt` items
         """
+        state = state or self._state_of(db_df_bin)
         support = self.item_sim if min_support is None else min_support
         # `select`, `agg`, `groupby`
         sel_contexts = context_dict["select"]
@@ -333,7 +702,7 @@ class queryRecommender(object):
         groupby_contexts = context_dict["groupby"]
         # STEP ONE: initial recommendation
         if len(sel_contexts) == 0:
-            freq_combo = self.get_freq_combo(db_df_bin, set([]), support, max_len = max_len)
+            freq_combo = self.get_freq_combo(db_df_bin, set([]), support, max_len = max_len, state=state)
             union_set = frozenset().union(*freq_combo["itemsets"].values)
             next_cols = [list(v) for v in freq_combo["itemsets"].values]
             # print("freq_combo: ", freq_combo)
@@ -352,7 +721,7 @@ class queryRecommender(object):
                         if sum([col in c for c in cols_supp]) == 0:
                             curr_set = [col]
                             # check `max_len` constraints
-                            for c in self.g_cols_cache:
+                            for c in state.col_groups:
                                 if col in c:
                                     curr_set += list(c.difference([col]))[:max_len-2]
                             # print("curr_set: ", curr_set)
@@ -380,17 +749,16 @@ class queryRecommender(object):
         context_cols = np.concatenate(sel_contexts)
         rest_cols = columns.difference(context_cols)
         
-        all_sims = np.zeros(len(rest_cols))
         ########################################################################
         # get `groupby` and `agg_opt` items (NEW)
         opt_flag = False
         if len(sel_contexts) > 0:
             if len(sel_contexts[-1]) > 0:
-                if set(self.pre_sel) != set(sel_contexts[-1]):
+                if set(state.pre_sel) != set(sel_contexts[-1]):
                     groupby_sugg, agg_sugg = self.get_opts(db_df_bin, [sel_contexts[-1]], groupby_contexts,
-                                                        agg_contexts, self.opt_n)
-                    # print("sel_contexts[-1], self.pre_sel: ", sel_contexts[-1], self.pre_sel)
-                    self.pre_sel = sel_contexts[-1]
+                                                        agg_contexts, self.opt_n, state=state)
+                    # print("sel_contexts[-1], state.pre_sel: ", sel_contexts[-1], state.pre_sel)
+                    state.pre_sel = sel_contexts[-1]
                     if len(groupby_sugg[0]) > 0 or bool(agg_sugg[0]):
                         opt_flag = True
                         if bool(agg_sugg[0]):
@@ -398,7 +766,7 @@ class queryRecommender(object):
                         else:
                             sel_pre = [sel_contexts[-1]]
                         print("---"*10)
-                        # print("sel_contexts, self.pre_sel: ", sel_contexts, self.pre_sel)
+                        # print("sel_contexts, state.pre_sel: ", sel_contexts, state.pre_sel)
                         print("prev cols, groupby_sugg, agg_sugg: ", sel_contexts[-1], groupby_sugg, agg_sugg)
                         print("---"*10)
         # 
@@ -408,24 +776,8 @@ class queryRecommender(object):
         #     print("operations for queried items: ", context_cols, groupby_sugg_, agg_sugg_)
         ########################################################################
 
-        for contextid, context in enumerate(sel_contexts):
-            # print()
-            # print("context: ", context)
-            # print()
-            if len(context)>0:
-                # 1. consider semantic similarity
-                semantic_sim_scores = np.max(self.cal_cosine_sim(rest_cols, context),
-                                            axis=1) * math.pow(self.alpha,
-                                                                len(sel_contexts) - contextid - 1)
-                # print("semantic_sim_scores: ", semantic_sim_scores)
-                # 2. consider cosine similarity between feature vectors (relevance vector to the database)
-                db_col_feat = db_df_bin[rest_cols].T
-                context_feat = db_df_bin[context].T
-                db_relevance = np.max(cosine_similarity(db_col_feat, context_feat), axis=1) * math.pow(
-                    self.alpha, len(sel_contexts) - contextid - 1)
-                # print("db_relevance: ", db_relevance)
-                # 3. average similarity based on semantic similarity and db relevance
-                all_sims += semantic_sim_scores + self.beta * db_relevance
+        # decayed relevance of the columns to the whole `select` history
+        all_sims = self._context_scores(db_df_bin, sel_contexts, state)[columns.get_indexer(rest_cols)]
         # print("all_sims: ", all_sims, rest_cols)
         rest_cols = rest_cols[(-all_sims).argsort()]
         top_n_rest_cols = rest_cols[:top_n]
@@ -433,11 +785,12 @@ class queryRecommender(object):
         # support = support * math.pow(self.alpha, len(sel_contexts))
         # print(f"support: {support}")
 
-        # print(self.g_cols_cache)
+        # print(state.col_groups)
         # print("top_n_rest_cols: ", top_n_rest_cols)
 
         freq_combo = self.get_freq_combo(db_df_bin[list(context_cols) + list(top_n_rest_cols)],
-                                         filter_set=set(context_cols), support=support, max_len = max_len)
+                                         filter_set=set(context_cols), support=support, max_len = max_len,
+                                         state=state)
         freq_cols = [list(v) for v in freq_combo["itemsets"].values if len(v) > 0]
         ##########################################
         for col in rest_cols:
@@ -447,7 +800,7 @@ class queryRecommender(object):
                     total_cols = np.concatenate(freq_cols)
                 if col not in total_cols:
                     curr_set = [col]
-                    for c in self.g_cols_cache:
+                    for c in state.col_groups:
                         if col in c:
                             curr_set += list(c.difference([col]))[:max_len-2]
                     # print("col not in total cols: ", curr_set)
@@ -0,0 +1,251 @@
+"""
+Offline recommender artifacts: the per-database state that the first `/sql_sugg` request of a
+database would otherwise build (`db_df_bin`, reference rows, column groups and the maximal
+itemsets behind the empty-context suggestions), precomputed for every database.
+
+    cd backend/app/dataService && python recArtifacts.py [--workers 8] [--db_ids cinema,store_1]
+
+Bundle layout (`GV.REC_ARTIFACT_FOLDER`):
+  - manifest.json: bundle version, build parameters and one entry per database
+  - col_bits.npy: packed row bitmaps of the `db_df_bin` columns of all databases (uint8, flat)
+  - rowids.npy: reference corpus rows behind every `db_df_bin` (int64, flat)
+The arrays are memory-mapped on load; a bundle whose parameters differ from the
+recommender's (model, thresholds, corpus and schema files) is ignored.
+"""
+import os
+import json
+import shutil
+import argparse
+import multiprocessing
+from time import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import globalVariable as GV
+    from recState import DBState
+    from refCorpus import file_stamp
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.recState import DBState
+    from app.dataService.refCorpus import file_stamp
+
+BUNDLE_VERSION = 3
+
+
+def bundle_params(qr, supports=GV.REC_ARTIFACT_SUPPORTS):
+    """
+    - everything the artifacts depend on; a bundle is only used if these match exactly
+    """
+    return {
+        "version": BUNDLE_VERSION,
+        "model": GV.SENTENCE_MODEL_NAME,
+        "corpus": file_stamp(qr.ref_db_meta_path),
+        "tables": file_stamp(qr.schema_registry.tables_path),
+        "topic_sim_th": qr.topic_sim_th,
+        "item_sim": qr.item_sim,
+        "ann": [qr.ann_min_entities, qr.ann_n_probe],
+        "prune_max_len": bool(qr.prune_max_len),
+        "embedding_dtype": qr.embedding_dtype,
+        "supports": list(supports),
+    }
+
+
+def db_topic(db_id):
+    # as `DataService.sql_suggest`
+    return db_id.replace("_", " ").strip()
+
+
+def build_db_artifact(qr, db_id, supports=GV.REC_ARTIFACT_SUPPORTS):
+    """
+    - INPUT:
+      - qr: queryRecommender
+      - db_id: database id
+    - OUTPUT:
+      - dict with the state of `db_id`, searched with all its columns (`SchemaRegistry.get_db_cols`)
+    """
+    state = qr.get_db_state(db_topic(db_id), qr.schema_registry.get_db_cols(db_id))
+    for support in supports:
+        # mines (and pins) the itemsets of the full column set, like a request without context
+        qr.query_suggestion(state.db_df_bin, {"select": [], "groupby": [], "agg": []}, support, state=state)
+    itemsets = []
+    for (_, support, max_len), freq_combo in state.itemsets.pinned():
+        itemsets.append({"support": support, "max_len": max_len,
+                         "itemsets": [sorted(s) for s in freq_combo["itemsets"].values],
+                         "supports": [float(s) for s in freq_combo["support"].values]})
+    n_groups = len(state.col_groups) - len(GV.col_combo)
+    artifact = {
+        "db_id": db_id,
+        "topic": state.topic,
+        "search_cols": state.search_cols,
+        "columns": list(state.db_df_bin.columns),
+        "n_rows": len(state.db_df_bin),
+        "col_groups": [list(g) for g in state.col_groups[:n_groups]],
+        "itemsets": itemsets,
+        "rowids": np.asarray(state.ref_rowids, dtype=np.int64),
+        "col_bits": np.asarray(state.col_bits, dtype=np.uint8),
+    }
+    qr.db_states.pop(state.key)
+    return artifact
+
+
+_worker_qr = None
+
+
+def _init_worker(rec_kwargs):
+    global _worker_qr
+    try:
+        from queryRec import queryRecommender
+    except ImportError:
+        from app.dataService.queryRec import queryRecommender
+    _worker_qr = queryRecommender(**rec_kwargs)
+    # the parent owns the on-disk embedding store
+    _worker_qr.embeddings.read_only = True
+
+
+def _build_in_worker(args):
+    db_id, supports = args
+    return build_db_artifact(_worker_qr, db_id, supports)
+
+
+def write_bundle(path, params, artifacts):
+    """
+    - write the bundle next to `path` and swap it in, so readers never see a partial bundle
+    """
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    artifacts = sorted(artifacts, key=lambda a: a["db_id"])
+    dbs = {}
+    bits_offset, row_offset = 0, 0
+    for a in artifacts:
+        dbs[a["db_id"]] = {
+            "topic": a["topic"], "search_cols": a["search_cols"], "columns": a["columns"],
+            "n_rows": a["n_rows"], "col_groups": a["col_groups"], "itemsets": a["itemsets"],
+            "bits": [bits_offset, bits_offset + a["col_bits"].size] + list(a["col_bits"].shape),
+            "rows": [row_offset, row_offset + len(a["rowids"])],
+        }
+        bits_offset += a["col_bits"].size
+        row_offset += len(a["rowids"])
+    np.save(os.path.join(tmp_path, "col_bits.npy"),
+            np.concatenate([a["col_bits"].ravel() for a in artifacts] + [np.zeros(0, dtype=np.uint8)]))
+    np.save(os.path.join(tmp_path, "rowids.npy"),
+            np.concatenate([a["rowids"] for a in artifacts] + [np.zeros(0, dtype=np.int64)]))
+    # the manifest is written last: a bundle without one is incomplete
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump({"params": params, "dbs": dbs}, f)
+    old_path = path.rstrip(os.sep) + ".old"
+    if os.path.isdir(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    if os.path.isdir(old_path):
+        shutil.rmtree(old_path)
+
+
+def build_bundle(path=GV.REC_ARTIFACT_FOLDER, db_ids=None, workers=None, supports=GV.REC_ARTIFACT_SUPPORTS,
+                 **rec_kwargs):
+    """
+    - build the artifacts of `db_ids` (default: all databases) with `workers` processes
+    - INPUT:
+      - rec_kwargs: `queryRecommender` parameters (thresholds, ...)
+    - OUTPUT:
+      - manifest params
+    """
+    try:
+        from queryRec import queryRecommender
+    except ImportError:
+        from app.dataService.queryRec import queryRecommender
+    qr = queryRecommender(use_artifacts=False, **rec_kwargs)
+    db_ids = list(db_ids or qr.db_names)
+    params = bundle_params(qr, supports)
+    # embed everything the workers look up once, here, so they only read the shared embedding store
+    qr._build_ref_entities()
+    qr.embeddings.encode(qr.db_new_names + [db_topic(db_id) for db_id in db_ids])
+    for db_id in db_ids:
+        cols = qr.schema_registry.get_db_cols(db_id)
+        qr.embeddings.encode(cols + [qr.strip_table_name(c) for c in cols])
+    workers = workers or multiprocessing.cpu_count()
+    if workers <= 1 or len(db_ids) <= 1:
+        artifacts = [build_db_artifact(qr, db_id, supports) for db_id in db_ids]
+    else:
+        rec_kwargs = dict(rec_kwargs, use_artifacts=False)
+        # spawn: the parent already runs encoder threads, which must not be forked
+        with multiprocessing.get_context("spawn").Pool(min(workers, len(db_ids)), initializer=_init_worker,
+                                                       initargs=(rec_kwargs,)) as pool:
+            artifacts = pool.map(_build_in_worker, [(db_id, supports) for db_id in db_ids], chunksize=1)
+    write_bundle(path, params, artifacts)
+    return params
+
+
+class ArtifactBundle(object):
+    """
+    - read side of a bundle: manifest in memory, arrays memory-mapped
+    """
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.params = manifest["params"]
+        self.dbs = manifest["dbs"]
+        self.col_bits = np.load(os.path.join(path, "col_bits.npy"), mmap_mode="r")
+        self.rowids = np.load(os.path.join(path, "rowids.npy"), mmap_mode="r")
+        self._by_key = {}
+        for db_id, entry in self.dbs.items():
+            self._by_key[DBState(entry["topic"], entry["search_cols"]).key] = db_id
+
+    def __len__(self):
+        return len(self.dbs)
+
+    @classmethod
+    def load(cls, path, params):
+        """
+        - OUTPUT:
+          - ArtifactBundle, or None if there is no complete bundle built with `params`
+        """
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.isfile(manifest_path):
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("params") != params:
+            print("recommender artifacts in {} are outdated, rebuild them with recArtifacts.py".format(path))
+            return None
+        return cls(path, manifest)
+
+    def state(self, key):
+        """
+        - INPUT:
+          - key: `DBState.key`
+        - OUTPUT:
+          - DBState (with its itemsets pinned), or None if the bundle has no such state
+        """
+        db_id = self._by_key.get(key)
+        if db_id is None:
+            return None
+        entry = self.dbs[db_id]
+        state = DBState(entry["topic"], entry["search_cols"])
+        start, end, n_cols, n_bytes = entry["bits"]
+        state.col_bits = self.col_bits[start:end].reshape(n_cols, n_bytes)
+        bits = np.unpackbits(state.col_bits, axis=1)[:, :entry["n_rows"]].T
+        state.db_df_bin = pd.DataFrame(bits.astype(np.int64), columns=entry["columns"])
+        state.col_pos = {c: i for i, c in enumerate(entry["columns"])}
+        state.ref_rowids = np.array(self.rowids[entry["rows"][0]:entry["rows"][1]])
+        state.col_groups = [set(g) for g in entry["col_groups"]] + GV.col_combo
+        for item in entry["itemsets"]:
+            freq_combo = pd.DataFrame({"support": np.array(item["supports"], dtype=np.float64),
+                                       "itemsets": [frozenset(s) for s in item["itemsets"]]},
+                                      columns=["support", "itemsets"])
+            state.itemsets.put(entry["columns"], item["support"], freq_combo, max_len=item["max_len"], pin=True)
+        return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="precompute recommender artifacts for every database")
+    parser.add_argument("--path", default=GV.REC_ARTIFACT_FOLDER)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: #cpus)")
+    parser.add_argument("--db_ids", default=None, help="comma separated database ids (default: all)")
+    args = parser.parse_args()
+    start = time()
+    build_bundle(args.path, args.db_ids.split(",") if args.db_ids else None, args.workers)
+    print("artifacts written to {} in {:.1f}s".format(args.path, time() - start))
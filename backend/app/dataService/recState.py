@@ -0,0 +1,277 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import globalVariable as GV
+    from itemsetCache import ItemsetCache
+    from similarity import block_rows
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.itemsetCache import ItemsetCache
+    from app.dataService.similarity import block_rows
+
+
+def cols_key(columns):
+    """
+    - stable key of a column list (order matters, as it fixes the `db_df_bin` layout)
+    """
+    return hashlib.sha1("\n".join(columns).encode("utf-8")).hexdigest()
+
+
+def _nbytes(obj):
+    if obj is None:
+        return 0
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(index=True, deep=True)))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(v) for v in obj)
+    return 64
+
+
+class DBState(object):
+    """
+    - recommender state of one database (topic + the columns it is searched with)
+      - db_df_bin: binary relevance matrix (reference queries * search columns)
+      - ref_rowids: rows of the reference corpus (`RefCorpus`) behind `db_df_bin`
+      - n_ref_rows: corpus rows the state was built from, rows appended later are merged by
+        `queryRecommender._extend_db_state`
+      - col_bits: packed row bitmap of every `db_df_bin` column (`itemsetMiner.pack_columns`)
+      - col_pos: column name => row in `col_bits`
+      - col_groups: semantic column groups (`queryRecommender.get_grouped_cols`)
+      - itemsets: `ItemsetCache` of maximal itemsets mined from `db_df_bin`
+      - pre_sel: `select` context that `get_opts` was last run for
+      - context_scores: LRU of decayed column scores per `select` history prefix
+        (`queryRecommender._context_scores`), read and written under `lock` (`cached_scores`,
+        `remember_scores`), as states are shared by request and warm-up threads
+      - col_cooc: column * column cosine similarity of `db_df_bin` (`cooccurrence`, built on first use,
+        None for schemas too wide to keep it)
+    """
+
+    def __init__(self, topic, search_cols):
+        self.topic = topic
+        self.search_cols = list(search_cols)
+        self.key = (topic, cols_key(self.search_cols))
+        self.db_df_bin = None
+        self.ref_rowids = None
+        self.n_ref_rows = 0
+        self.col_bits = None
+        self.col_pos = {}
+        self.col_groups = []
+        self.itemsets = ItemsetCache()
+        self.pre_sel = []
+        self.context_scores = OrderedDict()
+        self.col_cooc = None
+        self.lock = threading.RLock()
+        self._size = None
+
+    def nbytes(self):
+        """
+        - estimated memory footprint (cached until `invalidate_size`)
+        """
+        if self._size is None:
+            self._size = sum(_nbytes(v) for v in [self.db_df_bin, self.ref_rowids, self.col_bits,
+                                                  self.col_cooc])
+        with self.lock:
+            scores_size = sum(v.nbytes for v in self.context_scores.values())
+        return self._size + self.itemsets.nbytes() + scores_size
+
+    def invalidate_size(self):
+        self._size = None
+
+    def cooccurrence(self, idx, max_bytes=GV.REC_SIM_MEMORY_LIMIT):
+        """
+        - cosine similarity between all `db_df_bin` columns and columns `idx` (as sklearn
+          `cosine_similarity`: all-zero columns are similar to nothing)
+        - the full column * column matrix is computed once and kept (`col_cooc`) if it fits in
+          `max_bytes`; wider schemas get the `idx` columns computed per call, in column blocks
+        - OUTPUT:
+          - (#columns, len(idx)) float32, rows in `db_df_bin.columns` order
+        """
+        n_cols = self.db_df_bin.shape[1]
+        if self.col_cooc is None and n_cols * n_cols * 4 <= max_bytes:
+            x = self._normalized_columns()
+            self.col_cooc = (x.T @ x).astype(np.float32)
+            self.invalidate_size()
+        if self.col_cooc is not None:
+            return self.col_cooc[:, idx]
+        x_idx = self._normalized_columns(idx)
+        out = np.empty((n_cols, len(idx)), dtype=np.float32)
+        step = block_rows(16 * len(self.db_df_bin), max_bytes)  # int64 slice + float64 copy
+        for start in range(0, n_cols, step):
+            block = np.arange(start, min(start + step, n_cols))
+            out[start:start + len(block)] = self._normalized_columns(block).T @ x_idx
+        return out
+
+    def _normalized_columns(self, idx=None):
+        x = (self.db_df_bin.values if idx is None else self.db_df_bin.values[:, idx]).astype(np.float64)
+        norms = np.sqrt(np.einsum("ij,ij->j", x, x))
+        norms[norms == 0] = 1
+        x /= norms
+        return x
+
+    def cached_scores(self, keys):
+        """
+        - INPUT:
+          - keys: history prefix keys, shortest first
+        - OUTPUT:
+          - (number of keys covered, scores) of the longest cached prefix, (0, None) if none is cached
+        """
+        with self.lock:
+            for i in range(len(keys), 0, -1):
+                scores = self.context_scores.get(keys[i - 1])
+                if scores is not None:
+                    self.context_scores.move_to_end(keys[i - 1])
+                    return i, scores
+        return 0, None
+
+    def remember_scores(self, key, scores, max_entries=GV.REC_CONTEXT_CACHE_SIZE):
+        with self.lock:
+            self.context_scores[key] = scores
+            self.context_scores.move_to_end(key)
+            while len(self.context_scores) > max_entries:
+                self.context_scores.popitem(last=False)
+
+
+class StateCache(object):
+    """
+    - LRU of `DBState`s bounded by a memory budget (bytes)
+    - the most recently used state is always kept, even when it alone exceeds the budget
+    - `get_or_build` runs at most one build per key at a time
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._states = OrderedDict()
+        self._lock = threading.RLock()
+        self._building = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, key):
+        return key in self._states
+
+    def values(self):
+        with self._lock:
+            return list(self._states.values())
+
+    def get(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def put(self, state):
+        with self._lock:
+            self._states[state.key] = state
+            self._states.move_to_end(state.key)
+            self.evict()
+
+    def pop(self, key):
+        with self._lock:
+            return self._states.pop(key, None)
+
+    def nbytes(self):
+        with self._lock:
+            return sum(s.nbytes() for s in self._states.values())
+
+    def evict(self):
+        """
+        - drop least recently used states until the budget is met
+        """
+        with self._lock:
+            while len(self._states) > 1 and self.nbytes() > self.budget:
+                self._states.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_or_build(self, key, build):
+        """
+        - INPUT:
+          - key: state key
+          - build: () => DBState, called on a miss
+        - OUTPUT:
+          - cached or newly built state
+        """
+        with self._lock:
+            state = self.get(key)
+            if state is not None:
+                self.stats["hits"] += 1
+                return state
+            self.stats["misses"] += 1
+            build_lock = self._building.setdefault(key, threading.Lock())
+        with build_lock:
+            state = self.get(key)
+            if state is None:
+                state = build()
+                self.put(state)
+        with self._lock:
+            self._building.pop(key, None)
+        return state
+
+
+class ColumnGroupCache(object):
+    """
+    - semantic column groups per column list, kept apart from the `DBState`s (which may be evicted)
+    - column embeddings are cached per column list and clusters per (column list, min_size, th),
+      so other clustering thresholds re-cluster the cached embeddings without the model
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._embeddings = OrderedDict()
+        self._groups = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "clustered": 0, "encoded": 0}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def clear(self):
+        with self._lock:
+            self._embeddings.clear()
+            self._groups.clear()
+
+    @staticmethod
+    def _touch(entries, key, value, max_entries):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+
+    def get(self, columns, min_size, th, encode, cluster):
+        """
+        - INPUT:
+          - columns: column list
+          - min_size, th: clustering parameters
+          - encode: (columns) => (#columns, dim) embeddings, called once per column list
+          - cluster: (embeddings, min_size, th) => list of clusters (lists of column positions)
+        - OUTPUT:
+          - list of column sets (copies, safe to modify)
+        """
+        key = cols_key(columns)
+        with self._lock:
+            groups = self._groups.get((key, min_size, th))
+            if groups is not None:
+                self.stats["hits"] += 1
+                self._groups.move_to_end((key, min_size, th))
+                return [set(g) for g in groups]
+            emb = self._embeddings.get(key)
+            if emb is None:
+                emb = encode(columns)
+                self.stats["encoded"] += 1
+            self._touch(self._embeddings, key, emb, self.max_entries)
+            # kept as lists: the sets are rebuilt per call, so their iteration order never changes
+            groups = [[columns[c] for c in cluster_ids] for cluster_ids in cluster(emb, min_size, th)]
+            self.stats["clustered"] += 1
+            self._touch(self._groups, (key, min_size, th), groups, self.max_entries)
+            return [set(g) for g in groups]
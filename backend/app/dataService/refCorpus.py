@@ -0,0 +1,239 @@
+import os
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+
+try:
+    import globalVariable as GV
+    from utils.processSQL import decode_sql
+    from utils.processSQL.decode_sql import extract_select_names, extract_agg_opts, extract_groupby_names
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.utils.processSQL import decode_sql
+    from app.dataService.utils.processSQL.decode_sql import extract_select_names, extract_agg_opts, \
+        extract_groupby_names
+
+AGG_OPTS = ['max', 'min', 'count', 'sum', 'avg']
+
+
+def strip_table_name(sen):
+    """
+    - "table: col" => " col" (the form used for semantic similarity)
+    """
+    return "".join(sen.split(":")[1:]) if ":" in sen else sen
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def decode_entities(records, tables):
+    """
+    - INPUT:
+      - records: reference queries in the format of `train_spider.json` (`db_id` + parsed `sql`)
+      - tables: {db_id: table dict} (`SchemaRegistry.tables`)
+    - OUTPUT:
+      - field => one entity list per query: `select` entities (without table names),
+        `groupby` entities and the aggregated columns of every agg_opt ("agg_<opt>")
+    """
+    fields = {field: [] for field in RefCorpus.FIELDS}
+    for record in records:
+        sql_decoded = decode_sql(record["sql"], tables[record["db_id"]])
+        fields["select"].append([strip_table_name(ent) for ent in extract_select_names(sql_decoded["select"])])
+        fields["groupby"].append(extract_groupby_names(sql_decoded["groupBy"]))
+        agg_dict = extract_agg_opts(sql_decoded["select"])
+        for agg_opt in AGG_OPTS:
+            fields["agg_" + agg_opt].append(agg_dict[agg_opt])
+    return fields
+
+
+class Entities(object):
+    """
+    - interned entity lists of all reference queries: the entities of query i are
+      vocab[ids[offsets[i]:offsets[i + 1]]]
+    - the aggregated columns of all agg_opts share one vocabulary
+    """
+
+    def __init__(self, offsets, ids, vocab):
+        self.offsets = offsets  # (#queries + 1,) int64
+        self.ids = ids  # (#slots,) int64
+        self.vocab = vocab  # list of str, shared by the fields of one vocabulary
+
+    @staticmethod
+    def intern(ents_per_field):
+        """
+        - INPUT:
+          - ents_per_field: list of fields, each one entity list per query
+        - OUTPUT:
+          - list of `Entities` (one per field) over one sorted vocabulary
+        """
+        vocab = sorted(set(ent for ents_per_query in ents_per_field for ents in ents_per_query for ent in ents))
+        lookup = {ent: i for i, ent in enumerate(vocab)}
+        return [Entities._build(ents_per_query, lookup, vocab) for ents_per_query in ents_per_field]
+
+    @staticmethod
+    def _build(ents_per_query, lookup, vocab, offsets=None, ids=None):
+        counts = np.array([len(ents) for ents in ents_per_query], dtype=np.int64)
+        flat = np.array([lookup[ent] for ents in ents_per_query for ent in ents], dtype=np.int64)
+        if offsets is None:
+            return Entities(np.concatenate([[0], np.cumsum(counts)]).astype(np.int64), flat, vocab)
+        return Entities(np.concatenate([offsets, offsets[-1] + np.cumsum(counts)]), np.concatenate([ids, flat]), vocab)
+
+    @staticmethod
+    def extend(fields, ents_per_field):
+        """
+        - `Entities` of fields sharing one vocabulary, with more queries appended
+          (new objects, unseen entities get the next ids)
+        """
+        vocab = list(fields[0].vocab)
+        lookup = {ent: i for i, ent in enumerate(vocab)}
+        for ents_per_query in ents_per_field:
+            for ents in ents_per_query:
+                for ent in ents:
+                    if ent not in lookup:
+                        lookup[ent] = len(vocab)
+                        vocab.append(ent)
+        return [Entities._build(ents_per_query, lookup, vocab, field.offsets, field.ids)
+                for field, ents_per_query in zip(fields, ents_per_field)]
+
+    def of(self, i):
+        return [self.vocab[e] for e in self.ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.ids.nbytes
+
+
+class RefCorpus(object):
+    """
+    - compact, columnar reference corpus of the query recommender: of every query of
+      `train_spider.json` only what the recommender reads
+      - db_codes: (#queries,) int32 codes of `db_ids`
+      - entities: field => `Entities` (`select`, `groupby` and "agg_<opt>", see `decode_entities`)
+    - built from the json once, then loaded from a pickled snapshot while the json and
+      `tables.json` are unchanged
+    - immutable: `appended` returns a new corpus, so readers keep a consistent version
+    """
+    SNAPSHOT_VERSION = 1
+    FIELDS = ["select", "groupby"] + ["agg_" + agg_opt for agg_opt in AGG_OPTS]
+
+    def __init__(self, db_ids, db_codes, entities):
+        self.db_ids = db_ids
+        self.db_codes = db_codes
+        self.entities = entities
+        self._db_index = {db_id: i for i, db_id in enumerate(db_ids)}
+
+    def __len__(self):
+        return len(self.db_codes)
+
+    @property
+    def select(self):
+        return self.entities["select"]
+
+    @property
+    def groupby(self):
+        return self.entities["groupby"]
+
+    def agg(self, agg_opt):
+        return self.entities["agg_" + agg_opt]
+
+    @property
+    def nbytes(self):
+        return self.db_codes.nbytes + sum(e.nbytes for e in self.entities.values())
+
+    def rows_of(self, db_names, start=0):
+        """
+        - OUTPUT:
+          - rows (>= start) of the queries on databases `db_names`, ascending
+        """
+        codes = [self._db_index[db_id] for db_id in db_names if db_id in self._db_index]
+        return start + np.where(np.isin(self.db_codes[start:], codes))[0]
+
+    def frame(self, rowids=None):
+        """
+        - OUTPUT:
+          - DataFrame (db_id + entity lists) of the queries `rowids` (default: all), for inspection
+        """
+        rowids = np.arange(len(self)) if rowids is None else np.asarray(rowids)
+        data = {"db_id": [self.db_ids[c] for c in self.db_codes[rowids]]}
+        for field in self.FIELDS:
+            data[field] = [self.entities[field].of(i) for i in rowids]
+        return pd.DataFrame(data, columns=["db_id"] + self.FIELDS)
+
+    @classmethod
+    def from_records(cls, records, tables):
+        db_ids = sorted(set(record["db_id"] for record in records))
+        db_index = {db_id: i for i, db_id in enumerate(db_ids)}
+        db_codes = np.array([db_index[record["db_id"]] for record in records], dtype=np.int32)
+        fields = decode_entities(records, tables)
+        entities = {}
+        for names in [["select"], ["groupby"], ["agg_" + agg_opt for agg_opt in AGG_OPTS]]:
+            entities.update(zip(names, Entities.intern([fields[name] for name in names])))
+        return cls(db_ids, db_codes, entities)
+
+    def appended(self, records, tables):
+        """
+        - OUTPUT:
+          - new corpus with `records` (format of `train_spider.json`) appended
+        """
+        db_ids = list(self.db_ids) + sorted(set(r["db_id"] for r in records) - set(self.db_ids))
+        db_index = {db_id: i for i, db_id in enumerate(db_ids)}
+        db_codes = np.concatenate([self.db_codes,
+                                   np.array([db_index[r["db_id"]] for r in records], dtype=np.int32)])
+        fields = decode_entities(records, tables)
+        entities = {}
+        for names in [["select"], ["groupby"], ["agg_" + agg_opt for agg_opt in AGG_OPTS]]:
+            entities.update(zip(names, Entities.extend([self.entities[name] for name in names],
+                                                       [fields[name] for name in names])))
+        return RefCorpus(db_ids, db_codes, entities)
+
+    @classmethod
+    def load(cls, path, tables, tables_path, snapshot_folder=None):
+        """
+        - INPUT:
+          - path: reference queries (`train_spider.json`)
+          - tables, tables_path: `SchemaRegistry.tables` and the file they were parsed from
+          - snapshot_folder: defaults to `GV.REF_CORPUS_FOLDER`
+        - OUTPUT:
+          - RefCorpus, from the snapshot of `path` if it is up to date
+        """
+        snapshot_folder = snapshot_folder or GV.REF_CORPUS_FOLDER
+        fingerprint = [cls.SNAPSHOT_VERSION, file_stamp(path), file_stamp(tables_path)]
+        snapshot_path = os.path.join(snapshot_folder, os.path.splitext(os.path.basename(path))[0] + ".pkl")
+        if os.path.isfile(snapshot_path):
+            try:
+                with open(snapshot_path, "rb") as f:
+                    snapshot_fingerprint, state = pickle.load(f)
+                if snapshot_fingerprint == fingerprint:
+                    return cls(*state)
+            except Exception:
+                pass
+        with open(path, "r") as f:
+            corpus = cls.from_records(json.load(f), tables)
+        if not os.path.isdir(snapshot_folder):
+            os.makedirs(snapshot_folder)
+        # write to a temp file first so that concurrent readers never see a partial snapshot
+        tmp_path = "{}.{}.tmp".format(snapshot_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump((fingerprint, (corpus.db_ids, corpus.db_codes, corpus.entities)), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+        return corpus
+
+
+if __name__ == "__main__":
+    from time import time
+    try:
+        from schemaRegistry import get_schema_registry
+    except ImportError:
+        from app.dataService.schemaRegistry import get_schema_registry
+
+    registry = get_schema_registry()
+    ref_path = os.path.join(GV.SPIDER_FOLDER, "train_spider.json")
+    start = time()
+    corpus = RefCorpus.load(ref_path, registry.tables, registry.tables_path)
+    print("{} queries, {:.1f} KB, loaded in {:.3f}s".format(len(corpus), corpus.nbytes / 1024, time() - start))
+    print(corpus.frame(corpus.rows_of([GV.test_topic])[:5]))
@@ -0,0 +1,155 @@
+import os
+import pickle
+import threading
+
+try:
+    import globalVariable as GV
+    from utils.processSQL import process_sql
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.utils.processSQL import process_sql
+
+
+class SchemaRegistry(object):
+    """
+    - single owner of the parsed `tables.json` metadata, shared by `DataService`,
+      `SQLParser` and `queryRecommender`
+    - holds:
+      - db_lists / db_names: database ids in file order
+      - db_meta_dict: {db_id: raw tables.json entry}
+      - db_schema: {db_id: {table: [col, ...]}} (as `process_sql.get_schemas_from_json`)
+      - tables: {db_id: table dict} (as `process_sql.get_schemas_from_json`)
+      - id_maps: {db_id: `process_sql.Schema` idMap}
+      - table_index: {db_id: {table name: table idx}}
+      - column_index: {db_id: {"table name: col name": col idx}}
+      - db_cols: {db_id: ["table name: col name", ...]} without primary/foreign keys
+    - the parsed state is pickled to a snapshot next to the data folder and reused
+      while `tables.json` is unchanged
+    """
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, tables_path=None, snapshot_path=None, use_snapshot=True):
+        self.tables_path = tables_path or os.path.join(GV.SPIDER_FOLDER, "tables.json")
+        self.snapshot_path = snapshot_path or GV.SCHEMA_SNAPSHOT_PATH
+        self._schemas = {}
+        self._schema_lock = threading.Lock()
+        if not (use_snapshot and self._load_snapshot()):
+            self._build()
+            if use_snapshot:
+                self._save_snapshot()
+
+    def _fingerprint(self):
+        stat = os.stat(self.tables_path)
+        return self.SNAPSHOT_VERSION, os.path.abspath(self.tables_path), stat.st_size, stat.st_mtime_ns
+
+    def _build(self):
+        db_schema, db_names, tables = process_sql.get_schemas_from_json(self.tables_path)
+        self.db_schema = db_schema
+        self.db_names = db_names
+        self.tables = tables
+        self.db_meta_dict = {}
+        for db_meta in process_sql.load_data(self.tables_path):
+            self.db_meta_dict[db_meta["db_id"]] = db_meta
+        self.id_maps = {}
+        self.table_index = {}
+        self.column_index = {}
+        self.db_cols = {}
+        for db_id in self.db_names:
+            db_info = self.db_meta_dict[db_id]
+            self.id_maps[db_id] = process_sql.Schema(db_schema[db_id], tables[db_id]).idMap
+            table_names = db_info["table_names"]
+            self.table_index[db_id] = {t: tidx for tidx, t in enumerate(table_names)}
+            self.column_index[db_id] = {table_names[col[0]] + ": " + col[1]: cidx
+                                        for cidx, col in enumerate(db_info["column_names"]) if col[0] != -1}
+            # remove columns that included in primary keys and foreign keys since they usually do not carry many meanings
+            k_set = set(db_info["primary_keys"])
+            for f in db_info["foreign_keys"]:
+                for e in f:
+                    k_set.add(e)
+            self.db_cols[db_id] = [table_names[col[0]] + ": " + col[1]
+                                   for colidx, col in enumerate(db_info["column_names"])
+                                   if col[0] != -1 and colidx not in k_set]
+
+    def _state(self):
+        return {
+            "db_schema": self.db_schema,
+            "db_names": self.db_names,
+            "tables": self.tables,
+            "db_meta_dict": self.db_meta_dict,
+            "id_maps": self.id_maps,
+            "table_index": self.table_index,
+            "column_index": self.column_index,
+            "db_cols": self.db_cols,
+        }
+
+    def _load_snapshot(self):
+        if not os.path.isfile(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                fingerprint, state = pickle.load(f)
+        except Exception:
+            return False
+        if fingerprint != self._fingerprint():
+            return False
+        for k, v in state.items():
+            setattr(self, k, v)
+        return True
+
+    def _save_snapshot(self):
+        folder = os.path.dirname(self.snapshot_path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # write to a temp file first so that concurrent readers never see a partial snapshot
+        tmp_path = "{}.{}.tmp".format(self.snapshot_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self._fingerprint(), self._state()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+
+    @property
+    def db_lists(self):
+        return self.db_names
+
+    def get_schema(self, db_id):
+        """
+        - `process_sql.Schema` for `db_id`, built once and reused
+        """
+        if db_id not in self._schemas:
+            with self._schema_lock:
+                if db_id not in self._schemas:
+                    self._schemas[db_id] = process_sql.Schema(self.db_schema[db_id], self.tables[db_id])
+        return self._schemas[db_id]
+
+    def get_db_cols(self, db_id):
+        """
+        - meaningful columns of `db_id`: ["table name: col name", ...] (keys removed)
+        """
+        return self.db_cols[db_id]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_schema_registry():
+    """
+    - process-wide shared `SchemaRegistry` (loaded on first use)
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SchemaRegistry()
+    return _registry
+
+
+if __name__ == "__main__":
+    from time import time
+    start = time()
+    registry = SchemaRegistry(use_snapshot=False)
+    registry._save_snapshot()
+    print("build: {:.3f}s".format(time() - start))
+    start = time()
+    registry = SchemaRegistry()
+    print("load: {:.3f}s, dbs: {}".format(time() - start, len(registry.db_lists)))
+    print(registry.get_db_cols(GV.test_topic))
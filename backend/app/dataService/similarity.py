@@ -0,0 +1,208 @@
+import numpy as np
+
+
+def normalize_rows(x):
+    """
+    - L2-normalize the rows of x (zero rows stay zero)
+    - INPUT:
+      - x: (n, dim) or (dim,) array
+    - OUTPUT:
+      - float32 array with the same shape
+    """
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def cos_sim(a, b):
+    """
+    - cosine similarity matrix between the rows of a and b
+    - INPUT:
+      - a: (n, dim) or (dim,) embeddings
+      - b: (m, dim) or (dim,) embeddings
+    - OUTPUT:
+      - (n, m) similarity (1-D inputs are treated as a single row, like `util.pytorch_cos_sim`)
+    """
+    a = normalize_rows(np.atleast_2d(a))
+    b = normalize_rows(np.atleast_2d(b))
+    return a @ b.T
+
+
+def block_rows(row_bytes, max_bytes):
+    """
+    - number of rows of `row_bytes` bytes that fit in `max_bytes` (at least 1)
+    """
+    return max(1, int(max_bytes // max(1, row_bytes)))
+
+
+def cos_sim_max(a, b, max_bytes):
+    """
+    - max cosine similarity of every row of a over the rows of b, i.e. `cos_sim(a, b).max(axis=1)`
+      without the (n, m) matrix: rows of a are scored in blocks of at most `max_bytes`
+    - INPUT:
+      - a: (n, dim) embeddings
+      - b: (m, dim) embeddings, m > 0
+    - OUTPUT:
+      - (n,) float32
+    """
+    a = normalize_rows(np.atleast_2d(a))
+    b = normalize_rows(np.atleast_2d(b))
+    out = np.empty(len(a), dtype=np.float32)
+    step = block_rows(len(b) * 4, max_bytes)
+    for start in range(0, len(a), step):
+        out[start:start + step] = np.max(a[start:start + step] @ b.T, axis=1)
+    return out
+
+
+def community_detection(emb, threshold, min_community_size, max_bytes):
+    """
+    - `sentence_transformers.util.community_detection` (current releases) in bounded memory:
+      every row with at least `min_community_size` rows (itself included) at cosine similarity >= threshold
+      seeds a community of those rows, most similar first; communities are taken largest first, members
+      a larger community already took are removed, and the rest is kept if it still has `min_community_size` rows
+      (releases before 2.2, with `init_max_size`, skipped an overlapping community whole)
+    - rows are scored in blocks of at most `max_bytes` instead of the full (n, n) matrix
+    - INPUT:
+      - emb: (n, dim) embeddings
+    - OUTPUT:
+      - list of communities (lists of row positions, most similar to the seed first), largest first
+    """
+    emb = normalize_rows(np.atleast_2d(emb))
+    min_community_size = max(1, min(min_community_size, len(emb)))
+    communities = []
+    step = block_rows(len(emb) * 5, max_bytes)  # similarities + threshold mask
+    for start in range(0, len(emb), step):
+        sim = emb[start:start + step] @ emb.T
+        hits = sim >= threshold
+        for i in np.where(hits.sum(axis=1) >= min_community_size)[0]:
+            ids = np.where(hits[i])[0]
+            communities.append(ids[np.argsort(-sim[i, ids], kind="stable")])
+    communities = sorted(communities, key=len, reverse=True)
+    unique = []
+    taken = np.zeros(len(emb), dtype=bool)
+    for community in communities:
+        community = community[~taken[community]]
+        if len(community) >= min_community_size:
+            unique.append(community)
+            taken[community] = True
+    return [community.tolist() for community in sorted(unique, key=len, reverse=True)]
+
+
+def segment_max(sim, offsets, fill=0.0):
+    """
+    - max over column segments: out[:, i] = max(sim[:, offsets[i]:offsets[i + 1]])
+    - INPUT:
+      - sim: (n, m) matrix
+      - offsets: (k + 1,) non-decreasing segment boundaries, offsets[-1] == m
+      - fill: value for empty segments
+    - OUTPUT:
+      - (n, k) matrix
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    out = np.full((sim.shape[0], len(counts)), fill, dtype=sim.dtype)
+    non_empty = np.where(counts > 0)[0]
+    if len(non_empty) > 0:
+        # `reduceat` only behaves for non-empty segments
+        out[:, non_empty] = np.maximum.reduceat(sim, offsets[non_empty], axis=1)
+    return out
+
+
+def gather_segments(offsets, ids):
+    """
+    - select segments `ids` from a segmented array described by `offsets`
+    - INPUT:
+      - offsets: (k + 1,) segment boundaries
+      - ids: segment ids to gather
+    - OUTPUT:
+      - slots: positions of the gathered elements (segments concatenated in `ids` order)
+      - new_offsets: (len(ids) + 1,) boundaries of the gathered segments in `slots`
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    starts = offsets[ids]
+    counts = offsets[ids + 1] - starts
+    new_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(counts)
+    slots = np.arange(new_offsets[-1], dtype=np.int64) + np.repeat(starts - new_offsets[:-1], counts)
+    return slots, new_offsets
+
+
+class EmbeddingMatrix(object):
+    """
+    - row-normalized embedding matrix stored in reduced precision
+      - float32: reference precision
+      - float16: half the memory
+      - int8: a quarter of the memory, symmetric per-row quantization (row ~= data * scale)
+    - similarities are fused with dequantization and computed in row blocks, so a full
+      float32 copy of the matrix is never materialized
+    """
+    DTYPES = ("float32", "float16", "int8")
+
+    def __init__(self, x, dtype="float32", block_size=65536):
+        if dtype not in self.DTYPES:
+            raise ValueError("unsupported embedding dtype: {}".format(dtype))
+        self.dtype = dtype
+        self.block_size = block_size
+        x = normalize_rows(x)
+        if dtype == "int8":
+            scale = np.abs(x).max(axis=-1) / 127 if x.size > 0 else np.zeros(len(x), dtype=np.float32)
+            scale[scale == 0] = 1
+            self.data = np.round(x / scale[:, None]).astype(np.int8)
+            self.scale = scale.astype(np.float32)
+        else:
+            self.data = x.astype(dtype)
+            self.scale = None
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+    def extended(self, x):
+        """
+        - new matrix with the rows of x appended (quantized the same way); self is unchanged
+        """
+        tail = EmbeddingMatrix(x, self.dtype, self.block_size)
+        out = EmbeddingMatrix(np.zeros((0, self.data.shape[1]), dtype=np.float32), self.dtype, self.block_size)
+        out.data = np.concatenate([self.data, tail.data])
+        if self.scale is not None:
+            out.scale = np.concatenate([self.scale, tail.scale])
+        return out
+
+    def rows(self, ids=None):
+        """
+        - float32 (dequantized) rows `ids` (default: all)
+        """
+        data = self.data if ids is None else self.data[ids]
+        out = data.astype(np.float32)
+        if self.scale is not None:
+            out *= (self.scale if ids is None else self.scale[ids])[:, None]
+        return out
+
+    def sim(self, queries, ids=None):
+        """
+        - cosine similarity between the queries and rows `ids` (default: all)
+        - INPUT:
+          - queries: (nq, dim) or (dim,) embeddings
+        - OUTPUT:
+          - (nq, #rows) float32 similarity
+        """
+        q = normalize_rows(np.atleast_2d(queries))
+        ids = np.arange(len(self.data)) if ids is None else np.asarray(ids)
+        if self.dtype == "float32" and len(ids) <= self.block_size:
+            return q @ self.data[ids].T
+        out = np.empty((len(q), len(ids)), dtype=np.float32)
+        for b in range(0, len(ids), self.block_size):
+            block = ids[b:b + self.block_size]
+            out[:, b:b + len(block)] = q @ self.data[block].astype(np.float32).T
+            if self.scale is not None:
+                out[:, b:b + len(block)] *= self.scale[block][None, :]
+        return out
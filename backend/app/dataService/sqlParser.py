@@ -1,5 +1,7 @@
 import os
 import sys
+import json
+import logging
 # import nltk
 # nltk.download('punkt')
 # nltk.download('stopwords')
@@ -32,8 +34,10 @@ import smbop.utils.node_util as node_util
 # process SQL
 try:
     from utils.processSQL import process_sql
+    from schemaRegistry import get_schema_registry
 except ImportError:
     from app.dataService.utils.processSQL import process_sql
+    from app.dataService.schemaRegistry import get_schema_registry
 
 pathlib.Path(f"cache").mkdir(exist_ok=True)
 
@@ -43,15 +47,19 @@ from transformers import AutoTokenizer
 from UnifiedSKG.utils.configue import Configure
 from UnifiedSKG.models.unified.prefixtuning import Model
 
+LOG = logging.getLogger(__name__)
+
 class SQLParser(object):
-    def __init__(self):
+    def __init__(self, schema_registry=None):
         self.db = GV.SPIDER_FOLDER
-        self.db_schema, self.db_names, self.tables = process_sql.get_schemas_from_json(os.path.join(self.db, "tables.json"))
+        self.schema_registry = schema_registry or get_schema_registry()
+        self.db_schema = self.schema_registry.db_schema
+        self.db_names = self.schema_registry.db_names
+        self.tables = self.schema_registry.tables
         
     def parse_sql(self, sql="SELECT name ,  country ,  age FROM singer group by country having count(*) > 2", db_id="concert_singer"):
-        schema = self.db_schema[db_id]
         table = self.tables[db_id]
-        schema = process_sql.Schema(schema, table)
+        schema = self.schema_registry.get_schema(db_id)
 
         sql_label = process_sql.get_sql(schema, sql)
         # print("sql_label: {}".format(sql_label))
@@ -73,33 +81,102 @@ class SmBop(object):
         self.predictor = Predictor.from_path(GV.SMBOP_PATH, cuda_device=-1, overrides=overrides)
 
     def predict(self, q, db_id):
-        instance = self.predictor._dataset_reader.text_to_instance(utterance=q, db_id=db_id)
-        self.predictor._dataset_reader.apply_token_indexers(instance)
+        return self.predict_batch([(q, db_id)])[0]
+
+    def predict_batch(self, pairs, batch_size=GV.TEXT2SQL_BATCH_SIZE):
+        """
+        - text-to-sql for many questions: [(utterance, db_id), ...] => [sql, ...] (same order)
+        - instances run through the model `batch_size` at a time (`forward_on_instances` pads a batch
+          to its longest instance); they are grouped by database and utterance length, so that
+          a batch shares its schema and needs little padding
+        """
+        reader = self.predictor._dataset_reader
+        instances = []
+        for q, db_id in pairs:
+            instance = reader.text_to_instance(utterance=q, db_id=db_id)
+            reader.apply_token_indexers(instance)
+            instances.append(instance)
+        order = sorted(range(len(pairs)), key=lambda i: (pairs[i][1], len(pairs[i][0])))
+        sqls = [None] * len(pairs)
         with torch.cuda.amp.autocast(enabled=True):
-            out = self.predictor._model.forward_on_instances([instance])
-            return out[0]["sql_list"]
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                outs = self.predictor._model.forward_on_instances([instances[i] for i in batch])
+                for i, out in zip(batch, outs):
+                    sqls[i] = out["sql_list"]
+        return sqls
 
 
 class SQL2NL(object):
-    def __init__(self):
+    # sqls the fast tokenizer has to encode exactly like the slow one (with the spider queries)
+    TOKENIZER_PROBES = [
+        "SELECT name ,  country ,  age FROM singer ORDER BY age DESC",
+        "SELECT count(*) FROM head WHERE age  >  56",
+        "SELECT T1.title FROM film AS T1 JOIN schedule AS T2 ON T1.film_id  =  T2.film_id WHERE T2.price < 10.5",
+        "SELECT avg(price) ,  max(price) FROM products GROUP BY product_type_code HAVING count(*) >= 2",
+        "SELECT name FROM people WHERE name LIKE '%Ann%' OR name != \"O'Neil\" LIMIT 1",
+    ]
+
+    def __init__(self, use_fast=GV.SQL2NL_FAST_TOKENIZER):
         self.tokenizer = AutoTokenizer.from_pretrained(GV.SQL2NL_MODEL_NAME, use_fast=False)
+        if use_fast:
+            fast_tokenizer = AutoTokenizer.from_pretrained(GV.SQL2NL_MODEL_NAME, use_fast=True)
+            if self.same_ids(self.tokenizer, fast_tokenizer, self._probe_prompts()):
+                self.tokenizer = fast_tokenizer
+            else:
+                LOG.warning("fast sql2nl tokenizer differs from the slow one, keep the slow tokenizer")
         args = Configure.Get(GV.SQL2NL_MODEL_CONFIG_PATH)
         self.model = Model(args)
         self.model.load(GV.SQL2NL_MODEL_NAME)
-    def sql2text(self, sql: str = "SELECT name ,  country ,  age FROM singer ORDER BY age DESC"):
+
+    @staticmethod
+    def prompt(sql):
         prefix = ""
-        prompt = "{} ; structed knowledge: {}".format(sql, prefix)
-        tokenized_txt = self.tokenizer([prompt], max_length=1024, padding="max_length", truncation=True)
-        pred = self.tokenizer.batch_decode(
-            self.model.generate(
-                torch.LongTensor(tokenized_txt.data['input_ids']),
-                torch.LongTensor(tokenized_txt.data['attention_mask']),
-                num_beams=1, 
-                max_length=256
-                ), 
-            skip_special_tokens=True 
-        )
-        return pred[0]
+        return "{} ; structed knowledge: {}".format(sql, prefix)
+
+    @staticmethod
+    def same_ids(slow_tokenizer, fast_tokenizer, texts):
+        """
+        - True if both tokenizers encode every text to the same ids
+        """
+        return slow_tokenizer(texts)["input_ids"] == fast_tokenizer(texts)["input_ids"]
+
+    def _probe_prompts(self, n_queries=500):
+        sqls = list(self.TOKENIZER_PROBES)
+        ref_path = os.path.join(GV.SPIDER_FOLDER, "train_spider.json")
+        if os.path.isfile(ref_path):
+            with open(ref_path, "r") as f:
+                sqls += [r["query"] for r in json.load(f)[:n_queries]]
+        return [self.prompt(sql) for sql in sqls]
+
+    def sql2text(self, sql: str = "SELECT name ,  country ,  age FROM singer ORDER BY age DESC"):
+        return self.sql2text_batch([sql])[0]
+
+    def sql2text_batch(self, sqls, batch_size=GV.SQL2NL_BATCH_SIZE):
+        """
+        - sql => natural language for a list of sqls (same order), `batch_size` sqls per `generate` call
+        - prompts are padded to the longest prompt of their batch instead of `max_length`,
+          and batched by length, so that short sqls attend over short sequences
+        """
+        prompts = [self.prompt(sql) for sql in sqls]
+        order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+        preds = [None] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            tokenized_txt = self.tokenizer([prompts[i] for i in batch], max_length=1024, padding="longest",
+                                           truncation=True)
+            pred = self.tokenizer.batch_decode(
+                self.model.generate(
+                    torch.LongTensor(tokenized_txt.data['input_ids']),
+                    torch.LongTensor(tokenized_txt.data['attention_mask']),
+                    num_beams=1,
+                    max_length=256
+                    ),
+                skip_special_tokens=True
+            )
+            for i, text in zip(batch, pred):
+                preds[i] = text
+        return preds
 
 if __name__=='__main__':
     # smbop = SmBop()
@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import globalVariable as GV
+    from similarity import normalize_rows
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.similarity import normalize_rows
+
+_QUOTED = re.compile(r'("[^"]*"|\'[^\']*\')')
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCT = re.compile(r"[\s?.!]+$")
+_NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+_WORD = re.compile(r"[a-z]+")
+_LETTERS = re.compile(r"[A-Za-z]+")
+_SQL_STRING = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+NUMBER_WORDS = {w: str(i) for i, w in enumerate(
+    ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+     "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen", "twenty"])}
+NUMBER_WORDS.update({"once": "1", "twice": "2"})
+# words that flip a comparison, an ordering or a condition, by the sense they agree on
+POLARITY_WORDS = {
+    "gt": ["more", "greater", "larger", "bigger", "higher", "above", "over", "exceed", "exceeds", "exceeding",
+           "after", "later", "older", "longer", "expensive"],
+    "lt": ["less", "fewer", "smaller", "lower", "below", "under", "before", "earlier", "younger", "shorter",
+           "cheaper"],
+    "max": ["max", "maximum", "highest", "largest", "biggest", "greatest", "oldest", "latest", "longest",
+            "top", "best"],
+    "min": ["min", "minimum", "lowest", "smallest", "fewest", "youngest", "earliest", "shortest", "cheapest",
+            "worst"],
+    "asc": ["ascending", "alphabetical", "alphabetically", "increasing"],
+    "desc": ["descending", "decreasing", "reverse"],
+    "not": ["not", "no", "never", "without", "except", "excluding", "nor", "neither"],
+    "or": ["or", "either"],
+}
+_POLARITY = {w: sense for sense, words in POLARITY_WORDS.items() for w in words}
+# words folded to lower case in cache keys; everything else keeps its case, as unquoted values
+# ("singers from France") are copied into sql literals and sqlite `=` is case sensitive
+CASE_FOLD_WORDS = set(NUMBER_WORDS) | set(_POLARITY) | {
+    "a", "an", "the", "what", "which", "who", "whom", "whose", "when", "where", "why", "how", "many", "much",
+    "is", "are", "was", "were", "be", "been", "being", "do", "does", "did", "has", "have", "had", "can", "could",
+    "will", "would", "should", "of", "in", "on", "at", "by", "for", "with", "from", "to", "into", "as", "and",
+    "than", "then", "all", "each", "every", "any", "some", "both", "there", "that", "this", "these", "those",
+    "its", "their", "them", "they", "i", "my", "you", "your", "please", "list", "show", "find", "give", "return",
+    "count", "display", "tell", "get", "sort", "order", "ordered", "sorted", "name", "names", "number", "total",
+    "average", "sum", "distinct", "different", "unique"}
+# key format of `normalize_utterance`, part of the cache version: entries of older formats are never returned
+KEY_FORMAT = 2
+
+
+def _fold_case(match):
+    word = match.group(0)
+    return word.lower() if word.lower() in CASE_FOLD_WORDS else word
+
+
+def normalize_utterance(text):
+    """
+    - cache key form of an utterance: unicode-normalized, `CASE_FOLD_WORDS` in lower case, single spaces,
+      no trailing "?", "." or "!"; other words and quoted literals keep their case (values are case sensitive)
+    """
+    parts = _QUOTED.split(unicodedata.normalize("NFKC", text))
+    out = []
+    for i, part in enumerate(parts):
+        # odd parts are the quoted literals
+        if i % 2 == 0:
+            part = _SPACES.sub(" ", _LETTERS.sub(_fold_case, part))
+        out.append(part)
+    return _TRAILING_PUNCT.sub("", "".join(out).strip())
+
+
+def literal_values(text):
+    """
+    - values an utterance mentions: numbers (digits or number words) and quoted strings, sorted
+    """
+    text = unicodedata.normalize("NFKC", text)
+    quoted = [q[1:-1] for q in _QUOTED.findall(text)]
+    rest = _QUOTED.sub(" ", text).lower()
+    numbers = _NUMBER.findall(rest) + [NUMBER_WORDS[w] for w in _WORD.findall(rest) if w in NUMBER_WORDS]
+    return tuple(sorted(["#" + str(float(n)) for n in numbers] + ["'" + q for q in quoted]))
+
+
+def polarity(text):
+    """
+    - senses of the comparison/ordering/negation words of an utterance (see `POLARITY_WORDS`), sorted
+    """
+    words = _WORD.findall(_QUOTED.sub(" ", text).lower())
+    return tuple(sorted(set(_POLARITY[w] for w in words if w in _POLARITY)))
+
+
+def sql_strings(sql):
+    """
+    - string literals of a sql
+    """
+    if not isinstance(sql, str):
+        return []
+    return [a or b for a, b in _SQL_STRING.findall(sql)]
+
+
+def value_mentions(utterance, values):
+    """
+    - the spellings (case preserved) in which `values` occur in an utterance, matched ignoring case
+    """
+    mentions = set()
+    for value in values:
+        if len(value.strip()) > 0:
+            mentions.update(m.group(0) for m in re.finditer(re.escape(value), utterance, re.IGNORECASE))
+    return sorted(mentions)
+
+
+def model_version(path=GV.SMBOP_PATH):
+    """
+    - version of the text2sql model: name, size and mtime of its archive
+    """
+    if not os.path.isfile(path):
+        return os.path.basename(path)
+    stat = os.stat(path)
+    return "{}-{}-{}".format(os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+
+
+class Text2SQLCache(object):
+    """
+    - text2sql results keyed by (db_id, normalized utterance, model version)
+    - two tiers: in-memory LRU -> SQLite file (`path`), so results survive restarts;
+      entries of other model versions (or key formats, `KEY_FORMAT`) are never returned
+    - `stats()`: lookups, hits per tier and hit rate
+    """
+
+    def __init__(self, path=GV.TEXT2SQL_CACHE_PATH, lru_size=GV.TEXT2SQL_CACHE_LRU_SIZE, version=None):
+        self.path = path
+        self.lru_size = lru_size
+        self.version = "{}/key{}".format(version or model_version(), KEY_FORMAT)
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = {"lookups": 0, "lru_hits": 0, "disk_hits": 0, "stores": 0}
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        # one connection shared by the request threads, serialized by `_lock`
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS text2sql ("
+                         "db_id TEXT, utterance TEXT, version TEXT, sql TEXT, "
+                         "PRIMARY KEY (db_id, utterance, version))")
+        self._db.commit()
+
+    def key(self, db_id, utterance):
+        return db_id, normalize_utterance(utterance)
+
+    def _remember(self, key, sql):
+        self._lru[key] = sql
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get(self, db_id, utterance):
+        """
+        - OUTPUT:
+          - cached sql, or None
+        """
+        key = self.key(db_id, utterance)
+        with self._lock:
+            self._stats["lookups"] += 1
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self._stats["lru_hits"] += 1
+                return self._lru[key]
+            row = self._db.execute("SELECT sql FROM text2sql WHERE db_id = ? AND utterance = ? AND version = ?",
+                                   key + (self.version,)).fetchone()
+            if row is None:
+                return None
+            sql = json.loads(row[0])
+            self._remember(key, sql)
+            self._stats["disk_hits"] += 1
+            return sql
+
+    def put(self, db_id, utterance, sql):
+        key = self.key(db_id, utterance)
+        with self._lock:
+            self._remember(key, sql)
+            self._db.execute("INSERT OR REPLACE INTO text2sql VALUES (?, ?, ?, ?)",
+                             key + (self.version, json.dumps(sql)))
+            self._db.commit()
+            self._stats["stores"] += 1
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM text2sql WHERE version = ?", (self.version,)).fetchone()[0]
+
+    def items(self, db_id):
+        """
+        - OUTPUT:
+          - [(normalized utterance, sql), ...] stored for `db_id` by the current model version
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT utterance, sql FROM text2sql WHERE db_id = ? AND version = ?",
+                                    (db_id, self.version)).fetchall()
+        return [(u, json.loads(sql)) for u, sql in rows]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["lru_hits"] + stats["disk_hits"]
+        stats["hits"] = hits
+        stats["hit_rate"] = hits / stats["lookups"] if stats["lookups"] > 0 else 0.0
+        stats["lru_entries"] = len(self._lru)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SemanticText2SQLCache(object):
+    """
+    - text2sql results of paraphrases: a lookup returns the sql of the most similar cached utterance
+      of the same database if their embedding cosine similarity reaches the database's threshold
+    - literal guards, a candidate is only returned if
+      - both utterances mention the same numbers and quoted strings (`literal_values`)
+      - both use the same comparison/ordering/negation senses (`polarity`)
+      - the string values of its sql that occur in its utterance also occur in the new one, with the
+        same case (unquoted names, e.g. "films directed by Bill Schreiner"; "France" is not "france")
+    - `encoder`: anything with `encode(list of str) -> (n, dim)`, e.g. the recommender's `BatchEncoder`;
+      utterances are user text, so not a persistent `EmbeddingStore`: their embeddings are only kept here
+    - `seed(db_id)`: called once per database with the known [(utterance, sql), ...] (e.g. `Text2SQLCache.items`)
+    - at most `max_entries` utterances per database, the oldest are dropped first
+    """
+
+    def __init__(self, encoder, threshold=GV.TEXT2SQL_SEMANTIC_THRESHOLD,
+                 db_thresholds=GV.TEXT2SQL_SEMANTIC_DB_THRESHOLDS, max_entries=GV.TEXT2SQL_SEMANTIC_MAX_ENTRIES,
+                 seed=None, guards=True):
+        self.encoder = encoder
+        self.threshold = threshold
+        self.db_thresholds = dict(db_thresholds)
+        self.max_entries = max_entries
+        self.seed = seed
+        self.guards = guards
+        self._entries = {}  # db_id => {"emb": (n, dim) normalized, "meta": [(literals, polarity, value mentions), ...], "sqls": [...]}
+        self._lock = threading.RLock()
+        self._stats = {"lookups": 0, "hits": 0, "guard_rejects": 0, "stores": 0}
+
+    def threshold_of(self, db_id):
+        return self.db_thresholds.get(db_id, self.threshold)
+
+    @staticmethod
+    def _meta(utterance, sql):
+        return (literal_values(utterance), polarity(utterance),
+                value_mentions(normalize_utterance(utterance), sql_strings(sql)))
+
+    def _db_entries(self, db_id):
+        entries = self._entries.get(db_id)
+        if entries is None:
+            entries = {"emb": None, "meta": [], "sqls": []}
+            self._entries[db_id] = entries
+            if self.seed is not None:
+                self._add(entries, self.seed(db_id))
+        return entries
+
+    def _add(self, entries, pairs):
+        pairs = pairs[-self.max_entries:]
+        if len(pairs) == 0:
+            return
+        emb = normalize_rows(self.encoder.encode([normalize_utterance(u) for u, _ in pairs]))
+        entries["emb"] = emb if entries["emb"] is None else np.vstack([entries["emb"], emb])
+        entries["meta"] += [self._meta(u, sql) for u, sql in pairs]
+        entries["sqls"] += [sql for _, sql in pairs]
+        n_drop = len(entries["sqls"]) - self.max_entries
+        if n_drop > 0:
+            entries["emb"] = entries["emb"][n_drop:]
+            entries["meta"] = entries["meta"][n_drop:]
+            entries["sqls"] = entries["sqls"][n_drop:]
+
+    def _admits(self, meta, literals, senses, normalized):
+        if not self.guards:
+            return True
+        return meta[0] == literals and meta[1] == senses and all(v in normalized for v in meta[2])
+
+    def get(self, db_id, utterance):
+        """
+        - OUTPUT:
+          - sql of the closest admissible paraphrase, or None
+        """
+        emb = normalize_rows(self.encoder.encode([normalize_utterance(utterance)]))[0]
+        literals, senses = literal_values(utterance), polarity(utterance)
+        normalized = normalize_utterance(utterance)
+        th = self.threshold_of(db_id)
+        with self._lock:
+            self._stats["lookups"] += 1
+            entries = self._db_entries(db_id)
+            if entries["emb"] is None:
+                return None
+            sims = entries["emb"] @ emb
+            for i in np.argsort(-sims, kind="stable"):
+                if sims[i] < th:
+                    break
+                if self._admits(entries["meta"][i], literals, senses, normalized):
+                    self._stats["hits"] += 1
+                    return entries["sqls"][i]
+                self._stats["guard_rejects"] += 1
+            return None
+
+    def put(self, db_id, utterance, sql):
+        with self._lock:
+            self._add(self._db_entries(db_id), [(utterance, sql)])
+            self._stats["stores"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = sum(len(e["sqls"]) for e in self._entries.values())
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] > 0 else 0.0
+        return stats
+
+
+if __name__ == "__main__":
+    cache = Text2SQLCache(version="test")
+    cache.put(GV.test_topic, "How many customers are there?", "SELECT count(*) FROM customers")
+    print(cache.get(GV.test_topic, "how many  customers are there"), cache.stats())
@@ -0,0 +1,444 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+try:
+    import globalVariable as GV
+    from schemaRegistry import get_schema_registry
+    from similarity import normalize_rows
+    from text2sqlCache import NUMBER_WORDS
+    from utils.processSQL import process_sql
+except ImportError:
+    import app.dataService.globalVariable as GV
+    from app.dataService.schemaRegistry import get_schema_registry
+    from app.dataService.similarity import normalize_rows
+    from app.dataService.text2sqlCache import NUMBER_WORDS
+    from app.dataService.utils.processSQL import process_sql
+
+STOP_WORDS = {
+    "a", "an", "the", "of", "and", "or", "in", "on", "at", "by", "for", "with", "to", "from", "as", "is", "are",
+    "was", "were", "be", "been", "has", "have", "had", "do", "does", "did", "that", "this", "these", "those", "it",
+    "its", "their", "there", "what", "which", "who", "whose", "whom", "when", "where", "how", "many", "much", "all",
+    "each", "every", "any", "some", "list", "show", "give", "find", "return", "me", "number", "count", "total",
+    "average", "maximum", "minimum", "max", "min", "sum", "than", "more", "less", "most", "least", "id", "ids",
+}
+SQL_WORDS = set(GV.CLAUSE_KEYWORDS + GV.JOIN_KEYWORDS + GV.WHERE_OPS + GV.AGG_OPS + GV.COND_OPS + GV.ORDER_OPS +
+                ("by", "distinct", "having", "null", "*"))
+_WORD = re.compile(r"[a-z0-9]+")
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_QUOTED = re.compile(r'(?:^|(?<=\s))["“\']([^"”\']+)["”\']')
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_IDENTIFIER = re.compile(r"[a-z_]\w*(?:\.(?:\w+|\*))?")
+# capitalized words after the first word of a question: names of values ("directed by Bill Schreiner")
+_NAME = re.compile(r"(?<=\s)[A-Z][\w\-']*(?:\s+(?:of\s+|de\s+)?[A-Z][\w\-']*)*")
+
+
+def stem(word):
+    """
+    - crude stem that maps singular and plural, and a few derived forms, to the same word
+      ("city", "cities" -> "citi", "directed", "director" -> "direct")
+    """
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    if len(word) > 2 and word.endswith("y"):
+        word = word[:-1] + "i"
+    for suffix in ("ing", "ed", "er", "or"):
+        if len(word) > len(suffix) + 4 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def content_words(text):
+    """
+    - stemmed words of `text` that may name a schema element (stop words removed)
+    """
+    return set(stem(w) for w in _WORD.findall(text.lower().replace("_", " ")) if w not in STOP_WORDS)
+
+
+def question_values(question):
+    """
+    - values a question mentions, in order of appearance
+    - OUTPUT:
+      - numbers: [str, ...] (number words as digits), strings: [str, ...] (quoted strings, then capitalized names)
+    """
+    quoted = [m.group(1) for m in _QUOTED.finditer(question)]
+    rest = _QUOTED.sub(" ", question)
+    names = [m.group(0) for m in _NAME.finditer(rest)]
+    numbers = []
+    for tok in _TOKEN.findall(_NAME.sub(" ", rest)):
+        if _NUMBER.fullmatch(tok):
+            numbers.append(tok)
+        elif tok.lower() in NUMBER_WORDS:
+            numbers.append(NUMBER_WORDS[tok.lower()])
+    return numbers, quoted + names
+
+
+def detokenize(toks):
+    """
+    - sql text of `process_sql.tokenize` tokens: keywords upper case, "count(*)" style calls
+    """
+    out = ""
+    for i, tok in enumerate(toks):
+        if tok in SQL_WORDS and tok not in GV.AGG_OPS and tok != "*":
+            tok = tok.upper()
+        if i > 0 and toks[i - 1] != "(" and tok != ")" and not (tok == "(" and toks[i - 1] in GV.AGG_OPS):
+            out += " "
+        out += tok
+    return out
+
+
+def _is_number(tok):
+    return _NUMBER.fullmatch(tok) is not None
+
+
+class _Schema(object):
+    """
+    - lookup tables of one database for adapting sqls: original names (lower case) -> ids,
+      natural-language names, column types, foreign keys and the words naming its elements
+    """
+
+    def __init__(self, db_meta):
+        self.table_orig = [t.lower() for t in db_meta["table_names_original"]]
+        self.table_nat = list(db_meta["table_names"])
+        self.col_table = [c[0] for c in db_meta["column_names_original"]]
+        self.col_orig = [c[1].lower() for c in db_meta["column_names_original"]]
+        self.col_orig_case = [c[1] for c in db_meta["column_names_original"]]
+        self.table_orig_case = list(db_meta["table_names_original"])
+        self.col_nat = [c[1] for c in db_meta["column_names"]]
+        self.col_types = list(db_meta["column_types"])
+        self.fks = set()
+        for a, b in db_meta["foreign_keys"]:
+            self.fks.add((a, b))
+            self.fks.add((b, a))
+        self.table_words = [content_words(t) for t in self.table_nat]
+        # words of a column besides those of its table ("film id" of table "film": nothing)
+        self.col_words = [content_words(c) - (self.table_words[t] if t >= 0 else set())
+                          for c, t in zip(self.col_nat, self.col_table)]
+        self.words = set().union(*(self.table_words + self.col_words))
+        self.table_ids = {t: i for i, t in enumerate(self.table_orig)}
+        self.table_cols = {i: [] for i in range(len(self.table_orig))}
+        for cidx, tidx in enumerate(self.col_table):
+            if tidx >= 0:
+                self.table_cols[tidx].append(cidx)
+
+    def column_of(self, tidx, name):
+        for cidx in self.table_cols[tidx]:
+            if self.col_orig[cidx] == name:
+                return cidx
+        return None
+
+    def col_label(self, cidx):
+        return "{}: {}".format(self.table_nat[self.col_table[cidx]], self.col_nat[cidx])
+
+
+def mention(words, question_words):
+    """
+    - share of an element's words that the question mentions
+    """
+    if len(words) == 0:
+        return 0.0
+    return len(words & question_words) / len(words)
+
+
+class RetrievalText2SQL(object):
+    """
+    - retrieval fast path of text-to-SQL: the reference questions (Spider train) closest to a question
+      give candidate sqls, re-targeted to the question's database; SmBop is only needed when no
+      candidate is confident and valid
+    - retrieval compares question templates: values and words naming schema elements of the question's
+      own database are masked ("how many item are there ?"), so questions on other databases match by structure
+    - adapting a candidate (`adapt`):
+      - tables and columns of the reference sql are mapped to the elements of the target database the
+        question mentions (same column type, distinct targets); elements the reference question does not
+        mention (join tables, keys) are mapped by the similarity of their names
+      - join conditions have to be foreign keys of the target database
+      - numbers and strings are replaced by the question's values, which have to be as many
+    - confidence: template similarity * how well the question mentions the mapped elements
+      (and how much of the question's schema words they cover)
+    - valid: parsed by `process_sql.get_sql` and accepted by sqlite's EXPLAIN
+    - `encoder`: anything with `encode(list of str) -> (n, dim)`, e.g. the recommender's `BatchEncoder`;
+      encodes the questions, which are user text, so it should not persist them
+    - `store`: encodes the reference questions and schema labels, e.g. an `EmbeddingStore` of its own
+      (bounded by the reference set and the schemas); `encoder` if None
+    """
+
+    def __init__(self, encoder, schema_registry=None, threshold=GV.TEXT2SQL_RETRIEVAL_THRESHOLD,
+                 top_k=GV.TEXT2SQL_RETRIEVAL_TOP_K,
+                 ref_path=os.path.join(GV.SPIDER_FOLDER, "train_spider.json"),
+                 database_folder=os.path.join(GV.SPIDER_FOLDER, "database"), store=None):
+        self.encoder = encoder
+        self.store = store or encoder
+        self.schema_registry = schema_registry or get_schema_registry()
+        self.threshold = threshold
+        self.top_k = top_k
+        self.ref_path = ref_path
+        self.database_folder = database_folder
+        self._schemas = {}
+        self._name_emb = {}
+        self.refs = None
+        self.ref_emb = None
+        self._lock = threading.RLock()
+        self.stats = {"lookups": 0, "answered": 0}
+
+    def schema(self, db_id):
+        if db_id not in self._schemas:
+            self._schemas[db_id] = _Schema(self.schema_registry.db_meta_dict[db_id])
+        return self._schemas[db_id]
+
+    def template(self, question, db_id):
+        """
+        - question with its values and the words naming schema elements of `db_id` masked
+        """
+        schema = self.schema(db_id)
+        text = _QUOTED.sub(" value ", question)
+        text = _NAME.sub(" value ", text)
+        out = []
+        for tok in _TOKEN.findall(text.lower()):
+            if _is_number(tok) or tok in NUMBER_WORDS:
+                tok = "value"
+            elif tok not in STOP_WORDS and stem(tok) in schema.words:
+                tok = "item"
+            if tok in ("value", "item") and len(out) > 0 and out[-1] == tok:
+                continue
+            out.append(tok)
+        return " ".join(out)
+
+    def _load_refs(self):
+        with self._lock:
+            if self.refs is not None:
+                return
+            with open(self.ref_path, "r") as f:
+                records = json.load(f)
+            db_meta = self.schema_registry.db_meta_dict
+            refs = [{"db_id": r["db_id"], "question": r["question"], "query": r["query"]}
+                    for r in records if r["db_id"] in db_meta]
+            emb = self.store.encode([self.template(r["question"], r["db_id"]) for r in refs])
+            self.ref_emb = normalize_rows(emb)
+            self.refs = refs
+
+    def _names_emb(self, db_id):
+        """normalized embeddings of the table names and column labels of `db_id`"""
+        if db_id not in self._name_emb:
+            schema = self.schema(db_id)
+            labels = list(schema.table_nat) + [schema.col_label(c) if schema.col_table[c] >= 0 else "*"
+                                               for c in range(len(schema.col_orig))]
+            emb = normalize_rows(self.store.encode(labels))
+            self._name_emb[db_id] = (emb[:len(schema.table_nat)], emb[len(schema.table_nat):])
+        return self._name_emb[db_id]
+
+    def neighbors(self, question, db_id):
+        """
+        - OUTPUT:
+          - [(template similarity, reference), ...] of the `top_k` closest reference questions
+        """
+        self._load_refs()
+        emb = normalize_rows(self.encoder.encode([self.template(question, db_id)]))[0]
+        sims = self.ref_emb @ emb
+        top = np.argsort(-sims, kind="stable")[:self.top_k]
+        return [(float(sims[i]), self.refs[i]) for i in top]
+
+    @staticmethod
+    def _assign(sources, candidates, score):
+        """
+        - greedy one-to-one assignment, best (source, candidate) pairs first
+        - OUTPUT:
+          - {source: candidate}, None if a source has no candidate left
+        """
+        pairs = sorted(((score(s, c), i, c, s) for i, s in enumerate(sources) for c in candidates[s]),
+                       key=lambda p: (-p[0], p[1], p[2]))
+        out, used = {}, set()
+        for _, _, c, s in pairs:
+            if s not in out and c not in used:
+                out[s] = c
+                used.add(c)
+        return out if len(out) == len(sources) else None
+
+    def adapt(self, ref, question, db_id):
+        """
+        - re-target the sql of a reference question to `db_id` and the values of `question`
+        - OUTPUT:
+          - (sql, mapping quality in [0, 1]), None if it cannot be adapted
+        """
+        src, tgt = self.schema(ref["db_id"]), self.schema(db_id)
+        try:
+            toks = process_sql.tokenize(ref["query"])
+        except AssertionError:
+            return None
+        alias = process_sql.scan_alias(toks)
+        # tables
+        table_pos = {}
+        for i, tok in enumerate(toks):
+            if i > 0 and toks[i - 1] in ("from", "join") and tok in src.table_ids:
+                table_pos[i] = src.table_ids[tok]
+        src_tables = list(dict.fromkeys(table_pos.values()))
+        # columns: "alias.col", "table.col" or a bare column of one of the query's tables
+        col_pos = {}
+        for i, tok in enumerate(toks):
+            if i in table_pos or tok in SQL_WORDS or not _IDENTIFIER.fullmatch(tok):
+                continue
+            if i + 1 < len(toks) and toks[i + 1] == "(":
+                continue
+            if "." in tok:
+                prefix, name = tok.split(".", 1)
+                tidx = src.table_ids.get(alias.get(prefix, prefix))
+                if tidx is None:
+                    return None
+                if name != "*":
+                    cidx = src.column_of(tidx, name)
+                    if cidx is None:
+                        return None
+                    col_pos[i] = (prefix, cidx)
+            elif tok not in alias and i > 0 and toks[i - 1] != "as":
+                owners = [src.column_of(t, tok) for t in src_tables]
+                owners = [c for c in owners if c is not None]
+                if len(owners) == 0:
+                    return None
+                col_pos[i] = (None, owners[0])
+        src_cols = list(dict.fromkeys(c for _, c in col_pos.values()))
+
+        question_words = content_words(question)
+        ref_words = content_words(ref["question"])
+        src_tab_emb, src_col_emb = self._names_emb(ref["db_id"])
+        tgt_tab_emb, tgt_col_emb = self._names_emb(db_id)
+        qualities = []
+
+        # tables mentioned by the reference question go to tables mentioned by the question
+        def table_score(s, t):
+            sim = float(src_tab_emb[s] @ tgt_tab_emb[t])
+            if mention(src.table_words[s], ref_words) > 0:
+                return mention(tgt.table_words[t], question_words) + 0.1 * sim
+            return sim + 0.1 * mention(tgt.table_words[t], question_words)
+
+        all_tables = list(range(len(tgt.table_orig)))
+        table_map = self._assign(src_tables, {s: all_tables for s in src_tables}, table_score)
+        if table_map is None:
+            return None
+        for s, t in table_map.items():
+            if mention(src.table_words[s], ref_words) > 0:
+                qualities.append(mention(tgt.table_words[t], question_words))
+
+        def col_score(s, c):
+            sim = float(src_col_emb[s] @ tgt_col_emb[c])
+            if mention(src.col_words[s], ref_words) > 0:
+                return mention(tgt.col_words[c], question_words) + 0.1 * sim
+            return sim + 0.1 * mention(tgt.col_words[c], question_words)
+
+        col_candidates = {s: [c for c in tgt.table_cols[table_map[src.col_table[s]]]
+                              if tgt.col_types[c] == src.col_types[s]] for s in src_cols}
+        col_map = self._assign(src_cols, col_candidates, col_score)
+        if col_map is None:
+            return None
+        for s, c in col_map.items():
+            if mention(src.col_words[s], ref_words) > 0:
+                qualities.append(mention(tgt.col_words[c], question_words))
+
+        # join conditions: "on a = b (and c = d)" have to stay foreign keys
+        for i, tok in enumerate(toks):
+            if tok == "=" and (i - 1) in col_pos and (i + 1) in col_pos:
+                if "on" not in toks[max(0, i - 6):i]:
+                    continue
+                a, b = col_map[col_pos[i - 1][1]], col_map[col_pos[i + 1][1]]
+                if (a, b) not in tgt.fks and tgt.col_orig[a] != tgt.col_orig[b]:
+                    return None
+
+        # values
+        numbers, strings = question_values(question)
+        value_pos = [i for i, tok in enumerate(toks) if tok.startswith('"')]
+        number_pos = [i for i, tok in enumerate(toks) if _is_number(tok)
+                      and not (i > 0 and toks[i - 1] == "limit" and tok == "1")]
+        if len(value_pos) != len(strings) or len(number_pos) != len(numbers):
+            return None
+
+        out = list(toks)
+        for i, tidx in table_pos.items():
+            out[i] = tgt.table_orig_case[table_map[tidx]]
+        for i, (prefix, cidx) in col_pos.items():
+            name = tgt.col_orig_case[col_map[cidx]]
+            if prefix is None:
+                out[i] = name
+            elif prefix in alias and prefix not in src.table_ids:
+                out[i] = "{}.{}".format(prefix, name)
+            else:
+                out[i] = "{}.{}".format(tgt.table_orig_case[table_map[src.table_ids[prefix]]], name)
+        for i, tok in enumerate(toks):
+            if "." in tok and tok.endswith(".*"):
+                prefix = tok[:-2]
+                if prefix in src.table_ids and prefix not in alias:
+                    out[i] = tgt.table_orig_case[table_map[src.table_ids[prefix]]] + ".*"
+        for i, value in zip(value_pos, strings):
+            old = toks[i][1:-1]
+            wild_l = "%" if old.startswith("%") else ""
+            wild_r = "%" if old.endswith("%") and len(old) > 1 else ""
+            out[i] = "'{}{}{}'".format(wild_l, value.replace("'", "''"), wild_r)
+        for i, value in zip(number_pos, numbers):
+            out[i] = value
+
+        quality = min(qualities) if len(qualities) > 0 else 1.0
+        # schema words of the question the sql does not use suggest a missing condition
+        used = set().union(*([tgt.table_words[t] for t in table_map.values()] +
+                             [tgt.col_words[c] for c in col_map.values()]))
+        asked = question_words & tgt.words
+        if len(asked) > 0:
+            quality = min(quality, len(asked & used) / len(asked))
+        return detokenize(out), quality
+
+    def is_valid(self, sql, db_id):
+        """
+        - True if `process_sql.get_sql` parses `sql` and sqlite can EXPLAIN it on `db_id`
+        """
+        try:
+            process_sql.get_sql(self.schema_registry.get_schema(db_id), sql)
+        except Exception:
+            return False
+        db_path = os.path.join(self.database_folder, db_id, db_id + ".sqlite")
+        if not os.path.isfile(db_path):
+            return False
+        con = sqlite3.connect("file:{}?mode=ro".format(db_path), uri=True)
+        try:
+            con.execute("EXPLAIN " + sql)
+            return True
+        except sqlite3.Error:
+            return False
+        finally:
+            con.close()
+
+    def candidates(self, question, db_id):
+        """
+        - adapted sqls of the closest reference questions
+        - OUTPUT:
+          - [(confidence, sql, reference), ...], most confident first (not validated)
+        """
+        out = []
+        for sim, ref in self.neighbors(question, db_id):
+            adapted = self.adapt(ref, question, db_id)
+            if adapted is not None:
+                out.append((sim * adapted[1], adapted[0], ref))
+        return sorted(out, key=lambda c: -c[0])
+
+    def best(self, question, db_id):
+        """
+        - OUTPUT:
+          - (confidence, sql) of the most confident valid candidate, (0.0, None) if there is none
+        """
+        for conf, sql, _ in self.candidates(question, db_id):
+            if self.is_valid(sql, db_id):
+                return conf, sql
+        return 0.0, None
+
+    def predict(self, question, db_id):
+        """
+        - OUTPUT:
+          - sql, None if no valid candidate reaches `threshold`
+        """
+        conf, sql = self.best(question, db_id)
+        answered = sql is not None and conf >= self.threshold
+        with self._lock:
+            self.stats["lookups"] += 1
+            self.stats["answered"] += answered
+        return sql if answered else None
@@ -94,6 +94,23 @@ def sql_sugg(db_id):
     return jsonify(sugg)
 
 
+@api.route("/ready", methods=['GET'])
+def ready():
+    # 503 until every model is loaded (by the warm-up, or on first use), so that load balancers hold traffic back
+    readiness = current_app.dataService.readiness()
+    return jsonify(readiness), (200 if readiness["ready"] else 503)
+
+
+@api.route("/cache_stats", methods=['GET'])
+def cache_stats():
+    return jsonify(current_app.dataService.cache_stats())
+
+
+@api.route("/model_stats", methods=['GET'])
+def model_stats():
+    return jsonify(current_app.dataService.models.stats())
+
+
 @api.route("/user_data", methods=['POST'])
 def get_user_data():
     user_data = request.json
@@ -107,6 +124,8 @@ def get_user_data():
     with open(os.path.join(user_data_folder, f"{userid}-{username}-{systype}-{timestamp}.json"),
               "w") as f:
         json.dump(user_data, f)
+    if current_app.dataService.global_variable.REC_APPEND_USER_QUERIES:
+        current_app.dataService.queue_reference_queries(current_app.dataService.logged_queries(user_data))
     return jsonify("successfully save user data!")
 
 
@@ -12,6 +12,8 @@ def create_app():
     # Create DataService Intstance
     dataService = DataService("spider")
     app.dataService = dataService
+    if dataService.global_variable.WARMUP_ON_STARTUP:
+        dataService.start_warmup()
 
     app.json_encoder = NpEncoder
     app.register_blueprint(api, url_prefix='/api')
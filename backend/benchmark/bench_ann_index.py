@@ -0,0 +1,50 @@
+"""
+Benchmark: recall/latency of `IVFFlatIndex` against exact (brute-force) cosine search.
+
+Synthetic clustered embeddings stand in for reference entities, so the corpus
+size can go well beyond Spider's `train_spider.json`.
+
+    cd backend && python benchmark/bench_ann_index.py [n_vectors]
+"""
+import os
+import sys
+from time import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.dataService.annIndex import IVFFlatIndex
+from app.dataService.similarity import normalize_rows
+
+
+def clustered(rng, centers, n, noise=1.2):
+    return normalize_rows(centers[rng.randint(len(centers), size=n)] + noise * normalize_rows(rng.randn(n, centers.shape[1])))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    dim, n_queries, k = 384, 200, 10
+    rng = np.random.RandomState(0)
+    centers = normalize_rows(rng.randn(2000, dim))
+    x = clustered(rng, centers, n)
+    queries = clustered(rng, centers, n_queries)
+
+    start = time()
+    exact_ids = np.zeros((n_queries, k), dtype=np.int64)
+    for qi, q in enumerate(queries):
+        s = x @ q
+        top = np.argpartition(-s, k)[:k]
+        exact_ids[qi] = top[np.argsort(-s[top])]
+    t_exact = (time() - start) / n_queries
+
+    start = time()
+    index = IVFFlatIndex().build(x)
+    print("vectors: {}, lists: {}, build: {:.2f}s".format(n, index.n_lists, time() - start))
+    print("exact: {:8.3f} ms/query".format(t_exact * 1000))
+    for n_probe in [1, 4, 8, 16, 32, 64]:
+        start = time()
+        _, ids = index.search(queries, k=k, n_probe=n_probe)
+        t_ann = (time() - start) / n_queries
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+        print("n_probe: {:3d}  recall@{}: {:.3f}  {:8.3f} ms/query  speedup: {:6.1f}x".format(
+            n_probe, k, recall, t_ann * 1000, t_exact / t_ann))
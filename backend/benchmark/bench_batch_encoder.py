@@ -0,0 +1,77 @@
+"""
+Benchmark: encode throughput of many small requests (1-5 sentences, like the
+recommender's call sites) from concurrent clients, calling `model.encode`
+directly vs. through the micro-batching `BatchEncoder`.
+
+    cd backend && python benchmark/bench_batch_encoder.py             # SentenceTransformer
+    cd backend && python benchmark/bench_batch_encoder.py --simulated # fixed per-call cost model
+"""
+import os
+import sys
+import threading
+from time import time, sleep
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.batchEncoder import BatchEncoder
+
+
+class SimulatedModel(object):
+    """
+    - stand-in with a fixed overhead per `encode` call plus a small cost per sentence
+    """
+
+    def __init__(self, call_cost=0.003, sentence_cost=0.0001, dim=384):
+        self.call_cost = call_cost
+        self.sentence_cost = sentence_cost
+        self.dim = dim
+        self._lock = threading.Lock()  # one forward pass at a time, like a single GPU/CPU model
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        n = 1 if single else len(sentences)
+        with self._lock:
+            sleep(self.call_cost + n * self.sentence_cost)
+        out = np.ones((n, self.dim), dtype=np.float32)
+        return out[0] if single else out
+
+
+def make_requests(rng, n_requests, vocab):
+    return [list(rng.choice(vocab, rng.randint(1, 6))) for _ in range(n_requests)]
+
+
+def run(encode, requests, n_clients):
+    chunks = [requests[i::n_clients] for i in range(n_clients)]
+    threads = [threading.Thread(target=lambda c=c: [encode(r) for r in c]) for c in chunks]
+    start = time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time() - start
+
+
+if __name__ == "__main__":
+    if "--simulated" in sys.argv:
+        model = SimulatedModel()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(GV.SENTENCE_MODEL_NAME)
+    rng = np.random.RandomState(0)
+    vocab = ["{} {}".format(c, i) for i in range(50) for c in GV.test_table_cols]
+    n_requests = 400
+    print("{:>8} {:>14} {:>14} {:>8} {:>10}".format("clients", "direct req/s", "batched req/s", "speedup", "avg batch"))
+    for n_clients in [1, 4, 16, 32]:
+        requests = make_requests(rng, n_requests, vocab)
+        t_direct = run(lambda r: model.encode(r, convert_to_numpy=True), requests, n_clients)
+        encoder = BatchEncoder(model)
+        t_batched = run(encoder.encode, requests, n_clients)
+        encoder.close()
+        print("{:>8} {:>14.1f} {:>14.1f} {:>7.1f}x {:>10.1f}".format(
+            n_clients, n_requests / t_direct, n_requests / t_batched, t_direct / t_batched,
+            encoder.stats["sentences"] / max(1, encoder.stats["batches"])))
@@ -0,0 +1,69 @@
+"""
+Report: reduced-precision reference embeddings (float16 / int8 `EmbeddingMatrix`) vs. float32.
+For every database the recommender state is built with each precision and compared with float32:
+  - db_df_bin: fraction of differing cells
+  - suggestions: fraction of identical suggestions over a short simulated session
+  - memory of the reference entity matrices
+Needs the Spider data and the sentence model.
+
+    cd backend && python benchmark/bench_embedding_dtype.py [n_dbs]
+"""
+import os
+import sys
+import json
+from time import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.dataService.queryRec import queryRecommender
+from app.dataService.schemaRegistry import get_schema_registry
+
+N_STEPS = 3
+SUPPORT = 0.6
+
+
+def session(qr, db_id, cols):
+    state = qr.get_db_state(db_id.replace("_", " ").strip(), cols)
+    context = {"select": [], "groupby": [], "agg": []}
+    suggestions = []
+    for _ in range(N_STEPS):
+        sugg = qr.query_suggestion(state.db_df_bin, context, SUPPORT, state=state)
+        suggestions.append(json.dumps(sugg, sort_keys=True, default=sorted))
+        if len(sugg["select"]) == 0 or len(state.db_df_bin.columns.difference(
+                np.concatenate(context["select"] + [sugg["select"][0]]))) == 0:
+            break
+        for k in context:
+            context[k].append(sugg[k][0])
+    return state.db_df_bin, suggestions
+
+
+if __name__ == "__main__":
+    registry = get_schema_registry()
+    n_dbs = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    db_ids = registry.db_names[:n_dbs]
+    results = {}
+    for dtype in ["float32", "float16", "int8"]:
+        qr = queryRecommender(use_artifacts=False, embedding_dtype=dtype)
+        start = time()
+        qr._build_ref_entities()
+        nbytes = qr.ref_ent_emb.nbytes + qr.ref_gb_emb.nbytes + qr.ref_agg_emb.nbytes
+        results[dtype] = {"nbytes": nbytes, "dbs": {}}
+        for db_id in db_ids:
+            results[dtype]["dbs"][db_id] = session(qr, db_id, registry.get_db_cols(db_id))
+        results[dtype]["time"] = time() - start
+    print("{:>8} {:>12} {:>14} {:>16} {:>9}".format("dtype", "entity MB", "bin diff cells", "same suggestion", "time s"))
+    for dtype, res in results.items():
+        diff_cells, cells, same, total = 0, 0, 0, 0
+        for db_id, (db_df_bin, suggestions) in res["dbs"].items():
+            ref_bin, ref_suggestions = results["float32"]["dbs"][db_id]
+            if list(db_df_bin.columns) == list(ref_bin.columns):
+                diff_cells += int((db_df_bin.values != ref_bin.values).sum())
+            else:
+                # column order follows the column sums, so reorder before comparing
+                diff_cells += int((db_df_bin[ref_bin.columns].values != ref_bin.values).sum())
+            cells += ref_bin.size
+            same += sum(a == b for a, b in zip(suggestions, ref_suggestions))
+            total += max(len(suggestions), len(ref_suggestions))
+        print("{:>8} {:>12.2f} {:>13.4f}% {:>15.1f}% {:>9.1f}".format(
+            dtype, res["nbytes"] / 2 ** 20, 100 * diff_cells / max(1, cells), 100 * same / max(1, total), res["time"]))
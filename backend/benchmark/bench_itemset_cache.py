@@ -0,0 +1,62 @@
+"""
+Benchmark: `query_suggestion` itemset mining over a simulated session,
+mining with `fpmax` on every request vs. the per-database `ItemsetCache`
+(cached results + derivation of column subsets from cached supersets).
+
+    cd backend && python benchmark/bench_itemset_cache.py
+"""
+import os
+import sys
+from time import time
+
+import numpy as np
+import pandas as pd
+from mlxtend.frequent_patterns import fpmax
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.dataService.itemsetCache import ItemsetCache
+
+
+def synthetic_bin(rng, n_rows=600, n_cols=40, n_topics=6):
+    # reference queries touch a few "topics", each topic makes a group of columns co-occur
+    topics = rng.randint(n_topics, size=n_cols)
+    row_topics = rng.rand(n_rows, n_topics) < 0.45
+    arr = row_topics[:, topics] & (rng.rand(n_rows, n_cols) < 0.85)
+    return pd.DataFrame(arr.astype(int), columns=["table: col {}".format(i) for i in range(n_cols)])
+
+
+def session_requests(rng, db_df_bin, n_steps=8, top_n=5):
+    # like `query_suggestion`: full matrix first, then context columns + top-n rest columns
+    columns = list(db_df_bin.columns)
+    context = []
+    requests = [columns]
+    for _ in range(n_steps):
+        rest = [c for c in columns if c not in context]
+        context.append(rest[rng.randint(len(rest))])
+        rest = [c for c in columns if c not in context]
+        requests.append(context + list(rng.choice(rest, top_n, replace=False)))
+    return requests
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    miner = lambda d, s: fpmax(d, min_support=s, use_colnames=True)
+    db_df_bin = synthetic_bin(rng)
+    sessions = [session_requests(rng, db_df_bin) for _ in range(20)]
+    for support in [0.2, 0.3, 0.6]:
+        t_plain, t_cached, latencies = 0.0, 0.0, []
+        cache = ItemsetCache()
+        for requests in sessions:
+            for cols in requests:
+                start = time()
+                expected = miner(db_df_bin[cols], support)
+                t_plain += time() - start
+                start = time()
+                got = cache.mine(db_df_bin[cols], support, miner, pin=len(cols) == db_df_bin.shape[1])
+                latencies.append(time() - start)
+                assert set(expected["itemsets"]) == set(got["itemsets"])
+        t_cached = sum(latencies)
+        n = len(latencies)
+        print("support {:.1f}: {} requests  fpmax: {:7.2f} ms/req  cached: {:7.2f} ms/req (p99 {:6.2f} ms)  "
+              "speedup: {:5.1f}x  {}".format(support, n, t_plain / n * 1000, t_cached / n * 1000,
+                                            np.percentile(latencies, 99) * 1000, t_plain / t_cached, cache.stats))
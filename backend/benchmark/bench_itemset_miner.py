@@ -0,0 +1,55 @@
+"""
+Benchmark: maximal itemset mining of recommender-like binary matrices,
+mlxtend `fpmax` vs. the packed-bitset miner (`itemsetMiner.fpmax_bitset`).
+Every run also checks that both miners return the same itemsets and supports.
+
+    cd backend && python benchmark/bench_itemset_miner.py
+"""
+import os
+import sys
+import warnings
+from time import time
+
+import numpy as np
+import pandas as pd
+from mlxtend.frequent_patterns import fpmax
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.dataService.itemsetMiner import fpmax_bitset
+
+
+def synthetic_bin(rng, n_rows, n_cols, n_topics=6):
+    # same generator as bench_itemset_cache.py: topics make groups of columns co-occur
+    topics = rng.randint(n_topics, size=n_cols)
+    row_topics = rng.rand(n_rows, n_topics) < 0.45
+    arr = row_topics[:, topics] & (rng.rand(n_rows, n_cols) < 0.85)
+    return pd.DataFrame(arr.astype(int), columns=["table: col {}".format(i) for i in range(n_cols)])
+
+
+def canonical(freq_combo):
+    return sorted((tuple(sorted(s)), round(float(p), 9))
+                  for s, p in zip(freq_combo["itemsets"], freq_combo["support"]))
+
+
+def timed(fn, repeat):
+    start = time()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time() - start) / repeat
+
+
+if __name__ == "__main__":
+    # `db_df_bin` is an int matrix; mlxtend warns about non-bool frames on every call
+    warnings.simplefilter("ignore", DeprecationWarning)
+    rng = np.random.RandomState(0)
+    print("{:>6} {:>5} {:>8} {:>10} {:>10} {:>8} {:>9}".format(
+        "rows", "cols", "support", "fpmax ms", "bitset ms", "speedup", "#itemsets"))
+    for n_rows, n_cols in [(200, 10), (600, 20), (600, 40), (2000, 40), (5000, 60)]:
+        df = synthetic_bin(rng, n_rows, n_cols)
+        for support in [0.4, 0.2]:
+            repeat = 5
+            ref, t_ref = timed(lambda: fpmax(df, min_support=support, use_colnames=True), repeat)
+            out, t_out = timed(lambda: fpmax_bitset(df, min_support=support), repeat)
+            assert canonical(ref) == canonical(out), "miners disagree ({} x {}, {})".format(n_rows, n_cols, support)
+            print("{:>6} {:>5} {:>8} {:>10.2f} {:>10.2f} {:>7.1f}x {:>9}".format(
+                n_rows, n_cols, support, t_ref * 1000, t_out * 1000, t_ref / t_out, len(out)))
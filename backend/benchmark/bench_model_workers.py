@@ -0,0 +1,125 @@
+"""
+Load test: model inference in the web process vs. `modelWorkers.WorkerPool` with 1, 2, 4, ... workers.
+Clients (like request handlers) send Spider questions/queries concurrently; reports throughput
+and latency percentiles per setup. Models: "sentence" (MiniLM encode, default), "text2sql" (SmBop predict)
+or "sql2text" (T5 sql2text); each worker uses `cpu_count // workers` torch threads. Synthetic models need no
+weights: "sleep" (50 ms per call, measures how many calls are served at once) and "cpu" (pure python loop,
+measures scaling over cores).
+Clients are threads, or with `--gevent` greenlets of one thread, as in the gevent server (`run-data-backend.py`).
+
+    cd backend && python benchmark/bench_model_workers.py [sentence|text2sql|sql2text|sleep|cpu] [n_requests] [max_workers] [--gevent]
+"""
+import os
+import sys
+import json
+import threading
+import multiprocessing
+from time import time, sleep
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService import modelWorkers
+
+
+class SyntheticModel(object):
+    def sleep(self):
+        sleep(0.05)
+
+    def cpu(self):
+        return sum(i * i for i in range(300000))
+
+
+def build_synthetic_model():
+    return SyntheticModel()
+
+
+FACTORIES = {
+    "sentence": modelWorkers.build_sentence_model,
+    "text2sql": modelWorkers.build_smbop,
+    "sql2text": modelWorkers.build_sql2nl,
+    "sleep": build_synthetic_model,
+    "cpu": build_synthetic_model,
+}
+
+
+def load_requests(kind, n):
+    """[(method, args), ...]"""
+    if kind in ("sleep", "cpu"):
+        return [(kind, ())] * n
+    with open(os.path.join(GV.SPIDER_FOLDER, "train_spider.json"), "r") as f:
+        records = json.load(f)
+    records = [records[i % len(records)] for i in range(n)]
+    if kind == "sentence":
+        return [("encode", ([r["question"]],)) for r in records]
+    if kind == "text2sql":
+        return [("predict", (r["question"], r["db_id"])) for r in records]
+    return [("sql2text", (r["query"],)) for r in records]
+
+
+def run_clients(call, requests, n_clients, use_gevent=False):
+    """send `requests` from `n_clients` threads (greenlets with `use_gevent`); OUTPUT: (seconds, latencies)"""
+    latencies = [None] * len(requests)
+    next_idx = iter(range(len(requests)))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_idx, None)
+            if i is None:
+                return
+            method, args = requests[i]
+            start = time()
+            call(method, *args)
+            latencies[i] = time() - start
+
+    start = time()
+    if use_gevent:
+        import gevent
+        gevent.joinall([gevent.spawn(client) for _ in range(n_clients)])
+    else:
+        threads = [threading.Thread(target=client) for _ in range(n_clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return time() - start, np.array(latencies)
+
+
+def report(name, elapsed, latencies):
+    print("{:>16} {:>10.2f} {:>10.1f} {:>10.1f}".format(
+        name, len(latencies) / elapsed, 1000 * np.percentile(latencies, 50), 1000 * np.percentile(latencies, 95)))
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    use_gevent = "--gevent" in sys.argv
+    kind = args[0] if len(args) > 0 else "sentence"
+    n = int(args[1]) if len(args) > 1 else 256
+    max_workers = int(args[2]) if len(args) > 2 else multiprocessing.cpu_count()
+    requests = load_requests(kind, n)
+    n_clients = 2 * max_workers
+    print("{}: {} requests from {} client {}, {} cores".format(
+        kind, n, n_clients, "greenlets" if use_gevent else "threads", multiprocessing.cpu_count()))
+    print("{:>16} {:>10} {:>10} {:>10}".format("", "req/s", "p50 ms", "p95 ms"))
+
+    model = FACTORIES[kind]()
+    run_clients(lambda method, *args: getattr(model, method)(*args), requests[:4], 1)  # warm-up
+    report("in-process", *run_clients(lambda method, *args: getattr(model, method)(*args), requests, n_clients,
+                                      use_gevent))
+    del model
+
+    n_workers = 1
+    while n_workers <= max_workers:
+        pool = modelWorkers.WorkerPool(FACTORIES[kind], n_workers,
+                                       torch_threads=max(1, multiprocessing.cpu_count() // n_workers), name=kind)
+        while list(pool.status()["workers"].values()).count("ready") < n_workers:
+            if "failed" in pool.status()["workers"].values():
+                raise RuntimeError("worker failed to load the model")
+            sleep(0.5)
+        run_clients(pool.call, requests[:2 * n_workers], n_workers, use_gevent)  # warm-up
+        report("{} worker(s)".format(n_workers), *run_clients(pool.call, requests, n_clients, use_gevent))
+        pool.close()
+        n_workers *= 2
@@ -0,0 +1,52 @@
+"""
+Benchmark: the recommender's reference corpus as the former full pandas DataFrame of
+`train_spider.json` vs. the compact columnar `RefCorpus` (cold build and snapshot load).
+
+    cd backend && python benchmark/bench_ref_corpus.py [path to train_spider.json]
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+from time import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.refCorpus import RefCorpus
+from app.dataService.schemaRegistry import get_schema_registry
+
+
+def timed(fn):
+    start = time()
+    out = fn()
+    return out, time() - start
+
+
+def load_frame(path):
+    with open(path, "r") as f:
+        return pd.DataFrame(json.load(f))
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(GV.SPIDER_FOLDER, "train_spider.json")
+    registry = get_schema_registry()
+    snapshot_folder = tempfile.mkdtemp()
+    try:
+        frame, t_frame = timed(lambda: load_frame(path))
+        _, t_build = timed(lambda: RefCorpus.load(path, registry.tables, registry.tables_path, snapshot_folder))
+        corpus, t_load = timed(lambda: RefCorpus.load(path, registry.tables, registry.tables_path, snapshot_folder))
+    finally:
+        shutil.rmtree(snapshot_folder)
+    frame_bytes = int(frame.memory_usage(index=True, deep=True).sum())
+    # vocabularies are python strings, count them too
+    vocab_bytes = sum(sys.getsizeof(v) for e in {id(e.vocab): e for e in corpus.entities.values()}.values()
+                      for v in e.vocab)
+    corpus_bytes = corpus.nbytes + vocab_bytes
+    print("{} reference queries".format(len(corpus)))
+    print("{:>22} {:>10} {:>10}".format("", "load s", "MB"))
+    print("{:>22} {:>10.3f} {:>10.2f}".format("DataFrame", t_frame, frame_bytes / 2 ** 20))
+    print("{:>22} {:>10.3f} {:>10.2f}".format("RefCorpus (build)", t_build, corpus_bytes / 2 ** 20))
+    print("{:>22} {:>10.3f} {:>10.2f}".format("RefCorpus (snapshot)", t_load, corpus_bytes / 2 ** 20))
@@ -0,0 +1,52 @@
+"""
+Benchmark: per-query similarity loop (old `search_sim_dbs`) vs. one matrix product
+with segmented max reductions over the reference-entity matrix.
+
+Embeddings are synthetic, so only the similarity/reduction cost is measured
+(the old loop additionally paid one `encode` round trip per reference query).
+
+    cd backend && python benchmark/bench_search_sim_dbs.py
+"""
+import os
+import sys
+from time import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.dataService.similarity import cos_sim, normalize_rows, segment_max, gather_segments
+
+
+def loop_bin(col_emb, ent_emb, offsets, rowids, th):
+    row_sims = []
+    for rowid in rowids:
+        row_sim = cos_sim(col_emb, ent_emb[offsets[rowid]:offsets[rowid + 1]])
+        row_sims.append(np.max(row_sim, axis=1))
+    return np.where(np.array(row_sims) > th, 1, 0)
+
+
+def vectorized_bin(col_emb, ent_emb, offsets, rowids, th):
+    slots, row_offsets = gather_segments(offsets, rowids)
+    ent_sim = normalize_rows(col_emb) @ ent_emb[slots].T
+    return np.where(segment_max(ent_sim, row_offsets, fill=-1.0).T > th, 1, 0)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    dim, n_cols, th = 384, 22, 0.4
+    for n_rows in [100, 1000, 7000, 50000]:
+        counts = rng.randint(1, 5, size=n_rows)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        ent_emb = normalize_rows(rng.randn(offsets[-1], dim))
+        col_emb = rng.randn(n_cols, dim).astype(np.float32)
+        rowids = np.arange(n_rows)
+
+        start = time()
+        expected = loop_bin(col_emb, ent_emb, offsets, rowids, th)
+        t_loop = time() - start
+        start = time()
+        got = vectorized_bin(col_emb, ent_emb, offsets, rowids, th)
+        t_vec = time() - start
+        assert (expected == got).all()
+        print("related queries: {:>6d}  loop: {:8.4f}s  vectorized: {:8.4f}s  speedup: {:6.1f}x".format(
+            n_rows, t_loop, t_vec, t_loop / t_vec))
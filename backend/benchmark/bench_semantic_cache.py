@@ -0,0 +1,78 @@
+"""
+Benchmark: semantic text2sql cache (`text2sqlCache.SemanticText2SQLCache`) on Spider paraphrases.
+Spider annotates most queries with several questions. Per database, the queries are split in two:
+the first question of every "seen" query is cached with its gold sql, then
+  - the other questions of seen queries are looked up (paraphrases: a hit should return their sql)
+  - all questions of "unseen" queries are looked up (every hit is a false hit)
+Reports, per similarity threshold, with and without the literal guards:
+  - hit rate: paraphrase lookups answered from the cache
+  - false-hit rate: hits whose sql differs from the gold sql of the question (over all hits)
+
+    cd backend && python benchmark/bench_semantic_cache.py [json file under the spider folder]
+"""
+import os
+import re
+import sys
+import json
+from collections import OrderedDict
+
+from sentence_transformers import SentenceTransformer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.embeddingStore import EmbeddingStore
+from app.dataService.text2sqlCache import SemanticText2SQLCache
+
+THRESHOLDS = [0.8, 0.85, 0.9, 0.95]
+
+
+def norm_sql(sql):
+    """lower case and single spaces outside string literals (values are case sensitive in sqlite)"""
+    parts = re.split(r"('[^']*')", sql.replace('"', "'"))
+    return "".join(p if i % 2 == 1 else " ".join(p.split()).lower() for i, p in enumerate(parts)).strip()
+
+
+def load_groups(file_name):
+    """db_id => [(gold sql, [question, ...]), ...]"""
+    with open(os.path.join(GV.SPIDER_FOLDER, file_name), "r") as f:
+        records = json.load(f)
+    groups = OrderedDict()
+    for r in records:
+        groups.setdefault(r["db_id"], OrderedDict()).setdefault(norm_sql(r["query"]), []).append(r["question"])
+    return {db_id: list(g.items()) for db_id, g in groups.items()}
+
+
+def run(encoder, groups, threshold, guards):
+    n_para = n_para_hits = n_unseen = n_hits = n_false = 0
+    for db_id, queries in groups.items():
+        cache = SemanticText2SQLCache(encoder, threshold=threshold, db_thresholds={}, guards=guards)
+        seen, unseen = queries[0::2], queries[1::2]
+        for sql, questions in seen:
+            cache.put(db_id, questions[0], sql)
+        lookups = [(sql, q, True) for sql, questions in seen for q in questions[1:]]
+        lookups += [(sql, q, False) for sql, questions in unseen for q in questions]
+        for sql, q, is_seen in lookups:
+            hit = cache.get(db_id, q)
+            n_para += is_seen
+            n_unseen += not is_seen
+            if hit is not None:
+                n_hits += 1
+                n_para_hits += is_seen
+                n_false += hit != sql
+    return n_para, n_para_hits, n_unseen, n_hits, n_false
+
+
+if __name__ == "__main__":
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "train_spider.json"
+    groups = load_groups(file_name)
+    encoder = EmbeddingStore(SentenceTransformer(GV.SENTENCE_MODEL_NAME),
+                             os.path.join(GV.EMBEDDING_CACHE_FOLDER, GV.SENTENCE_MODEL_NAME))
+    print("{} databases, {} queries".format(len(groups), sum(len(g) for g in groups.values())))
+    print("{:>9} {:>7} {:>11} {:>11} {:>9} {:>14}".format(
+        "threshold", "guards", "paraphrases", "hit rate", "hits", "false-hit rate"))
+    for threshold in THRESHOLDS:
+        for guards in [False, True]:
+            n_para, n_para_hits, n_unseen, n_hits, n_false = run(encoder, groups, threshold, guards)
+            print("{:>9.2f} {:>7} {:>11} {:>10.1f}% {:>9} {:>13.1f}%".format(
+                threshold, "on" if guards else "off", n_para, 100 * n_para_hits / max(1, n_para), n_hits,
+                100 * n_false / max(1, n_hits)))
@@ -0,0 +1,57 @@
+"""
+Benchmark: SQL-to-NL generation on Spider queries,
+  - per sql, padded to max_length=1024 with the slow tokenizer (former `SQL2NL.sql2text`)
+  - `SQL2NL.sql2text_batch`: dynamic padding to the longest prompt of a batch, slow and fast tokenizer
+Also checks that the fast tokenizer gives the same ids and that all variants generate the same text.
+Needs the UnifiedSKG sql2text model.
+
+    cd backend && python benchmark/bench_sql2nl_batch.py [n_sqls]
+"""
+import os
+import sys
+import json
+from time import time
+
+import torch
+from transformers import AutoTokenizer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.sqlParser import SQL2NL
+
+
+def padded_sql2text(sql2nl, tokenizer, sql):
+    tokenized_txt = tokenizer([sql2nl.prompt(sql)], max_length=1024, padding="max_length", truncation=True)
+    return tokenizer.batch_decode(
+        sql2nl.model.generate(torch.LongTensor(tokenized_txt.data['input_ids']),
+                              torch.LongTensor(tokenized_txt.data['attention_mask']),
+                              num_beams=1, max_length=256),
+        skip_special_tokens=True)[0]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    with open(os.path.join(GV.SPIDER_FOLDER, "train_spider.json"), "r") as f:
+        sqls = [r["query"] for r in json.load(f)][:n]
+    sql2nl = SQL2NL(use_fast=False)
+    slow = sql2nl.tokenizer
+    fast = AutoTokenizer.from_pretrained(GV.SQL2NL_MODEL_NAME, use_fast=True)
+    prompts = [sql2nl.prompt(sql) for sql in sqls]
+    print("fast tokenizer ids identical: {}".format(SQL2NL.same_ids(slow, fast, prompts)))
+    print("avg prompt tokens: {:.1f} (padded: 1024)".format(
+        sum(len(ids) for ids in slow(prompts)["input_ids"]) / len(prompts)))
+
+    start = time()
+    ref = [padded_sql2text(sql2nl, slow, sql) for sql in sqls]
+    t_ref = time() - start
+    print("{:>24} {:>8} {:>9} {:>9} {:>9}".format("", "batch", "sql/s", "speedup", "same nl"))
+    print("{:>24} {:>8} {:>9.2f} {:>9} {:>9}".format("max_length, per sql", 1, len(sqls) / t_ref, "1.0x", "-"))
+    for name, tokenizer in [("dynamic, slow tokenizer", slow), ("dynamic, fast tokenizer", fast)]:
+        sql2nl.tokenizer = tokenizer
+        for batch_size in [1, 4, 16]:
+            start = time()
+            out = sql2nl.sql2text_batch(sqls, batch_size=batch_size)
+            elapsed = time() - start
+            same = sum(a == b for a, b in zip(out, ref)) / len(sqls)
+            print("{:>24} {:>8} {:>9.2f} {:>8.1f}x {:>8.1f}%".format(
+                name, batch_size, len(sqls) / elapsed, t_ref / elapsed, 100 * same))
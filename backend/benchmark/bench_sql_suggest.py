@@ -0,0 +1,116 @@
+"""
+Benchmark: latency of the recommender part of `DataService.sql_suggest` (`get_db_state` + `query_suggestion`,
+without the text2sql/sql2text models) over simulated sessions, the first recommender
+(`query_rec_baseline.BaselineQueryRecommender`) vs. `queryRecommender`.
+A session is one database: the initial suggestion, then `n_steps` requests that each append the first suggestion
+to the context (as the frontend does). Reports p50/p99 of the first request of a database (cold) and of the
+follow-up requests (warm), and checks that both recommenders suggest the same queries.
+`--words` uses `query_rec_baseline.WordModel` instead of MiniLM, e.g. on the test fixture:
+
+    cd backend && python benchmark/bench_sql_suggest.py [spider folder] [n_dbs] [n_steps] [--words]
+    cd backend && python benchmark/bench_sql_suggest.py tests/fixtures/spider 3 5 --words
+"""
+import os
+import sys
+import shutil
+import tempfile
+from time import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.schemaRegistry import SchemaRegistry
+from app.dataService.queryRec import queryRecommender
+from query_rec_baseline import BaselineQueryRecommender, WordModel
+
+
+def run_session(suggest, db_id, n_steps):
+    """OUTPUT: (latencies, suggestions)"""
+    context = {"select": [], "groupby": [], "agg": []}
+    latencies, suggestions = [], []
+    for _ in range(n_steps + 1):
+        start = time()
+        sugg = suggest(db_id, context)
+        latencies.append(time() - start)
+        suggestions.append(sugg)
+        for key in context:
+            context[key].append(sugg[key][0])
+    return latencies, suggestions
+
+
+def baseline_suggest(model, registry, ref_path):
+    recs = {}
+
+    def suggest(db_id, context):
+        # one instance per database: the baseline keeps the rows of the last searched database
+        if db_id not in recs:
+            recs[db_id] = BaselineQueryRecommender(model, registry, ref_path)
+        rec = recs[db_id]
+        db_df_bin = rec.search_sim_dbs(db_id.replace("_", " ").strip(), registry.db_cols[db_id])
+        return rec.query_suggestion(db_df_bin, context, 0.6)
+    return suggest
+
+
+def current_suggest(rec, registry):
+    def suggest(db_id, context):
+        db_state = rec.get_db_state(db_id.replace("_", " ").strip(), registry.db_cols[db_id])
+        return rec.query_suggestion(db_state.db_df_bin, context, 0.6, state=db_state)
+    return suggest
+
+
+def normalized(suggestions):
+    return [[sorted(cols) for cols in sugg["select"]] + sugg["groupby"] + sugg["agg"] for sugg in suggestions]
+
+
+def report(name, cold, warm):
+    print("{:>10} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+        name, 1000 * np.percentile(cold, 50), 1000 * np.percentile(cold, 99),
+        1000 * np.percentile(warm, 50), 1000 * np.percentile(warm, 99)))
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    spider_folder = args[0] if len(args) > 0 else GV.SPIDER_FOLDER
+    n_dbs = int(args[1]) if len(args) > 1 else 20
+    n_steps = int(args[2]) if len(args) > 2 else 5
+    if "--words" in sys.argv:
+        model = WordModel()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(GV.SENTENCE_MODEL_NAME)
+    ref_path = os.path.join(spider_folder, "train_spider.json")
+    registry = SchemaRegistry(tables_path=os.path.join(spider_folder, "tables.json"), use_snapshot=False)
+    db_ids = registry.db_names[:n_dbs]
+
+    # cold caches: embeddings, ANN indexes and the corpus snapshot go to a temporary folder
+    cache_folder = tempfile.mkdtemp()
+    GV.EMBEDDING_CACHE_FOLDER = os.path.join(cache_folder, "embeddings")
+    GV.ANN_INDEX_FOLDER = os.path.join(cache_folder, "ann")
+    GV.REF_CORPUS_FOLDER = os.path.join(cache_folder, "ref_corpus")
+    try:
+        rec = queryRecommender(ref_db_meta_path=ref_path, schema_registry=registry, use_artifacts=False,
+                               sentence_model=model)
+        setups = [("baseline", baseline_suggest(model, registry, ref_path)),
+                  ("current", current_suggest(rec, registry))]
+        print("{} databases, {} requests per session".format(len(db_ids), n_steps + 1))
+        print("{:>10} {:>10} {:>10} {:>10} {:>10}".format("", "cold p50", "cold p99", "warm p50", "warm p99"))
+        outputs = {}
+        for name, suggest in setups:
+            cold, warm = [], []
+            # `_build_db_state` prints the related databases
+            sys_stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            try:
+                for db_id in db_ids:
+                    latencies, outputs[name, db_id] = run_session(suggest, db_id, n_steps)
+                    cold.append(latencies[0])
+                    warm += latencies[1:]
+            finally:
+                sys.stdout.close()
+                sys.stdout = sys_stdout
+            report(name, cold, warm)
+        n_same = sum(normalized(outputs["baseline", db_id]) == normalized(outputs["current", db_id])
+                     for db_id in db_ids)
+        print("same suggestions: {}/{} sessions".format(n_same, len(db_ids)))
+    finally:
+        shutil.rmtree(cache_folder)
@@ -0,0 +1,45 @@
+"""
+Benchmark: SmBop text-to-SQL on CPU, one question per forward pass vs. `SmBop.predict_batch`
+at batch sizes 1-16: latency per forward pass, throughput, and agreement with batch size 1.
+Questions are the reference questions of a few Spider databases. Needs the SmBop model.
+
+    cd backend && python benchmark/bench_text2sql_batch.py [n_questions]
+"""
+import os
+import sys
+import json
+from time import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.sqlParser import SmBop
+
+DB_IDS = ["cinema", "store_1", GV.test_topic]
+
+
+def load_pairs(n):
+    with open(os.path.join(GV.SPIDER_FOLDER, "train_spider.json"), "r") as f:
+        records = json.load(f)
+    pairs = [(r["question"], r["db_id"]) for r in records if r["db_id"] in DB_IDS]
+    return pairs[:n]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    smbop = SmBop()
+    pairs = load_pairs(n)
+    # warm-up (lazy allocations, schema caches of the dataset reader)
+    smbop.predict_batch(pairs[:2], batch_size=2)
+    start = time()
+    ref = [smbop.predict(q, db_id) for q, db_id in pairs]
+    t_serial = time() - start
+    print("{} questions, serial predict: {:.2f}s ({:.2f} q/s)".format(len(pairs), t_serial, len(pairs) / t_serial))
+    print("{:>6} {:>12} {:>10} {:>9} {:>10}".format("batch", "ms / batch", "q/s", "speedup", "same sql"))
+    for batch_size in [1, 2, 4, 8, 16]:
+        start = time()
+        out = smbop.predict_batch(pairs, batch_size=batch_size)
+        elapsed = time() - start
+        n_batches = (len(pairs) + batch_size - 1) // batch_size
+        same = sum(a == b for a, b in zip(out, ref)) / max(1, len(pairs))
+        print("{:>6} {:>12.1f} {:>10.2f} {:>8.1f}x {:>9.1f}%".format(
+            batch_size, 1000 * elapsed / n_batches, len(pairs) / elapsed, t_serial / elapsed, 100 * same))
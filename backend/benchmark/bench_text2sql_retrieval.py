@@ -0,0 +1,88 @@
+"""
+Benchmark: retrieval fast path of text-to-SQL (`text2sqlRetrieval.RetrievalText2SQL`) on Spider dev.
+Every dev question is answered by its most confident valid retrieved sql (references: Spider train, whose
+databases are disjoint from dev's); per confidence threshold reports
+  - coverage: questions answered by the fast path
+  - execution accuracy of those answers (same result rows as the gold sql on the dev database)
+  - fast path latency; with `--smbop` also SmBop's latency and accuracy on the answered questions,
+    and the accuracy of fast path + SmBop fallback
+Needs the sentence model (and the SmBop model with `--smbop`).
+
+    cd backend && python benchmark/bench_text2sql_retrieval.py [n_questions] [--smbop]
+"""
+import os
+import sys
+import json
+import sqlite3
+from time import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.embeddingStore import EmbeddingStore
+from app.dataService.text2sqlRetrieval import RetrievalText2SQL
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+def execute(sql, db_id):
+    """result rows of `sql` (sorted unless it orders them), None if it fails"""
+    con = sqlite3.connect("file:{}?mode=ro".format(
+        os.path.join(GV.SPIDER_FOLDER, "database", db_id, db_id + ".sqlite")), uri=True)
+    con.text_factory = lambda b: b.decode(errors="ignore")
+    try:
+        rows = con.execute(sql).fetchall()
+    except Exception:
+        return None
+    finally:
+        con.close()
+    return rows if "order by" in sql.lower() else sorted(rows, key=repr)
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n = int(args[0]) if len(args) > 0 else None
+    with open(os.path.join(GV.SPIDER_FOLDER, "dev.json"), "r") as f:
+        records = json.load(f)[:n]
+    model = SentenceTransformer(GV.SENTENCE_MODEL_NAME)
+    retrieval = RetrievalText2SQL(model, store=EmbeddingStore(model, GV.TEXT2SQL_RETRIEVAL_EMBEDDING_FOLDER))
+    start = time()
+    retrieval.neighbors(records[0]["question"], records[0]["db_id"])  # embeds the reference questions
+    print("reference index: {} questions, {:.1f}s".format(len(retrieval.refs), time() - start))
+
+    confs, correct, t_fast = [], [], []
+    for r in records:
+        start = time()
+        conf, sql = retrieval.best(r["question"], r["db_id"])
+        t_fast.append(time() - start)
+        gold = execute(r["query"], r["db_id"])
+        confs.append(conf if sql is not None else -1.0)
+        correct.append(sql is not None and gold is not None and execute(sql, r["db_id"]) == gold)
+    confs, correct = np.array(confs), np.array(correct)
+    print("{} dev questions, fast path: {:.1f} ms / question".format(len(records), 1000 * np.mean(t_fast)))
+
+    smbop_correct = None
+    if "--smbop" in sys.argv:
+        from app.dataService.sqlParser import SmBop
+        smbop = SmBop()
+        start = time()
+        preds = smbop.predict_batch([(r["question"], r["db_id"]) for r in records], batch_size=1)
+        print("SmBop: {:.1f} ms / question".format(1000 * (time() - start) / len(records)))
+        smbop_correct = np.array([execute(p, r["db_id"]) == execute(r["query"], r["db_id"])
+                                  for p, r in zip(preds, records)])
+        print("SmBop execution accuracy: {:.1f}%".format(100 * smbop_correct.mean()))
+
+    print("{:>9} {:>9} {:>14} {:>15} {:>15}".format(
+        "threshold", "coverage", "fast accuracy", "SmBop accuracy", "fast + SmBop"))
+    for th in THRESHOLDS:
+        answered = confs >= th
+        acc = correct[answered].mean() if answered.any() else float("nan")
+        if smbop_correct is None:
+            smbop_acc = combined = float("nan")
+        else:
+            smbop_acc = smbop_correct[answered].mean() if answered.any() else float("nan")
+            combined = np.where(answered, correct, smbop_correct).mean()
+        print("{:>9.2f} {:>8.1f}% {:>13.1f}% {:>14.1f}% {:>14.1f}%".format(
+            th, 100 * answered.mean(), 100 * acc, 100 * smbop_acc, 100 * combined))
@@ -0,0 +1,123 @@
+"""
+Benchmark: recommender similarity computations on synthetic wide schemas (up to 5k columns),
+dense (full similarity matrices) vs. blockwise under `GV.REC_SIM_MEMORY_LIMIT`:
+  - column groups: community detection over the column embeddings
+  - reference hits: columns x reference `select` entities, max per reference query (`_build_db_state`)
+  - context scores: max similarity of every column to a context (`cal_cosine_max`)
+  - relevance: column co-occurrence similarity to a context (`DBState.cooccurrence`)
+Every run checks that both variants agree; peak memory is measured with tracemalloc.
+
+    cd backend && python benchmark/bench_wide_schema.py [memory limit MB]
+"""
+import os
+import sys
+import tracemalloc
+from time import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import app.dataService.globalVariable as GV
+from app.dataService.recState import DBState
+from app.dataService.similarity import normalize_rows, cos_sim, cos_sim_max, community_detection, \
+    segment_max, block_rows, EmbeddingMatrix
+
+DIM = 384
+N_REF_ROWS = 4000
+ENTS_PER_ROW = 3
+N_CONTEXT = 4
+
+
+def synthetic_schema(rng, n_cols, n_topics=50):
+    # columns drawn around topic centers, so that the semantic groups are not trivial
+    centers = normalize_rows(rng.randn(n_topics, DIM))
+    emb = centers[rng.randint(n_topics, size=n_cols)] + 0.12 * rng.randn(n_cols, DIM)
+    return normalize_rows(emb), centers
+
+
+def dense_communities(emb, threshold, min_size):
+    sim = cos_sim(emb, emb)
+    communities = []
+    for i in np.where((sim >= threshold).sum(axis=1) >= min_size)[0]:
+        ids = np.where(sim[i] >= threshold)[0]
+        communities.append(ids[np.argsort(-sim[i, ids], kind="stable")].tolist())
+    communities = sorted(communities, key=len, reverse=True)
+    unique, taken = [], set()
+    for community in communities:
+        community = [idx for idx in community if idx not in taken]
+        if len(community) >= min_size:
+            unique.append(community)
+            taken.update(community)
+    return sorted(unique, key=len, reverse=True)
+
+
+def blockwise_hits(ents, ent_ids, offsets, col_emb, th, max_bytes):
+    hits = np.zeros((len(offsets) - 1, len(col_emb)), dtype=bool)
+    step = block_rows(len(ent_ids) * 4, max_bytes)
+    for start in range(0, len(col_emb), step):
+        hits[:, start:start + step] = segment_max(ents.sim(col_emb[start:start + step], ent_ids), offsets,
+                                                  fill=-1.0).T > th
+    return hits
+
+
+def measured(fn):
+    tracemalloc.start()
+    start = time()
+    out = fn()
+    elapsed = time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def state_of(rng, n_cols):
+    state = DBState("wide", ["t: c{}".format(i) for i in range(n_cols)])
+    state.db_df_bin = pd.DataFrame((rng.rand(N_REF_ROWS, n_cols) < 0.05).astype(np.int64),
+                                   columns=state.search_cols)
+    return state
+
+
+if __name__ == "__main__":
+    max_bytes = int(float(sys.argv[1]) * 2 ** 20) if len(sys.argv) > 1 else GV.REC_SIM_MEMORY_LIMIT
+    rng = np.random.RandomState(0)
+    print("memory limit: {:.0f} MB".format(max_bytes / 2 ** 20))
+    print("{:>6} {:>14} {:>10} {:>10} {:>12} {:>12}".format(
+        "cols", "step", "dense s", "block s", "dense MB", "block MB"))
+    for n_cols in [500, 2000, 5000]:
+        col_emb, centers = synthetic_schema(rng, n_cols)
+        rows = []
+
+        ref_groups, t_ref, m_ref = measured(lambda: dense_communities(col_emb, 0.8, 2))
+        groups, t_out, m_out = measured(lambda: community_detection(col_emb, 0.8, 2, max_bytes))
+        assert groups == ref_groups, "column groups differ"
+        rows.append(("col groups", t_ref, t_out, m_ref, m_out))
+
+        ref_emb, _ = synthetic_schema(rng, 20000)
+        ents = EmbeddingMatrix(ref_emb)
+        ent_ids = rng.randint(len(ref_emb), size=N_REF_ROWS * ENTS_PER_ROW)
+        offsets = np.arange(0, len(ent_ids) + 1, ENTS_PER_ROW)
+        ref_hits, t_ref, m_ref = measured(
+            lambda: segment_max(ents.sim(col_emb, ent_ids), offsets, fill=-1.0).T > 0.4)
+        hits, t_out, m_out = measured(lambda: blockwise_hits(ents, ent_ids, offsets, col_emb, 0.4, max_bytes))
+        assert np.array_equal(hits, ref_hits), "reference hits differ"
+        rows.append(("ref hits", t_ref, t_out, m_ref, m_out))
+
+        context = centers[:N_CONTEXT]
+        ref_max, t_ref, m_ref = measured(lambda: np.max(cos_sim(col_emb, context), axis=1))
+        out_max, t_out, m_out = measured(lambda: cos_sim_max(col_emb, context, max_bytes))
+        assert np.allclose(ref_max, out_max, atol=1e-6), "context similarities differ"
+        rows.append(("context", t_ref, t_out, m_ref, m_out))
+
+        idx = list(range(N_CONTEXT))
+        wide = state_of(rng, n_cols)
+        full = DBState("wide", wide.search_cols)
+        full.db_df_bin = wide.db_df_bin
+        ref_rel, t_ref, m_ref = measured(lambda: full.cooccurrence(idx, max_bytes=float("inf")))
+        out_rel, t_out, m_out = measured(lambda: wide.cooccurrence(idx, max_bytes=max_bytes))
+        assert np.allclose(ref_rel, out_rel, atol=1e-6), "co-occurrence similarities differ"
+        rows.append(("relevance", t_ref, t_out, m_ref, m_out))
+
+        for step, t_ref, t_out, m_ref, m_out in rows:
+            print("{:>6} {:>14} {:>10.3f} {:>10.3f} {:>12.1f} {:>12.1f}".format(
+                n_cols, step, t_ref, t_out, m_ref / 2 ** 20, m_out / 2 ** 20))
@@ -0,0 +1,341 @@
+"""
+The query recommender before the performance work: `search_sim_dbs`, `get_grouped_cols`, `get_freq_combo`,
+`get_opts` and `query_suggestion` as in the first version of `app/dataService/queryRec.py` (commented-out code
+and debug prints removed). Reference for `bench_sql_suggest.py` and for the golden tests (`tests/test_query_rec.py`).
+
+`WordModel` is a sentence model without weights, for runs without the MiniLM download.
+
+Differences to the original, none of which changes results:
+  - the sentence model and the schema are passed in instead of being loaded from `GV`
+  - `util.community_detection` is called without `init_max_size`, which sentence-transformers >= 2.2 removed
+  - `get_freq_combo` ranks itemsets of the same length and support by their sorted item names (as `ItemsetCache`
+    does); `fpmax` returns them in the order of numpy's unstable argsort, which differs between CPUs
+"""
+import re
+import math
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+import torch
+from sentence_transformers import util
+from mlxtend.frequent_patterns import fpmax
+from sklearn.metrics.pairwise import cosine_similarity
+
+import app.dataService.globalVariable as GV
+from app.dataService.utils.processSQL import decode_sql
+from app.dataService.utils.processSQL.decode_sql import extract_select_names, extract_agg_opts, \
+    extract_groupby_names
+
+
+class WordModel(object):
+    """
+    - `SentenceTransformer` stand-in: a sentence embeds as the sum of fixed random vectors of its words and of
+      their 4-letter prefixes (so "director" and "directed by" are similar), L2-normalized
+    """
+
+    def __init__(self, dim=64):
+        self.dim = dim
+        self._vecs = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _vec(self, token):
+        if token not in self._vecs:
+            seed = int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+            self._vecs[token] = np.random.RandomState(seed).randn(self.dim)
+        return self._vecs[token]
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim)
+        for word in re.findall(r"[a-z0-9*]+", text.lower()):
+            vec += self._vec(word) + 0.5 * self._vec("prefix:" + word[:4])
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def encode(self, sentences, convert_to_tensor=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        emb = np.array([self._embed(s) for s in ([sentences] if single else list(sentences))],
+                       dtype=np.float32).reshape(-1, self.dim)
+        emb = emb[0] if single else emb
+        return torch.from_numpy(emb) if convert_to_tensor else emb
+
+
+class BaselineQueryRecommender(object):
+    def __init__(self, model, schema_registry, ref_db_meta_path, topic_sim_th=0.55, item_sim=0.4, alpha=0.9,
+                 beta=0.5, groupby_th=0.7, agg_th=0.5, sim=0.7, opt_n=1):
+        self.model = model
+        self.db_names = schema_registry.db_names
+        self.tables = schema_registry.tables
+        self.db_new_names = [re.sub(r'[0-9]+', '', n.replace("_", " ")).strip().lower() for n in
+                             self.db_names]
+        self.topic_sim_th = topic_sim_th
+        self.item_sim = item_sim
+        self.groupby_th = groupby_th
+        self.agg_th = agg_th
+        self.sim = sim
+        self.alpha = alpha
+        self.beta = beta
+        self.opt_n = opt_n
+        with open(ref_db_meta_path, "r") as f:
+            self.dataset = pd.DataFrame(json.load(f))
+        self.db_cache = {}
+        self.g_cols_cache = {}
+        self.pre_sel = []
+
+    def cal_cosine_sim(self, sen0, sen1):
+        if isinstance(sen0, list):
+            sen0 = ["".join(s.split(":")[1:]) if ":" in s else s for s in sen0]
+        elif isinstance(sen0, str):
+            sen0 = "".join(sen0.split(":")[1:]) if ":" in sen0 else sen0
+        if isinstance(sen1, list):
+            sen1 = ["".join(s.split(":")[1:]) if ":" in s else s for s in sen1]
+        elif isinstance(sen1, str):
+            sen1 = "".join(sen1.split(":")[1:]) if ":" in sen1 else sen1
+        embedd0 = self.model.encode(sen0, convert_to_tensor=True)
+        embedd1 = self.model.encode(sen1, convert_to_tensor=True)
+        cosine_scores = util.pytorch_cos_sim(embedd0, embedd1).cpu().numpy()
+        return cosine_scores
+
+    def search_sim_dbs(self, topic, search_cols):
+        cols_groups = self.get_grouped_cols(search_cols)
+        self.g_cols_cache = cols_groups
+
+        if topic in self.db_cache.keys():
+            return self.db_cache[topic]
+
+        self.search_cols = search_cols
+        sim_scores = self.cal_cosine_sim(topic, self.db_new_names)[0]
+        related_db_names = [self.db_names[i] for i in np.where(sim_scores > self.topic_sim_th)[0]]
+        row_sims = []
+        rowids = []
+        for rowid, row in self.dataset.iterrows():
+            if row["db_id"] in related_db_names:
+                rowids.append(rowid)
+                select_decoded = decode_sql(row["sql"], self.tables[row["db_id"]])["select"]
+                select_ents = extract_select_names(select_decoded)
+                row_sim = self.cal_cosine_sim(self.search_cols, select_ents)
+                row_sims.append(np.max(row_sim, axis=1))
+        db_df_bin = pd.DataFrame(np.where(np.array(row_sims) > self.item_sim, 1, 0),
+                                 columns=self.search_cols)
+        self.ref_db = (self.dataset.loc[rowids]).reset_index(drop=True)
+        sim_sum = [sum(db_df_bin[col]) for col in db_df_bin.columns]
+        db_df_bin = db_df_bin[db_df_bin.columns[(-np.array(sim_sum)).argsort()]]
+
+        self.db_cache[topic] = db_df_bin
+        return db_df_bin
+
+    def get_grouped_cols(self, columns, min_size=2, th=0.8):
+        corpus_embeddings = self.model.encode(columns, convert_to_tensor=False)
+        clusters = util.community_detection(corpus_embeddings, min_community_size=min_size, threshold=th)
+        col_groups = [set([columns[c] for c in cluster]) for cluster in clusters]
+        col_groups += GV.col_combo
+        return col_groups
+
+    def get_freq_combo(self, df, filter_set=set([]), support=None, max_len=3):
+        if support is None:
+            support = self.item_sim
+        freq_combo = fpmax(df, min_support=support, use_colnames=True)
+        freq_combo = freq_combo.iloc[sorted(range(len(freq_combo)),
+                                            key=lambda i: sorted(freq_combo["itemsets"].values[i]))]
+        freq_combo["itemlen"] = freq_combo["itemsets"].apply(len)
+        freq_combo["itemW"] = freq_combo["itemlen"] * np.square(freq_combo["support"])
+        if len(filter_set) > 0:
+            freq_combo = freq_combo.iloc[
+                [rowid for rowid, row in enumerate(freq_combo["itemsets"]) if
+                 row.issubset(filter_set) == False]]
+        freq_combo = freq_combo.sort_values(["itemlen", "support"], ascending=False).reset_index(
+            drop=True)
+        return freq_combo
+
+    def get_opts(self, df, cols, groupby_contexts=[], agg_contexts=[], top_n=1):
+        agg_opts = ['max', 'min', 'count', 'sum', 'avg']
+        groupby_sugg = []
+        agg_sugg = []
+
+        gb_sugg_context = []
+        if len(groupby_contexts) > 0:
+            groupby_contexts = np.hstack(groupby_contexts)
+            if len(groupby_contexts) > 0:
+                df_col_diff = df.columns.difference(set(groupby_contexts))
+                groupby_c_sim = np.max(self.cal_cosine_sim(groupby_contexts, df_col_diff), axis=0)
+                df_col_diff = df_col_diff[(-groupby_c_sim).argsort()]
+                groupby_c_sim = groupby_c_sim[(-groupby_c_sim).argsort()]
+                gb_sugg_context = [gb for gb in list(df_col_diff[groupby_c_sim > self.groupby_th]) if
+                                   "*" not in gb]
+
+        for _, col in enumerate(cols):
+            col_mul = np.prod(df[col], axis=1)
+            col_mul_idx = np.where(col_mul == 1)[0]
+            all_groupby_names = []
+            agg_list = []
+            for rowid, row in self.ref_db.iloc[col_mul_idx].iterrows():
+                db_id = row["db_id"]
+                table = self.tables[db_id]
+                sql = row["sql"]
+                groupby_decoded = decode_sql(sql, table)["groupBy"]
+                groupby_names = extract_groupby_names(groupby_decoded)
+                select_decoded = decode_sql(sql, table)["select"]
+                agg_dict = extract_agg_opts(select_decoded)
+                agg_list.append(agg_dict)
+                if len(groupby_names) > 0:
+                    all_groupby_names.append(groupby_names)
+            gb_sugg = []
+            if len(col_mul_idx) > 0:
+                if len(all_groupby_names) / len(
+                        col_mul_idx) > self.groupby_th:
+                    groupby_sim = np.max(
+                        self.cal_cosine_sim(np.concatenate(all_groupby_names), df.columns), axis=0)
+                    groupby_cols = df.columns[(-groupby_sim).argsort()]
+                    groupby_sim = groupby_sim[(-groupby_sim).argsort()]
+                    gb_sugg = list(
+                        groupby_cols[groupby_sim > self.groupby_th])
+            if len(gb_sugg_context) > 0:
+                if len(gb_sugg_context) >= top_n:
+                    gb_sugg = gb_sugg_context[:top_n]
+                else:
+                    gb_sugg = gb_sugg[:(top_n - len(gb_sugg_context))] + gb_sugg_context
+            else:
+                if len(gb_sugg) >= top_n:
+                    gb_sugg = gb_sugg[:top_n]
+            groupby_sugg.append(gb_sugg)
+            agg_df = pd.DataFrame(agg_list).head()
+            agg_sugg_dict = {}
+            if len(col_mul_idx) > 0:
+                for agg_opt in agg_opts:
+                    agg_l = [agg_c[agg_opt] for agg_c in agg_contexts if agg_opt in agg_c.keys()]
+                    agg_l = np.concatenate(agg_l) if len(agg_l) > 0 else agg_l
+                    if len(agg_l) > 0:
+                        agg_context_sim = np.max(self.cal_cosine_sim(agg_l, col), axis=0)
+                        agg_col = [col[aid] for aid, a_sim in enumerate(agg_context_sim) if
+                                   a_sim > self.item_sim]
+                        if agg_opt != "count":
+                            agg_col = [ac for ac in agg_col if ac not in GV.opt_constraints]
+                        if agg_opt not in agg_sugg_dict.keys():
+                            agg_sugg_dict[agg_opt] = []
+                        agg_sugg_dict[agg_opt] += (agg_col)
+                    agg_num = 0
+                    a_l = []
+                    for agg in agg_df[agg_opt].values:
+                        if len(agg) > 0:
+                            agg_num += 1
+                            a_l += agg
+                    if agg_num > 0:
+                        agg_c_sim = np.mean(self.cal_cosine_sim(a_l, col), axis=0)
+                        for g_sim, c in zip(agg_c_sim, col):
+                            if g_sim > self.agg_th:
+                                if agg_opt not in agg_sugg_dict.keys():
+                                    agg_sugg_dict[agg_opt] = []
+                                if c not in agg_sugg_dict[agg_opt]:
+                                    if len(agg_sugg_dict[agg_opt]) >= 1:
+                                        break
+                                    else:
+                                        if agg_opt == "count":
+                                            agg_sugg_dict[agg_opt].append(c)
+                                        else:
+                                            if c not in GV.opt_constraints:
+                                                agg_sugg_dict[agg_opt].append(c)
+
+                                if len(agg_sugg_dict[agg_opt]) == 0:
+                                    agg_sugg_dict.pop(agg_opt)
+
+            agg_sugg.append(agg_sugg_dict)
+        return groupby_sugg, agg_sugg
+
+    def query_suggestion(self, db_df_bin, context_dict={"select": [], "groupby": [], "agg": []},
+                         min_support=None, top_n=5, max_len=3):
+        support = self.item_sim if min_support is None else min_support
+        sel_contexts = context_dict["select"]
+        agg_contexts = context_dict["agg"]
+        groupby_contexts = context_dict["groupby"]
+        if len(sel_contexts) == 0:
+            freq_combo = self.get_freq_combo(db_df_bin, set([]), support, max_len=max_len)
+            union_set = frozenset().union(*freq_combo["itemsets"].values)
+            next_cols = [list(v) for v in freq_combo["itemsets"].values]
+
+            if len(union_set) < top_n:
+                rest_cols = db_df_bin.columns.difference(list(union_set))
+                sim_sum = [sum(db_df_bin[col]) for col in rest_cols]
+                cols_supp = []
+                for col in db_df_bin[rest_cols[(-np.array(sim_sum)).argsort()]].columns:
+                    if len(cols_supp) < top_n - len(union_set):
+                        if sum([col in c for c in cols_supp]) == 0:
+                            curr_set = [col]
+                            for c in self.g_cols_cache:
+                                if col in c:
+                                    curr_set += list(c.difference([col]))[:max_len - 2]
+                            cols_supp.append(curr_set)
+                next_cols += cols_supp
+            else:
+                next_cols = [list(v) for vidx, v in enumerate(freq_combo["itemsets"].values) if vidx < top_n]
+
+            return {
+                "select": next_cols,
+                "groupby": [[] for nc in next_cols],
+                "agg": [{} for nc in next_cols]
+            }
+
+        columns = db_df_bin.columns
+        context_cols = np.concatenate(sel_contexts)
+        rest_cols = columns.difference(context_cols)
+
+        all_sims = np.zeros(len(rest_cols))
+        opt_flag = False
+        if len(sel_contexts) > 0:
+            if len(sel_contexts[-1]) > 0:
+                if set(self.pre_sel) != set(sel_contexts[-1]):
+                    groupby_sugg, agg_sugg = self.get_opts(db_df_bin, [sel_contexts[-1]], groupby_contexts,
+                                                           agg_contexts, self.opt_n)
+                    self.pre_sel = sel_contexts[-1]
+                    if len(groupby_sugg[0]) > 0 or bool(agg_sugg[0]):
+                        opt_flag = True
+                        if bool(agg_sugg[0]):
+                            sel_pre = [[]]
+                        else:
+                            sel_pre = [sel_contexts[-1]]
+
+        for contextid, context in enumerate(sel_contexts):
+            if len(context) > 0:
+                semantic_sim_scores = np.max(self.cal_cosine_sim(rest_cols, context),
+                                             axis=1) * math.pow(self.alpha,
+                                                                len(sel_contexts) - contextid - 1)
+                db_col_feat = db_df_bin[rest_cols].T
+                context_feat = db_df_bin[context].T
+                db_relevance = np.max(cosine_similarity(db_col_feat, context_feat), axis=1) * math.pow(
+                    self.alpha, len(sel_contexts) - contextid - 1)
+                all_sims += semantic_sim_scores + self.beta * db_relevance
+        rest_cols = rest_cols[(-all_sims).argsort()]
+        top_n_rest_cols = rest_cols[:top_n]
+
+        freq_combo = self.get_freq_combo(db_df_bin[list(context_cols) + list(top_n_rest_cols)],
+                                         filter_set=set(context_cols), support=support, max_len=max_len)
+        freq_cols = [list(v) for v in freq_combo["itemsets"].values if len(v) > 0]
+        for col in rest_cols:
+            if len(freq_cols) < top_n:
+                total_cols = []
+                if len(freq_cols) > 0:
+                    total_cols = np.concatenate(freq_cols)
+                if col not in total_cols:
+                    curr_set = [col]
+                    for c in self.g_cols_cache:
+                        if col in c:
+                            curr_set += list(c.difference([col]))[:max_len - 2]
+                    freq_cols.append(curr_set)
+            else:
+                freq_cols = freq_cols[:top_n]
+                break
+
+        if opt_flag:
+            return {
+                "select": sel_pre + freq_cols,
+                "groupby": groupby_sugg + [[] for fc in freq_cols],
+                "agg": agg_sugg + [{} for fc in freq_cols]
+            }
+        else:
+            return {
+                "select": freq_cols,
+                "groupby": [[] for fc in freq_cols],
+                "agg": [{} for fc in freq_cols]
+            }
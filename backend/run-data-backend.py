@@ -5,7 +5,10 @@
 from app.routes.app import create_app
 from gevent.pywsgi import WSGIServer
 
-app = create_app()
+# model worker processes (`modelWorkers.WorkerPool`) are spawned, and spawned processes import this module:
+# the server must only start when it is run as a script
+if __name__ == "__main__":
+    app = create_app()
 
-http_server = WSGIServer(('0.0.0.0', 5011), app)
-http_server.serve_forever()
+    http_server = WSGIServer(('0.0.0.0', 5011), app)
+    http_server.serve_forever()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture
+def set_gv(monkeypatch):
+    """
+    - set a `globalVariable` setting for the test: once a module has put app/dataService on sys.path
+      (`decode_sql`), the other modules import it as `globalVariable`, next to `app.dataService.globalVariable`
+    """
+    def set_gv(name, value):
+        for module in ["app.dataService.globalVariable", "globalVariable"]:
+            if module in sys.modules:
+                monkeypatch.setattr(sys.modules[module], name, value)
+    return set_gv
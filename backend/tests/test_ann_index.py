@@ -0,0 +1,83 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+from app.dataService.annIndex import IVFFlatIndex
+from app.dataService.similarity import normalize_rows
+
+
+def clustered(rng, centers, n, noise=1.2):
+    return normalize_rows(centers[rng.randint(len(centers), size=n)] + noise * normalize_rows(rng.randn(n, centers.shape[1])))
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.RandomState(0)
+    centers = normalize_rows(rng.randn(40, 32))
+    return clustered(rng, centers, 4000), clustered(rng, centers, 50)
+
+
+def brute_force(x, queries, k):
+    s = queries @ x.T
+    ids = np.argsort(-s, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(s, ids, axis=1), ids
+
+
+def recall(ids, exact_ids):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids, exact_ids)])
+
+
+def test_recall_against_brute_force(data):
+    x, queries = data
+    index = IVFFlatIndex(n_probe=8).build(x)
+    assert index.n_lists == int(np.sqrt(len(x)))
+    _, exact_ids = brute_force(x, queries, 10)
+    recalls = [recall(index.search(queries, k=10, n_probe=n_probe)[1], exact_ids) for n_probe in [1, 8, 32]]
+    assert recalls[0] <= recalls[1] <= recalls[2]
+    assert recalls[0] < 0.9  # overlapping clusters: one list is not enough
+    assert recalls[1] >= 0.95
+    assert recalls[2] >= 0.99
+
+
+def test_probing_every_list_is_exact(data):
+    x, queries = data
+    index = IVFFlatIndex(n_lists=16).build(x, ids=np.arange(len(x)) + 100)
+    sims, ids = index.search(queries, k=5, n_probe=16)
+    exact_sims, exact_ids = brute_force(x, queries, 5)
+    np.testing.assert_array_equal(ids, exact_ids + 100)
+    np.testing.assert_allclose(sims, exact_sims, atol=1e-5)
+
+    for (hit_ids, hit_sims), s in zip(index.range_search(queries, 0.7, n_probe=16), queries @ x.T):
+        assert sorted(hit_ids - 100) == list(np.where(s > 0.7)[0])
+        assert (hit_sims > 0.7).all()
+
+
+def test_allowed_mask_and_padding(data):
+    x, queries = data
+    allowed = np.zeros(len(x), dtype=bool)
+    allowed[[3, 70, 1500]] = True
+    index = IVFFlatIndex(n_lists=8).build(x)
+    sims, ids = index.search(queries[:3], k=5, n_probe=8, allowed=allowed)
+    for row in ids:
+        assert sorted(row[:3]) == [3, 70, 1500] and list(row[3:]) == [-1, -1]
+    assert np.isinf(sims[:, 3:]).all()
+    for hit_ids, _ in index.range_search(queries, -1.0, n_probe=8, allowed=allowed):
+        assert sorted(hit_ids) == [3, 70, 1500]
+
+
+def test_add_and_save_load(data, tmp_path):
+    x, queries = data
+    index = IVFFlatIndex(n_lists=16, n_probe=4).build(x[:3000])
+    index.add(x[3000:], np.arange(3000, len(x)))
+    assert len(index) == len(x)
+    np.testing.assert_array_equal(np.diff(index.list_offsets), np.bincount(index.list_ids, minlength=16))
+    path = str(tmp_path / "index.npz")
+    index.save(path, fingerprint=np.array([1, 2]))
+    loaded, meta = IVFFlatIndex.load(path)
+    assert loaded.n_probe == 4 and list(meta["fingerprint"]) == [1, 2]
+    for a, b in zip(index.search(queries, k=10), loaded.search(queries, k=10)):
+        np.testing.assert_array_equal(a, b)
+    # exact once every list is probed, including the added vectors
+    np.testing.assert_array_equal(loaded.search(queries, k=10, n_probe=16)[1], brute_force(x, queries, 10)[1])
@@ -0,0 +1,114 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.dataService.batchEncoder import BatchEncoder
+
+
+class SlowModel(object):
+    """embedding of a text: its number and length; records every `encode` call"""
+
+    def __init__(self, delay=0.01, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def encode(self, texts, convert_to_numpy=True):
+        self.calls.append(list(texts))
+        self.gate.wait()
+        time.sleep(self.delay)
+        if self.fail_on in texts:
+            raise ValueError("cannot encode {}".format(self.fail_on))
+        return embed(texts)
+
+
+def hold_worker(encoder, model):
+    """submit one request and keep the worker inside `encode`, so that the next requests queue up"""
+    model.gate.clear()
+    future = encoder.submit("first 0")
+    while len(model.calls) == 0:
+        time.sleep(0.001)
+    return future
+
+
+def embed(texts):
+    return np.array([[float(t.split()[-1]), len(t)] for t in texts], dtype=np.float32)
+
+
+def test_results_keep_request_order_under_concurrent_submitters():
+    model = SlowModel()
+    encoder = BatchEncoder(model, max_batch_size=64, max_delay=0.005)
+    errors = []
+
+    def submitter(seed):
+        rng = np.random.RandomState(seed)
+        try:
+            for _ in range(30):
+                # overlapping texts across threads, duplicates within a request
+                texts = ["col {}".format(i) for i in rng.randint(0, 50, size=rng.randint(1, 8))]
+                np.testing.assert_array_equal(encoder.encode(texts), embed(texts))
+                np.testing.assert_array_equal(encoder.encode(texts[0]), embed(texts[:1])[0])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submitter, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    encoder.close()
+    assert errors == []
+    assert encoder.stats["requests"] == 8 * 30 * 2
+    # requests were merged, each batch stays within the limit and encodes a text once
+    assert encoder.stats["batches"] == len(model.calls) < encoder.stats["requests"]
+    assert all(len(call) == len(set(call)) <= 64 for call in model.calls)
+
+
+def test_batch_size_limit_and_large_requests():
+    model = SlowModel()
+    encoder = BatchEncoder(model, max_batch_size=4, max_delay=0.01)
+    blocker = hold_worker(encoder, model)
+    futures = [encoder.submit(["a {}".format(i), "b {}".format(i)]) for i in range(3)]
+    big = encoder.submit(["c {}".format(i) for i in range(6)])
+    model.gate.set()
+    for i, f in enumerate(futures):
+        np.testing.assert_array_equal(f.result(), embed(["a {}".format(i), "b {}".format(i)]))
+    assert big.result().shape == (6, 2) and blocker.result().shape == (2,)
+    # a request is never split: the 6 sentences make up a batch of their own
+    assert [len(call) for call in model.calls] == [1, 4, 2, 6]
+    encoder.close()
+
+
+def test_model_errors_reach_every_request_of_the_batch():
+    model = SlowModel(fail_on="bad 0")
+    encoder = BatchEncoder(model, max_delay=0.01)
+    hold_worker(encoder, model)
+    failed = [encoder.submit(["ok 1", "bad 0"]), encoder.submit("ok 2")]
+    model.gate.set()
+    for f in failed:
+        with pytest.raises(ValueError):
+            f.result()
+    np.testing.assert_array_equal(encoder.encode(["ok 3"]), embed(["ok 3"]))
+    encoder.close()
+
+
+def test_empty_input_and_close():
+    model = SlowModel()
+    encoder = BatchEncoder(model, max_delay=10.0)
+    assert encoder.encode([]).shape == (0, 2)
+    pending = encoder.submit(["late 1"])
+    encoder.close()  # flushes without waiting for max_delay
+    np.testing.assert_array_equal(pending.result(timeout=1), embed(["late 1"]))
+    with pytest.raises(RuntimeError):
+        encoder.submit("closed 0")
+    assert model.calls == [["late 1"]]
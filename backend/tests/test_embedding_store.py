@@ -0,0 +1,95 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+from app.dataService.embeddingStore import EmbeddingStore
+
+
+class CountingModel(object):
+    """deterministic embeddings; records every string sent to `encode`"""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, convert_to_numpy=True):
+        self.encoded.extend(texts)
+        return np.array([[len(t) + i + sum(map(ord, t)) % 7 for i in range(self.dim)] for t in texts],
+                        dtype=np.float32)
+
+
+def expected(texts, dim=8):
+    return CountingModel(dim).encode(texts)
+
+
+def test_lru_eviction_falls_back_to_disk(tmp_path):
+    model = CountingModel()
+    store = EmbeddingStore(model, str(tmp_path), lru_size=2)
+    store.encode(["a", "bb", "ccc"])
+    assert list(store._lru.keys()) == [store.key("bb"), store.key("ccc")]
+    # "a" left the LRU, not the store
+    np.testing.assert_array_equal(store.encode("a"), expected(["a"])[0])
+    assert model.encoded == ["a", "bb", "ccc"]
+    assert store.stats == {"lru_hits": 0, "disk_hits": 1, "encoded": 3}
+    # a hit moves the key to the end: "bb" is evicted next, not "a"
+    store.encode(["a", "dddd"])
+    assert list(store._lru.keys()) == [store.key("a"), store.key("dddd")]
+    assert store.stats["lru_hits"] == 1
+
+
+def test_duplicates_are_encoded_once(tmp_path):
+    model = CountingModel()
+    store = EmbeddingStore(model, str(tmp_path))
+    out = store.encode(["x", "y", "x"])
+    np.testing.assert_array_equal(out, expected(["x", "y", "x"]))
+    assert model.encoded == ["x", "y"]
+    assert len(store) == 2
+
+
+def test_memmap_reload_after_growth(tmp_path):
+    texts = ["text {}".format(i) for i in range(11)]
+    store = EmbeddingStore(CountingModel(), str(tmp_path), init_capacity=2)
+    store.encode(texts[:3])
+    store.encode(texts[3:])
+    assert store._vectors.shape[0] == 16 and len(store) == 11
+    del store
+
+    model = CountingModel()
+    reloaded = EmbeddingStore(model, str(tmp_path), init_capacity=2)
+    np.testing.assert_array_equal(reloaded.encode(texts), expected(texts))
+    assert model.encoded == []
+    assert reloaded.stats == {"lru_hits": 0, "disk_hits": 11, "encoded": 0}
+
+
+def test_torn_index_line_is_skipped(tmp_path):
+    store = EmbeddingStore(CountingModel(), str(tmp_path))
+    store.encode(["a", "b"])
+    with open(str(tmp_path / "index.tsv"), "a") as f:
+        f.write(store.key("c")[:10])  # interrupted append
+    model = CountingModel()
+    reloaded = EmbeddingStore(model, str(tmp_path))
+    assert len(reloaded) == 2
+    np.testing.assert_array_equal(reloaded.encode(["a", "b", "c"]), expected(["a", "b", "c"]))
+    assert model.encoded == ["c"]
+
+
+def test_read_only_keeps_new_embeddings_in_memory(tmp_path):
+    EmbeddingStore(CountingModel(), str(tmp_path)).encode(["a"])
+    model = CountingModel()
+    store = EmbeddingStore(model, str(tmp_path), read_only=True)
+    store.encode(["a", "b"])
+    store.encode(["b"])
+    assert model.encoded == ["b"]
+    assert len(store) == 1
+    assert len(EmbeddingStore(CountingModel(), str(tmp_path))) == 1
+
+
+def test_dim_mismatch(tmp_path):
+    EmbeddingStore(CountingModel(dim=8), str(tmp_path))
+    with pytest.raises(ValueError):
+        EmbeddingStore(CountingModel(dim=4), str(tmp_path))
@@ -0,0 +1,120 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from mlxtend.frequent_patterns import fpmax
+
+from app.dataService.itemsetCache import ItemsetCache
+from app.dataService.itemsetMiner import fpmax_bitset
+
+
+def random_bin(n_rows=60, n_cols=8, density=0.55, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(rng.rand(n_rows, n_cols) < density, columns=["c{}".format(i) for i in range(n_cols)])
+
+
+def as_set(freq_combo):
+    return {(frozenset(i), round(float(s), 10)) for s, i in freq_combo[["support", "itemsets"]].values}
+
+
+def mlxtend_fpmax(df, support):
+    return fpmax(df, min_support=support, use_colnames=True)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("support", [0.2, 0.35, 0.5])
+def test_derived_subset_equals_fresh_fpmax(seed, support):
+    df = random_bin(seed=seed)
+    cache = ItemsetCache()
+    cache.mine(df, support, mlxtend_fpmax, pin=True)
+    for cols in [["c0", "c3", "c5"], ["c1", "c2", "c4", "c6", "c7"], ["c2"]]:
+        derived = cache.mine(df[cols], support, mlxtend_fpmax)
+        assert as_set(derived) == as_set(mlxtend_fpmax(df[cols], support))
+    assert cache.stats == {"hits": 0, "derived": 3, "mined": 1}
+
+
+def test_subset_without_frequent_items_derives_nothing():
+    df = random_bin(density=0.1)
+    df["dense_a"] = df["dense_b"] = True
+    cache = ItemsetCache()
+    cache.mine(df, 0.5, mlxtend_fpmax)
+    derived = cache.mine(df[["c0", "c1"]], 0.5, mlxtend_fpmax)
+    assert len(derived) == 0 and list(derived.columns) == ["support", "itemsets"]
+    assert cache.stats["derived"] == 1
+
+
+def test_other_support_is_mined_not_derived():
+    df = random_bin(seed=1)
+    cache = ItemsetCache()
+    cache.mine(df, 0.5, mlxtend_fpmax)
+    result = cache.mine(df[["c0", "c1", "c2"]], 0.3, mlxtend_fpmax)
+    assert cache.stats["mined"] == 2 and cache.stats["derived"] == 0
+    assert as_set(result) == as_set(mlxtend_fpmax(df[["c0", "c1", "c2"]], 0.3))
+
+
+@pytest.mark.parametrize("max_len", [1, 2, 3])
+def test_derived_subset_with_max_len(max_len):
+    df = random_bin(n_cols=9, density=0.7, seed=2)
+    miner = lambda d, s: fpmax_bitset(d, min_support=s, max_len=max_len)
+    cache = ItemsetCache()
+    cache.mine(df, 0.3, miner, max_len=max_len)
+    cols = ["c0", "c2", "c4", "c5", "c8"]
+    derived = cache.mine(df[cols], 0.3, miner, max_len=max_len)
+    assert cache.stats["derived"] == 1
+    assert as_set(derived) == as_set(fpmax_bitset(df[cols], min_support=0.3, max_len=max_len))
+    # a result pruned at another max_len is not a derivation source
+    cache.mine(df[cols], 0.3, lambda d, s: fpmax_bitset(d, min_support=s), max_len=None)
+    assert cache.stats["mined"] == 2
+
+
+def test_hits_return_copies():
+    df = random_bin()
+    cache = ItemsetCache()
+    first = cache.mine(df, 0.3, mlxtend_fpmax)
+    first["support"] = 0.
+    assert as_set(cache.mine(df, 0.3, mlxtend_fpmax)) == as_set(mlxtend_fpmax(df, 0.3))
+    assert cache.stats["hits"] == 1
+
+
+def test_pinned_entries_survive_eviction():
+    df = random_bin()
+    cache = ItemsetCache(max_entries=2)
+    cache.mine(df, 0.3, mlxtend_fpmax, pin=True)
+    for support in [0.35, 0.4, 0.45]:
+        cache.mine(df[["c0", "c1"]], support, mlxtend_fpmax)
+    assert len(cache) == 2
+    assert [key for key, _ in cache.pinned()] == [(frozenset(df.columns), 0.3, None)]
+
+
+def test_concurrent_mine_and_put():
+    df = random_bin(n_cols=10)
+    cache = ItemsetCache(max_entries=8)
+    cache.mine(df, 0.3, mlxtend_fpmax, pin=True)
+    subsets = [list(df.columns[i:i + 4]) for i in range(7)]
+    expected = {tuple(cols): as_set(mlxtend_fpmax(df[cols], 0.3)) for cols in subsets}
+    errors = []
+
+    def worker(seed):
+        rng = np.random.RandomState(seed)
+        try:
+            for _ in range(30):
+                cols = subsets[rng.randint(len(subsets))]
+                if rng.rand() < 0.2:
+                    cache.put(cols, 0.4, mlxtend_fpmax(df[cols], 0.4))
+                elif as_set(cache.mine(df[cols], 0.3, mlxtend_fpmax)) != expected[tuple(cols)]:
+                    errors.append(cols)
+                cache.nbytes()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(cache) <= 8
@@ -0,0 +1,84 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from mlxtend.frequent_patterns import fpmax, fpgrowth
+
+from app.dataService.itemsetMiner import fpmax_bitset, fpmax_mlxtend
+
+
+def as_set(freq_combo):
+    return {(frozenset(i), round(float(s), 10)) for s, i in freq_combo[["support", "itemsets"]].values}
+
+
+def reference(df, min_support, max_len=None):
+    """mlxtend: fpmax, or with max_len the maximal sets among fpgrowth's itemsets of length <= max_len"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # mlxtend warns on empty frames
+        if max_len is None:
+            return as_set(fpmax(df, min_support=min_support, use_colnames=True))
+        freq = as_set(fpgrowth(df, min_support=min_support, use_colnames=True, max_len=max_len))
+    return {(i, s) for i, s in freq if not any(i < j for j, _ in freq)}
+
+
+def check(df, min_support, max_len=None):
+    out = fpmax_bitset(df, min_support=min_support, max_len=max_len)
+    assert list(out.columns) == ["support", "itemsets"]
+    assert as_set(out) == reference(df, min_support, max_len)
+    return out
+
+
+@pytest.mark.parametrize("df", [pd.DataFrame({"a": pd.Series([], dtype=bool), "b": pd.Series([], dtype=bool)}),
+                                pd.DataFrame(index=range(4))])
+def test_empty_frame(df):
+    assert len(check(df, 0.5)) == 0
+
+
+def test_support_without_itemsets():
+    df = pd.DataFrame({"a": [1, 0, 0, 0], "b": [0, 1, 0, 0], "c": [0, 0, 1, 0]}).astype(bool)
+    assert len(check(df, 0.5)) == 0
+    assert len(check(df, 0.5, max_len=2)) == 0
+
+
+def test_single_column():
+    df = pd.DataFrame({"a": [1, 1, 0, 1]}).astype(bool)
+    assert as_set(check(df, 0.5)) == {(frozenset(["a"]), 0.75)}
+    assert len(check(df, 0.8)) == 0
+
+
+def test_ties():
+    # every column and pair has the same support: the itemsets must not depend on column order
+    df = pd.DataFrame([[1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]], columns=["a", "b", "c"]).astype(bool)
+    assert as_set(check(df, 0.5)) == {(frozenset(p), 0.5) for p in [("a", "b"), ("a", "c"), ("b", "c")]}
+    assert as_set(check(df[["c", "b", "a"]], 0.5)) == as_set(check(df, 0.5))
+
+
+def test_duplicated_columns():
+    df = pd.DataFrame({"a": [1, 1, 0, 1, 0], "c": [0, 1, 1, 1, 1]}).astype(bool)
+    df["b"] = df["a"]
+    df["d"] = df["a"]
+    assert as_set(check(df, 0.4)) == {(frozenset("abcd"), 0.4)}
+    check(df, 0.6)
+
+
+@pytest.mark.parametrize("max_len", [1, 2, 3])
+def test_max_len(max_len):
+    df = pd.DataFrame({"a": [1, 1, 0, 1, 0], "c": [0, 1, 1, 1, 1]}).astype(bool)
+    df["b"] = df["a"]
+    out = check(df, 0.4, max_len=max_len)
+    assert out["itemsets"].apply(len).max() == max_len
+    assert as_set(fpmax_mlxtend(df, 0.4, max_len=max_len)) == as_set(out)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_len", [None, 1, 2, 3])
+def test_random_frames(seed, max_len):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame(rng.rand(50, 7) < rng.uniform(0.3, 0.8), columns=list("abcdefg"))
+    for min_support in [0.1, 0.3, 0.6]:
+        out = check(df, min_support, max_len)
+        assert as_set(fpmax_mlxtend(df, min_support, max_len)) == as_set(out)
@@ -0,0 +1,128 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from app.dataService.modelWorkers import WorkerPool, RemoteModel, WorkerError, WorkerCrashed
+
+
+class Toy(object):
+    def square(self, x):
+        return x * x
+
+    def fail(self):
+        raise ValueError("bad input")
+
+    def crash(self):
+        os._exit(3)
+
+    def nap(self, seconds):
+        time.sleep(seconds)
+
+
+# module level: spawned workers import the factories
+def build_toy():
+    return Toy()
+
+
+def build_broken():
+    raise RuntimeError("no model")
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(build_toy, n_workers=2, torch_threads=None, name="toy", timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_calls_and_errors(pool):
+    model = RemoteModel(pool)
+    assert [model.square(i) for i in range(5)] == [0, 1, 4, 9, 16]
+    with pytest.raises(WorkerError, match="bad input"):
+        model.fail()
+    assert model.square(3) == 9
+
+
+def test_crash_fails_only_the_running_call(pool):
+    futures = [pool.submit("square", i) for i in range(20)]
+    crash = pool.submit("crash")
+    futures += [pool.submit("square", i) for i in range(20, 40)]
+    done, not_done = wait(futures + [crash], timeout=60)
+    assert len(not_done) == 0
+    assert isinstance(crash.exception(), WorkerCrashed)
+    assert [f.result() for f in futures] == [i * i for i in range(40)]
+    assert pool.call("square", 7) == 49
+    assert pool.status()["crashes"] == 1
+
+
+def test_timed_out_calls_are_dropped():
+    pool = WorkerPool(build_toy, n_workers=1, torch_threads=None, name="toy", timeout=1)
+    try:
+        assert pool.call("square", 2) == 4
+        # queued behind a running call: unqueued, never runs
+        running = pool.submit("nap", 3)
+        with pytest.raises(TimeoutError):
+            pool.call("square", 3)
+        assert pool.status()["pending"] == 1
+        running.result(timeout=10)
+        assert pool.status()["pending"] == 0
+        # running in a hung worker: the worker is terminated and restarted
+        with pytest.raises(TimeoutError):
+            pool.call("nap", 30)
+        assert pool.status()["pending"] == 0
+        while pool.status()["restarts"] == 0 or pool.status()["workers"] != {0: "ready"}:
+            time.sleep(0.1)
+        assert pool.call("square", 5) == 25
+        status = pool.status()
+        assert status["pending"] == 0 and status["timeouts"] == 2 and status["crashes"] == 1
+    finally:
+        pool.close()
+
+
+def test_failed_load_fails_the_calls():
+    pool = WorkerPool(build_broken, n_workers=1, torch_threads=None, name="broken", timeout=60)
+    try:
+        with pytest.raises(WorkerCrashed, match="no worker could load the model"):
+            pool.call("square", 2)
+        assert pool.status()["workers"] == {0: "failed"}
+    finally:
+        pool.close()
+
+
+def build_dying():
+    os._exit(1)
+
+
+def build_slow():
+    import time
+    time.sleep(30)
+    return Toy()
+
+
+@pytest.mark.parametrize("factory, startup_timeout", [(build_dying, 60), (build_slow, 1)])
+def test_workers_that_never_get_ready_fail(factory, startup_timeout):
+    pool = WorkerPool(factory, n_workers=2, torch_threads=None, name="dying", timeout=60,
+                      startup_timeout=startup_timeout)
+    try:
+        with pytest.raises(WorkerCrashed, match="no worker could load the model"):
+            pool.call("square", 2)
+        status = pool.status()
+        assert status["workers"] == {0: "failed", 1: "failed"} and status["restarts"] == 0
+    finally:
+        pool.close()
+
+
+def test_calls_from_greenlets_run_concurrently(pool):
+    gevent = pytest.importorskip("gevent")
+    pool.call("square", 1)
+    while list(pool.status()["workers"].values()) != ["ready", "ready"]:
+        time.sleep(0.1)
+    start = time.time()
+    # greenlets of one thread, as in the gevent server: a blocking wait would serve one call at a time (0.8 s)
+    gevent.joinall([gevent.spawn(pool.call, "nap", 0.2) for _ in range(4)])
+    assert time.time() - start < 0.7
@@ -0,0 +1,100 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import itertools
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("mlxtend")
+
+import app.dataService.globalVariable as GV
+from app.dataService.schemaRegistry import SchemaRegistry
+from app.dataService.queryRec import queryRecommender
+from benchmark.query_rec_baseline import BaselineQueryRecommender, WordModel
+
+SPIDER = os.path.join(os.path.dirname(__file__), "fixtures", "spider")
+TOPICS = ["cinema", "cinema_2", "store_1"]
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return SchemaRegistry(tables_path=os.path.join(SPIDER, "tables.json"), use_snapshot=False)
+
+
+@pytest.fixture(params=["bitset", "fpmax"])
+def recommenders(request, registry, tmp_path, set_gv):
+    """(baseline factory, current recommender), sharing one `WordModel`; caches go to `tmp_path`"""
+    set_gv("EMBEDDING_CACHE_FOLDER", str(tmp_path / "embeddings"))
+    set_gv("ANN_INDEX_FOLDER", str(tmp_path / "ann"))
+    set_gv("REF_CORPUS_FOLDER", str(tmp_path / "ref_corpus"))
+    model = WordModel()
+    ref_path = os.path.join(SPIDER, "train_spider.json")
+    current = queryRecommender(ref_db_meta_path=ref_path, schema_registry=registry, use_artifacts=False,
+                               itemset_engine=request.param, sentence_model=model)
+    # the baseline keeps the rows of the last searched database (`ref_db`) and `pre_sel` across databases
+    return lambda: BaselineQueryRecommender(model, registry, ref_path), current
+
+
+def normalized(sugg):
+    """itemsets are sets: the order of the columns within one suggestion is arbitrary"""
+    return {
+        "select": [sorted(cols) for cols in sugg["select"]],
+        "groupby": [list(gb) for gb in sugg["groupby"]],
+        "agg": [{opt: list(cols) for opt, cols in agg.items()} for agg in sugg["agg"]],
+    }
+
+
+@pytest.mark.parametrize("db_id", TOPICS)
+def test_db_df_bin_matches_baseline(registry, recommenders, db_id):
+    baseline, current = recommenders
+    topic, cols = db_id.replace("_", " ").strip(), registry.db_cols[db_id]
+    expected = baseline().search_sim_dbs(topic, cols)
+    got = current.get_db_state(topic, cols).db_df_bin
+    assert list(got.columns) == list(expected.columns)
+    assert (got.values == expected.values).all()
+    assert expected.values.any()
+
+
+@pytest.mark.parametrize("db_id", TOPICS)
+def test_get_opts_matches_baseline(registry, recommenders, db_id):
+    baseline, current = recommenders
+    topic, cols = db_id.replace("_", " ").strip(), registry.db_cols[db_id]
+    base = baseline()
+    df = base.search_sim_dbs(topic, cols)
+    state = current.get_db_state(topic, cols)
+    selections = [[c] for c in df.columns] + [list(p) for p in itertools.combinations(df.columns[:5], 2)]
+    contexts = [
+        ([], []),
+        ([[cols[0]]], [{"avg": [cols[-1]]}]),
+        ([[cols[1], cols[2]], []], [{"count": [cols[0]], "max": [cols[1]]}, {"sum": [cols[2]]}]),
+    ]
+    n_suggested = 0
+    for groupby_contexts, agg_contexts in contexts:
+        for top_n in [1, 3]:
+            expected = base.get_opts(df, selections, groupby_contexts, agg_contexts, top_n)
+            got = current.get_opts(state.db_df_bin, selections, groupby_contexts, agg_contexts, top_n, state=state)
+            assert got == expected, (groupby_contexts, agg_contexts, top_n)
+            n_suggested += sum(len(gb) > 0 for gb in expected[0]) + sum(len(agg) > 0 for agg in expected[1])
+    assert n_suggested > 0
+
+
+@pytest.mark.parametrize("min_support", [0.6, 0.1])
+@pytest.mark.parametrize("db_id", TOPICS)
+def test_query_suggestion_session_matches_baseline(registry, recommenders, db_id, min_support):
+    baseline, current = recommenders
+    topic, cols = db_id.replace("_", " ").strip(), registry.db_cols[db_id]
+    base = baseline()
+    df = base.search_sim_dbs(topic, cols)
+    state = current.get_db_state(topic, cols)
+    # as the frontend does: the first suggestion of every step is appended to the context
+    expected_context = {"select": [], "groupby": [], "agg": []}
+    context = {"select": [], "groupby": [], "agg": []}
+    for step in range(5):
+        expected = base.query_suggestion(df, expected_context, min_support)
+        got = current.query_suggestion(state.db_df_bin, context, min_support, state=state)
+        assert normalized(got) == normalized(expected), step
+        for ctx, sugg in [(expected_context, expected), (context, got)]:
+            for key in ctx:
+                ctx[key].append(sugg[key][0])
@@ -0,0 +1,48 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import threading
+
+import pytest
+
+from app.dataService.modelRegistry import ModelRegistry
+
+
+def test_registry_remembers_evicted_models():
+    registry = ModelRegistry(rss_budget=None)
+    registry.register("model", lambda: object())
+    assert not registry.is_loaded("model") and not registry.was_loaded("model")
+    registry.get("model")
+    assert registry.is_loaded("model") and registry.was_loaded("model")
+    assert registry.unload("model")
+    assert not registry.is_loaded("model") and registry.was_loaded("model")
+
+
+def test_lazy_components_are_not_ready():
+    pytest.importorskip("allennlp")  # dataService imports the SmBop parser
+    from app.dataService.dataService import DataService
+
+    service = DataService.__new__(DataService)
+    service.models = ModelRegistry(rss_budget=None)
+    for name in DataService.COMPONENTS:
+        service.models.register(name, lambda: object())
+    service.warmup_status = {}
+    service._warmup_lock = threading.Lock()
+
+    readiness = service.readiness()
+    assert not readiness["ready"]
+    assert {c["status"] for c in readiness["components"].values()} == {"lazy"}
+    # loaded on first use, or warmed up
+    service.models.get("sql_parser")
+    service.models.get("sqlsugg")
+    service.models.get("text2sql")
+    service._set_warmup_status("sql2text", "warming")
+    assert not service.readiness()["ready"]
+    service._set_warmup_status("sql2text", "ready", seconds=1.0)
+    assert service.readiness()["ready"]
+    # an evicted model was loaded once: it is reloaded on its next use
+    service.models.unload("text2sql")
+    readiness = service.readiness()
+    assert readiness["components"]["text2sql"]["status"] == "unloaded" and readiness["ready"]
+    service._set_warmup_status("sql2text", "failed", error="OSError()")
+    assert not service.readiness()["ready"]
@@ -0,0 +1,91 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("mlxtend")
+
+import app.dataService.globalVariable as GV
+from app.dataService.schemaRegistry import SchemaRegistry
+from app.dataService.queryRec import queryRecommender
+from app.dataService.recArtifacts import ArtifactBundle, build_bundle, bundle_params, db_topic
+from benchmark.query_rec_baseline import WordModel
+
+SPIDER = os.path.join(os.path.dirname(__file__), "fixtures", "spider")
+
+
+@pytest.fixture
+def spider(tmp_path, set_gv):
+    """the fixture's spider files (in `tmp_path`, so that they can be touched) and cache folders in `tmp_path`"""
+    for name in ["tables.json", "train_spider.json"]:
+        shutil.copy(os.path.join(SPIDER, name), str(tmp_path / name))
+    set_gv("EMBEDDING_CACHE_FOLDER", str(tmp_path / "embeddings"))
+    set_gv("ANN_INDEX_FOLDER", str(tmp_path / "ann"))
+    set_gv("REF_CORPUS_FOLDER", str(tmp_path / "ref_corpus"))
+    set_gv("REC_ARTIFACT_FOLDER", str(tmp_path / "artifacts"))
+    return tmp_path
+
+
+def rec_kwargs(spider, **kwargs):
+    registry = SchemaRegistry(tables_path=str(spider / "tables.json"), use_snapshot=False)
+    return dict(ref_db_meta_path=str(spider / "train_spider.json"), schema_registry=registry,
+                sentence_model=WordModel(), **kwargs)
+
+
+def test_bundle_states_match_built_states(spider):
+    params = build_bundle(GV.REC_ARTIFACT_FOLDER, workers=1, **rec_kwargs(spider))
+    bundle = ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, params)
+    assert sorted(bundle.dbs) == ["cinema", "cinema_2", "store_1"]
+    qr = queryRecommender(use_artifacts=False, **rec_kwargs(spider))
+    for db_id in bundle.dbs:
+        built = qr.get_db_state(db_topic(db_id), qr.schema_registry.get_db_cols(db_id))
+        loaded = bundle.state(built.key)
+        assert (loaded.db_df_bin.values == built.db_df_bin.values).all()
+        assert list(loaded.db_df_bin.columns) == list(built.db_df_bin.columns)
+        np.testing.assert_array_equal(loaded.ref_rowids, built.ref_rowids)
+        np.testing.assert_array_equal(loaded.col_bits, built.col_bits)
+        assert loaded.col_groups == built.col_groups
+    assert bundle.state(("cinema", "other columns")) is None
+
+
+def test_recommender_uses_the_bundle(spider):
+    build_bundle(GV.REC_ARTIFACT_FOLDER, workers=1, **rec_kwargs(spider))
+    with_bundle = queryRecommender(**rec_kwargs(spider, use_artifacts=True))
+    without = queryRecommender(**rec_kwargs(spider, use_artifacts=False))
+    assert with_bundle.artifacts is not None and len(with_bundle.artifacts) == 3
+    cols = with_bundle.schema_registry.get_db_cols("cinema")
+    state = with_bundle.get_db_state("cinema", cols)
+    mined = state.itemsets.stats["mined"]
+    context = {"select": [], "groupby": [], "agg": []}
+    sugg = with_bundle.query_suggestion(state.db_df_bin, context, 0.6, state=state)
+    assert state.itemsets.stats["mined"] == mined  # the empty-context itemsets come from the bundle
+    expected_state = without.get_db_state("cinema", cols)
+    assert sugg == without.query_suggestion(expected_state.db_df_bin, context, 0.6, state=expected_state)
+
+
+def test_stale_or_incomplete_bundle_is_ignored(spider, capsys):
+    kwargs = rec_kwargs(spider)
+    params = build_bundle(GV.REC_ARTIFACT_FOLDER, workers=1, **kwargs)
+    assert ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, params) is not None
+    qr = queryRecommender(use_artifacts=False, **kwargs)
+    # other thresholds
+    qr.item_sim = 0.5
+    assert ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, bundle_params(qr)) is None
+    assert "outdated" in capsys.readouterr().out
+    qr.item_sim = 0.4
+    assert ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, bundle_params(qr)) is not None
+    # the reference corpus changed after the build
+    corpus = str(spider / "train_spider.json")
+    stat = os.stat(corpus)
+    os.utime(corpus, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, bundle_params(qr)) is None
+    assert queryRecommender(use_artifacts=True, **kwargs).artifacts is None
+    # a bundle without manifest is incomplete
+    params = build_bundle(GV.REC_ARTIFACT_FOLDER, workers=1, **kwargs)
+    os.remove(os.path.join(GV.REC_ARTIFACT_FOLDER, "manifest.json"))
+    assert ArtifactBundle.load(GV.REC_ARTIFACT_FOLDER, params) is None
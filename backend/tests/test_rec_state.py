@@ -0,0 +1,95 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.dataService.recState import DBState, StateCache, cols_key
+
+
+def test_context_scores_lru_under_concurrency():
+    state = DBState("topic", ["a", "b"])
+    keys = ["k{}".format(i) for i in range(20)]
+    errors = []
+
+    def worker(seed):
+        rng = np.random.RandomState(seed)
+        try:
+            for _ in range(2000):
+                i = rng.randint(1, len(keys) + 1)
+                n, scores = state.cached_scores(keys[:i])
+                assert scores is None or scores[0] == n - 1
+                state.remember_scores(keys[i - 1], np.full(2, i - 1.), max_entries=4)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(state.context_scores) <= 4
+
+
+def test_cached_scores_longest_prefix():
+    state = DBState("topic", ["a", "b"])
+    assert state.cached_scores(["x", "y"]) == (0, None)
+    state.remember_scores("x", np.ones(2))
+    state.remember_scores("z", np.zeros(2))
+    n, scores = state.cached_scores(["x", "y", "z"])
+    assert n == 3 and scores.sum() == 0
+
+
+def make_state(topic, n_rows=100):
+    state = DBState(topic, ["a", "b"])
+    state.db_df_bin = pd.DataFrame(np.ones((n_rows, 2), dtype=np.int64), columns=state.search_cols)
+    return state
+
+
+def test_state_key_depends_on_column_order():
+    assert DBState("t", ["a", "b"]).key == ("t", cols_key(["a", "b"]))
+    assert cols_key(["a", "b"]) != cols_key(["b", "a"])
+
+
+def test_state_cache_evicts_least_recently_used():
+    size = make_state("x").nbytes()
+    cache = StateCache(budget=2 * size)
+    for topic in ["x", "y"]:
+        cache.put(make_state(topic))
+    cache.get(make_state("x").key)  # "y" is now the least recently used
+    cache.put(make_state("z"))
+    assert make_state("y").key not in cache
+    assert make_state("x").key in cache and make_state("z").key in cache
+    assert cache.stats["evictions"] == 1 and cache.nbytes() <= cache.budget
+
+
+def test_state_cache_keeps_the_newest_state_over_budget():
+    cache = StateCache(budget=1)
+    cache.put(make_state("x"))
+    cache.put(make_state("y"))
+    assert len(cache) == 1 and make_state("y").key in cache
+
+
+def test_get_or_build_builds_each_key_once():
+    cache = StateCache(budget=1 << 30)
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.05)
+        return make_state("x")
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_build(make_state("x").key, build)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1
+    assert all(r is results[0] for r in results)
+    assert cache.stats["hits"] + cache.stats["misses"] == 8
@@ -0,0 +1,95 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+from app.dataService.schemaRegistry import SchemaRegistry
+from app.dataService.refCorpus import RefCorpus, decode_entities
+
+SPIDER = os.path.join(os.path.dirname(__file__), "fixtures", "spider")
+
+
+@pytest.fixture(scope="module")
+def tables():
+    return SchemaRegistry(tables_path=os.path.join(SPIDER, "tables.json"), use_snapshot=False).tables
+
+
+@pytest.fixture(scope="module")
+def records():
+    with open(os.path.join(SPIDER, "train_spider.json")) as f:
+        return json.load(f)
+
+
+def test_entities_match_decoded_records(tables, records):
+    corpus = RefCorpus.from_records(records, tables)
+    fields = decode_entities(records, tables)
+    assert len(corpus) == len(records)
+    frame = corpus.frame()
+    assert list(frame["db_id"]) == [r["db_id"] for r in records]
+    for field in RefCorpus.FIELDS:
+        assert list(frame[field]) == fields[field]
+    query = "SELECT directed_by , max(price) , min(price) FROM film GROUP BY directed_by"
+    row = [r["query"] for r in records].index(query)
+    assert corpus.select.of(row) == [" directed by", " price", " price"]
+    assert corpus.agg("max").of(row) == corpus.agg("min").of(row) == ["film: price"]
+    assert corpus.groupby.of(row) == ["film: directed by"]
+    # the agg fields share one vocabulary
+    assert corpus.agg("max").vocab is corpus.agg("avg").vocab
+
+
+def test_rows_of(tables, records):
+    corpus = RefCorpus.from_records(records, tables)
+    cinema = [i for i, r in enumerate(records) if r["db_id"] == "cinema"]
+    both = [i for i, r in enumerate(records) if r["db_id"] in ("cinema", "store_1")]
+    assert list(corpus.rows_of(["cinema"])) == cinema
+    assert list(corpus.rows_of(["store_1", "cinema", "no_such_db"])) == both
+    assert list(corpus.rows_of(["cinema"], start=10)) == [i for i in cinema if i >= 10]
+    assert len(corpus.rows_of([])) == 0
+
+
+def test_appended_matches_a_corpus_built_at_once(tables, records):
+    head = RefCorpus.from_records(records[:30], tables)
+    corpus = head.appended(records[30:], tables)
+    whole = RefCorpus.from_records(records, tables)
+    assert len(head) == 30 and len(corpus) == len(records)
+    assert corpus.frame().equals(whole.frame())
+    # the vocabulary grows at the end, so the ids of the first corpus stay valid
+    assert corpus.select.vocab[:len(head.select.vocab)] == head.select.vocab
+    np.testing.assert_array_equal(corpus.select.ids[:len(head.select.ids)], head.select.ids)
+
+
+def test_snapshot_follows_the_source_files(tables, tmp_path, monkeypatch):
+    path, tables_path = str(tmp_path / "refs.json"), str(tmp_path / "tables.json")
+    shutil.copy(os.path.join(SPIDER, "train_spider.json"), path)
+    shutil.copy(os.path.join(SPIDER, "tables.json"), tables_path)
+    snapshots = str(tmp_path / "snapshots")
+    from_records = RefCorpus.from_records
+    builds = []
+
+    def counted(cls, records, tables):
+        builds.append(len(records))
+        return from_records(records, tables)
+    monkeypatch.setattr(RefCorpus, "from_records", classmethod(counted))
+
+    built = RefCorpus.load(path, tables, tables_path, snapshots)
+    assert os.path.isfile(os.path.join(snapshots, "refs.pkl"))
+    assert RefCorpus.load(path, tables, tables_path, snapshots).frame().equals(built.frame())
+    assert builds == [58]
+    # a modified corpus is read again
+    with open(path) as f:
+        records = json.load(f)
+    with open(path, "w") as f:
+        json.dump(records[:5], f)
+    assert len(RefCorpus.load(path, tables, tables_path, snapshots)) == 5
+    assert builds == [58, 5]
+    # so is a corpus whose schema file changed
+    stat = os.stat(tables_path)
+    os.utime(tables_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    RefCorpus.load(path, tables, tables_path, snapshots)
+    RefCorpus.load(path, tables, tables_path, snapshots)
+    assert builds == [58, 5, 5]
@@ -0,0 +1,74 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import json
+import shutil
+
+import pytest
+
+from app.dataService.schemaRegistry import SchemaRegistry
+
+TABLES = os.path.join(os.path.dirname(__file__), "fixtures", "spider", "tables.json")
+
+
+@pytest.fixture
+def tables_path(tmp_path):
+    path = str(tmp_path / "tables.json")
+    shutil.copy(TABLES, path)
+    return path
+
+
+def registry(tables_path, tmp_path):
+    return SchemaRegistry(tables_path=tables_path, snapshot_path=str(tmp_path / "cache" / "schema.pkl"))
+
+
+def forbid_build(monkeypatch):
+    def build(self):
+        raise AssertionError("rebuilt although the snapshot is up to date")
+    monkeypatch.setattr(SchemaRegistry, "_build", build)
+
+
+def test_snapshot_is_reused(tables_path, tmp_path, monkeypatch):
+    built = registry(tables_path, tmp_path)
+    assert os.path.isfile(str(tmp_path / "cache" / "schema.pkl"))
+    forbid_build(monkeypatch)
+    loaded = registry(tables_path, tmp_path)
+    assert loaded.db_names == built.db_names == ["cinema", "cinema_2", "store_1"]
+    assert loaded.db_cols == built.db_cols
+    assert loaded.get_schema("cinema").idMap == built.get_schema("cinema").idMap
+
+
+def test_snapshot_is_rebuilt_when_tables_change(tables_path, tmp_path):
+    registry(tables_path, tmp_path)
+    with open(tables_path) as f:
+        tables = json.load(f)
+    with open(tables_path, "w") as f:
+        json.dump(tables[:2], f)
+    assert registry(tables_path, tmp_path).db_names == ["cinema", "cinema_2"]
+    # same size, newer modification time
+    with open(tables_path, "w") as f:
+        json.dump(tables[1::-1], f)
+    stat = os.stat(tables_path)
+    os.utime(tables_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert registry(tables_path, tmp_path).db_names == ["cinema_2", "cinema"]
+
+
+def test_unreadable_snapshot_is_rebuilt(tables_path, tmp_path):
+    registry(tables_path, tmp_path)
+    with open(str(tmp_path / "cache" / "schema.pkl"), "wb") as f:
+        f.write(b"not a pickle")
+    assert registry(tables_path, tmp_path).db_names == ["cinema", "cinema_2", "store_1"]
+    # and written again
+    with open(str(tmp_path / "cache" / "schema.pkl"), "rb") as f:
+        assert f.read(12) != b"not a pickle"
+
+
+def test_db_cols_without_keys(tables_path, tmp_path):
+    reg = registry(tables_path, tmp_path)
+    # primary keys and the foreign keys of the schedule table are dropped
+    assert reg.get_db_cols("cinema") == [
+        "film: title", "film: directed by", "film: price", "film: rank", "film: year",
+        "cinema: name", "cinema: capacity", "cinema: location", "cinema: openning year",
+        "schedule: date", "schedule: show times per day", "schedule: price"]
+    assert reg.column_index["cinema"]["schedule: film id"] == 14
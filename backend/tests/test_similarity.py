@@ -0,0 +1,124 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+from app.dataService.similarity import normalize_rows, cos_sim, cos_sim_max, community_detection, segment_max, \
+    gather_segments, EmbeddingMatrix
+
+
+def clustered(rng, n_centers=6, per_center=5, n_bridges=6, dim=16, noise=0.15):
+    """points around random centers, plus bridge points halfway between two centers (overlapping communities)"""
+    centers = normalize_rows(rng.randn(n_centers, dim))
+    points = [centers[i] + noise * rng.randn(dim) for i in range(n_centers) for _ in range(per_center)]
+    for _ in range(n_bridges):
+        a, b = rng.choice(n_centers, 2, replace=False)
+        points.append(centers[a] + centers[b] + noise * rng.randn(dim))
+    points += list(rng.randn(8, dim))  # outliers
+    return normalize_rows(np.array(points)[rng.permutation(len(points))])
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("threshold, min_size", [(0.8, 2), (0.7, 3), (0.6, 4), (0.9, 1)])
+def test_community_detection_matches_sentence_transformers(seed, threshold, min_size):
+    util = pytest.importorskip("sentence_transformers.util")
+    emb = clustered(np.random.RandomState(seed))
+    expected = util.community_detection(emb, threshold=threshold, min_community_size=min_size)
+    # a few rows per block
+    assert community_detection(emb, threshold, min_size, max_bytes=len(emb) * 5 * 7) == expected
+
+
+def test_overlapping_members_are_removed_not_the_whole_community():
+    angles = np.radians([0, 18, 40, 61, 80])
+    emb = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    # neighbors within 25 degrees: rows 1, 2, 3 seed communities of 3, rows 0 and 4 of 2
+    threshold = np.cos(np.radians(25))
+    # row 3 seeds [3, 4, 2]: 2 is taken by [1, 0, 2], the rest is kept
+    assert community_detection(emb, threshold, 2, max_bytes=1 << 20) == [[1, 0, 2], [3, 4]]
+    assert community_detection(emb, threshold, 3, max_bytes=1 << 20) == [[1, 0, 2]]
+
+
+def test_community_detection_edge_cases():
+    assert community_detection(np.zeros((0, 4)), 0.8, 2, max_bytes=1 << 20) == []
+    # fewer rows than min_community_size: all of them, if close enough
+    emb = normalize_rows(np.array([[1.0, 0.0], [0.99, 0.1]]))
+    assert community_detection(emb, 0.9, 5, max_bytes=1 << 20) == [[0, 1]]
+
+
+def test_segment_max_with_empty_segments():
+    sim = np.arange(12, dtype=np.float32).reshape(2, 6) % 5
+    # segments: [], [0, 2), [], [2, 3), [3, 6), []
+    offsets = [0, 0, 2, 2, 3, 6, 6]
+    expected = np.array([[-1, 1, -1, 2, 4, -1], [-1, 2, -1, 3, 4, -1]], dtype=np.float32)
+    np.testing.assert_array_equal(segment_max(sim, offsets, fill=-1.0), expected)
+    assert segment_max(sim, offsets).dtype == np.float32
+    assert (segment_max(sim, offsets)[:, [0, 2, 5]] == 0).all()
+    np.testing.assert_array_equal(segment_max(np.zeros((3, 0)), [0, 0, 0], fill=-2.0), np.full((3, 2), -2.0))
+    assert segment_max(sim, [0]).shape == (2, 0)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_gather_segments_matches_per_segment_loop(seed):
+    rng = np.random.RandomState(seed)
+    counts = rng.randint(0, 4, size=30)  # some segments are empty
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    sim = rng.randn(5, offsets[-1]).astype(np.float32)
+    ids = rng.choice(len(counts), 12)  # repeats and any order
+    slots, new_offsets = gather_segments(offsets, ids)
+    assert list(np.diff(new_offsets)) == list(counts[ids])
+    got = segment_max(sim[:, slots], new_offsets, fill=-np.inf)
+    for j, i in enumerate(ids):
+        segment = sim[:, offsets[i]:offsets[i + 1]]
+        expected = segment.max(axis=1) if segment.shape[1] > 0 else np.full(5, -np.inf)
+        np.testing.assert_array_equal(got[:, j], expected)
+    assert gather_segments(offsets, [])[0].shape == (0,)
+
+
+def test_cos_sim_normalizes_and_keeps_zero_rows():
+    a = np.array([[3.0, 4.0], [0.0, 0.0]])
+    np.testing.assert_allclose(cos_sim(a, [1.0, 0.0]), [[0.6], [0.0]], rtol=1e-6)
+    np.testing.assert_allclose(normalize_rows(a), [[0.6, 0.8], [0.0, 0.0]], rtol=1e-6)
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 1e-6), ("float16", 2e-3), ("int8", 2e-2)])
+def test_reduced_precision_sim_matches_float32(dtype, atol):
+    rng = np.random.RandomState(0)
+    refs = rng.randn(500, 384)
+    queries = rng.randn(20, 384)
+    ids = rng.choice(500, 300, replace=False)
+    matrix = EmbeddingMatrix(refs, dtype, block_size=64)
+    assert matrix.shape == (500, 384)
+    assert matrix.nbytes <= {"float32": 4, "float16": 2, "int8": 1}[dtype] * 500 * 384 + 4 * 500
+    sim = matrix.sim(queries, ids)
+    np.testing.assert_allclose(sim, cos_sim(queries, refs[ids]), atol=atol)
+    # as `cal_cosine_max`, on the dequantized rows
+    np.testing.assert_allclose(sim.max(axis=1), cos_sim_max(queries, refs[ids], max_bytes=4096), atol=atol)
+    np.testing.assert_allclose(cos_sim_max(queries, matrix.rows(ids), max_bytes=4096), sim.max(axis=1), atol=atol)
+    np.testing.assert_allclose(matrix.rows(), normalize_rows(refs), atol=atol)
+
+
+@pytest.mark.parametrize("dtype", EmbeddingMatrix.DTYPES)
+def test_embedding_matrix_extended_and_zero_rows(dtype):
+    rng = np.random.RandomState(1)
+    x = rng.randn(10, 16)
+    x[3] = 0
+    matrix = EmbeddingMatrix(x[:6], dtype, block_size=4).extended(x[6:])
+    whole = EmbeddingMatrix(x, dtype)
+    np.testing.assert_array_equal(matrix.data, whole.data)
+    np.testing.assert_array_equal(matrix.sim(x[:2]), whole.sim(x[:2]))
+    assert (matrix.sim(x[:2])[:, 3] == 0).all()
+    assert len(EmbeddingMatrix(np.zeros((0, 16)), dtype).sim(x[:2])[0]) == 0
+
+
+def test_embedding_matrix_rejects_unknown_dtype():
+    with pytest.raises(ValueError):
+        EmbeddingMatrix(np.ones((2, 2)), "int4")
+
+
+def test_cos_sim_max_blocks_match_full_matrix():
+    rng = np.random.RandomState(2)
+    a, b = rng.randn(37, 8), rng.randn(11, 8)
+    expected = cos_sim(a, b).max(axis=1)
+    for max_bytes in [1, 44, 440, 1 << 20]:
+        np.testing.assert_allclose(cos_sim_max(a, b, max_bytes), expected, rtol=1e-6)
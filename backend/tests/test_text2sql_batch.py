@@ -0,0 +1,82 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import pytest
+
+pytest.importorskip("allennlp")  # the SmBop parser and `DataService` need the allennlp stack
+
+
+class Reader(object):
+    def text_to_instance(self, utterance, db_id):
+        return {"utterance": utterance, "db_id": db_id}
+
+    def apply_token_indexers(self, instance):
+        instance["indexed"] = True
+
+
+class Model(object):
+    """echoes the utterance; records the batches"""
+
+    def __init__(self):
+        self.batches = []
+
+    def forward_on_instances(self, instances):
+        assert all(instance["indexed"] for instance in instances)
+        self.batches.append([(instance["db_id"], instance["utterance"]) for instance in instances])
+        return [{"sql_list": "SQL " + instance["utterance"]} for instance in instances]
+
+
+class Predictor(object):
+    def __init__(self):
+        self._dataset_reader = Reader()
+        self._model = Model()
+
+
+def test_smbop_predict_batch_keeps_input_order():
+    from app.dataService.sqlParser import SmBop
+    smbop = SmBop.__new__(SmBop)
+    smbop.predictor = Predictor()
+    pairs = [("a much longer question", "zoo"), ("short", "concert"), ("mid question", "zoo"),
+             ("q", "zoo"), ("another question", "concert")]
+    assert smbop.predict_batch(pairs, batch_size=2) == ["SQL " + q for q, _ in pairs]
+    # grouped by database, then by length
+    assert smbop.predictor._model.batches == [
+        [("concert", "short"), ("concert", "another question")],
+        [("zoo", "q"), ("zoo", "mid question")],
+        [("zoo", "a much longer question")],
+    ]
+    assert smbop.predict("q", "zoo") == "SQL q"
+    assert smbop.predict_batch([]) == []
+
+
+def test_dataservice_batches_only_uncached_questions(tmp_path, set_gv):
+    from app.dataService.dataService import DataService
+    from app.dataService.modelRegistry import ModelRegistry
+    from app.dataService.text2sqlCache import Text2SQLCache
+
+    class SmBop(object):
+        def __init__(self):
+            self.batches = []
+
+        def predict_batch(self, pairs):
+            self.batches.append(pairs)
+            return ["SQL " + q for q, _ in pairs]
+
+    smbop = SmBop()
+    set_gv("TEXT2SQL_RETRIEVAL", False)
+    set_gv("TEXT2SQL_SEMANTIC_CACHE", False)
+    service = DataService.__new__(DataService)
+    service.models = ModelRegistry()
+    service.models.register("text2sql", lambda: smbop)
+    service.text2sql_cache = Text2SQLCache(path=str(tmp_path / "cache.sqlite"), version="test")
+    service.semantic_cache = None
+    service.text2sql_retrieval = None
+    service.text2sql_cache.put("zoo", "cached", "SELECT 1")
+
+    qs = ["new", "cached", "other", "new"]
+    assert service.text2sql_batch(qs, "zoo") == ["SQL new", "SELECT 1", "SQL other", "SQL new"]
+    assert smbop.batches == [[("new", "zoo"), ("other", "zoo")]]
+    # all cached now: the model is not called again
+    assert service.text2sql_batch(qs, "zoo") == ["SQL new", "SELECT 1", "SQL other", "SQL new"]
+    assert len(smbop.batches) == 1
+    service.text2sql_cache.close()
@@ -0,0 +1,60 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import numpy as np
+
+from app.dataService.text2sqlCache import Text2SQLCache, SemanticText2SQLCache, normalize_utterance, \
+    value_mentions
+
+
+def test_normalize_folds_function_words_only():
+    assert normalize_utterance("How many  singers are from France?") == "how many singers are from France"
+    assert normalize_utterance("how many singers are from france") == "how many singers are from france"
+    assert normalize_utterance("What is the name of 'Joe Sharp' ?") == "what is the name of 'Joe Sharp'"
+
+
+def test_values_differing_in_case_do_not_share_an_entry(tmp_path):
+    cache = Text2SQLCache(path=str(tmp_path / "cache.sqlite"), version="test")
+    cache.put("singer", "Show singers from France.", "SELECT name FROM singer WHERE country = 'France'")
+    assert cache.get("singer", "show singers from France") == "SELECT name FROM singer WHERE country = 'France'"
+    assert cache.get("singer", "show singers from france") is None
+    cache.close()
+
+
+def test_entries_of_older_key_formats_are_ignored(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = Text2SQLCache(path=path, version="test")
+    # written by a build that lower-cased the whole utterance
+    cache._db.execute("INSERT INTO text2sql VALUES (?, ?, ?, ?)",
+                      ("singer", "show singers from france", "test", '"SELECT 1"'))
+    cache._db.commit()
+    assert cache.get("singer", "show singers from france") is None
+    cache.close()
+
+
+class WordEncoder(object):
+    """case-insensitive bag of words: utterances differing only in case embed identically"""
+
+    def __init__(self):
+        self.vocab = {}
+
+    def encode(self, texts):
+        emb = np.zeros((len(texts), 64))
+        for i, text in enumerate(texts):
+            for w in text.lower().replace("?", " ").split():
+                emb[i, self.vocab.setdefault(w, len(self.vocab))] = 1.0
+        return emb
+
+
+def test_semantic_guard_compares_values_with_case():
+    cache = SemanticText2SQLCache(WordEncoder(), threshold=0.99, db_thresholds={})
+    sql = "SELECT name FROM singer WHERE country = 'France'"
+    cache.put("singer", "Show singers from France", sql)
+    assert cache.get("singer", "show singers from France?") == sql
+    assert cache.get("singer", "show singers from france") is None
+    assert cache.stats()["guard_rejects"] == 1
+
+
+def test_value_mentions_keep_the_utterance_spelling():
+    assert value_mentions("singers from FRANCE or France", ["france", ""]) == ["FRANCE", "France"]
+    assert value_mentions("singers from Spain", ["France"]) == []
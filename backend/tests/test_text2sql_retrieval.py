@@ -0,0 +1,150 @@
+"""
+    cd backend && python -m pytest tests
+"""
+import os
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from app.dataService.schemaRegistry import SchemaRegistry
+from app.dataService.text2sqlRetrieval import RetrievalText2SQL
+
+
+def _has_punkt():
+    """`process_sql.tokenize` needs nltk's punkt tokenizer data (`nltk.download("punkt_tab")`)"""
+    from nltk import word_tokenize
+    try:
+        word_tokenize("SELECT 1")
+    except LookupError:
+        return False
+    return True
+
+
+pytestmark = pytest.mark.skipif(not _has_punkt(), reason="nltk punkt data is not installed")
+
+DATABASES = {
+    "concert": ("singer", ["singer id", "name", "country", "age"]),
+    "zoo": ("animal", ["animal id", "name", "country", "age"]),
+}
+REFS = [
+    {"db_id": "concert", "question": "How many singers are there?", "query": "SELECT count(*) FROM singer"},
+    {"db_id": "concert", "question": "What are the names of singers from France?",
+     "query": "SELECT name FROM singer WHERE country = \"France\""},
+]
+
+
+class WordEncoder(object):
+    """bag of words; records what it was asked to encode"""
+
+    def __init__(self, vocab=None):
+        self.vocab = {} if vocab is None else vocab
+        self.seen = []
+
+    def encode(self, texts):
+        self.seen.extend(texts)
+        emb = np.zeros((len(texts), 64))
+        for i, text in enumerate(texts):
+            for w in text.lower().replace("?", " ").split():
+                emb[i, self.vocab.setdefault(w, len(self.vocab))] = 1.0
+        return emb
+
+
+@pytest.fixture
+def spider(tmp_path):
+    """a two-database spider folder: tables.json, train_spider.json and the sqlite databases"""
+    tables = []
+    for db_id, (table, cols) in DATABASES.items():
+        tables.append({
+            "db_id": db_id,
+            "table_names": [table], "table_names_original": [table],
+            "column_names": [[-1, "*"]] + [[0, c] for c in cols],
+            "column_names_original": [[-1, "*"]] + [[0, c.replace(" ", "_")] for c in cols],
+            "column_types": ["text", "number", "text", "text", "number"],
+            "primary_keys": [1], "foreign_keys": [],
+        })
+        os.makedirs(str(tmp_path / "database" / db_id))
+        con = sqlite3.connect(str(tmp_path / "database" / db_id / (db_id + ".sqlite")))
+        con.execute("CREATE TABLE {} ({} int, name text, country text, age int)".format(
+            table, cols[0].replace(" ", "_")))
+        con.commit()
+        con.close()
+    with open(str(tmp_path / "tables.json"), "w") as f:
+        json.dump(tables, f)
+    with open(str(tmp_path / "train_spider.json"), "w") as f:
+        json.dump(REFS, f)
+    return tmp_path
+
+
+def make_retrieval(spider, threshold=0.85, encoder=None, store=None):
+    registry = SchemaRegistry(tables_path=str(spider / "tables.json"), use_snapshot=False)
+    return RetrievalText2SQL(encoder or WordEncoder(), schema_registry=registry, threshold=threshold,
+                             ref_path=str(spider / "train_spider.json"),
+                             database_folder=str(spider / "database"), store=store)
+
+
+def test_confident_candidate_is_retargeted(spider):
+    retrieval = make_retrieval(spider)
+    assert retrieval.predict("How many animals are there?", "zoo") == "SELECT count(*) FROM animal"
+    assert retrieval.predict("What are the names of animals from Kenya?", "zoo") == \
+        "SELECT name FROM animal WHERE country = 'Kenya'"
+    assert retrieval.stats == {"lookups": 2, "answered": 2}
+
+
+def test_threshold_separates_hits_from_misses(spider):
+    question = "How many animals are there in the zoo?"
+    conf, sql = make_retrieval(spider).best(question, "zoo")
+    assert sql == "SELECT count(*) FROM animal" and 0.0 < conf < 1.0
+    assert make_retrieval(spider, threshold=conf).predict(question, "zoo") == sql
+    missed = make_retrieval(spider, threshold=conf + 1e-6)
+    assert missed.predict(question, "zoo") is None
+    assert missed.stats == {"lookups": 1, "answered": 0}
+
+
+def test_invalid_candidates_are_not_returned(spider):
+    os.remove(str(spider / "database" / "zoo" / "zoo.sqlite"))
+    retrieval = make_retrieval(spider, threshold=0.0)
+    assert retrieval.best("How many animals are there?", "zoo") == (0.0, None)
+    assert retrieval.predict("How many animals are there?", "zoo") is None
+
+
+def test_questions_are_not_encoded_by_the_store(spider):
+    vocab = {}
+    encoder, store = WordEncoder(vocab), WordEncoder(vocab)
+    retrieval = make_retrieval(spider, encoder=encoder, store=store)
+    retrieval.predict("How many animals are there?", "zoo")
+    assert encoder.seen == ["how many item are there ?"]
+    assert "how many item are there ?" in store.seen  # the reference question's template
+    assert not any("animals" in text for text in store.seen)
+
+
+def test_dataservice_falls_through_to_smbop(spider, tmp_path, set_gv):
+    pytest.importorskip("allennlp")  # dataService imports the SmBop parser
+    from app.dataService.dataService import DataService
+    from app.dataService.modelRegistry import ModelRegistry
+    from app.dataService.text2sqlCache import Text2SQLCache
+
+    class SmBop(object):
+        def __init__(self):
+            self.questions = []
+
+        def predict(self, q, db_id):
+            self.questions.append(q)
+            return "SELECT name FROM animal"
+
+    smbop = SmBop()
+    set_gv("TEXT2SQL_RETRIEVAL", True)
+    set_gv("TEXT2SQL_SEMANTIC_CACHE", False)
+    service = DataService.__new__(DataService)
+    service.models = ModelRegistry()
+    service.models.register("text2sql", lambda: smbop)
+    service.text2sql_cache = Text2SQLCache(path=str(tmp_path / "cache.sqlite"), version="test")
+    service.semantic_cache = None
+    service.text2sql_retrieval = make_retrieval(spider)
+
+    assert service.text2sql("How many animals are there?", "zoo") == "SELECT count(*) FROM animal"
+    assert smbop.questions == []
+    assert service.text2sql("List the animal names.", "zoo") == "SELECT name FROM animal"
+    assert smbop.questions == ["List the animal names."]
+    service.text2sql_cache.close()